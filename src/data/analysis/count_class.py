@@ -1,9 +1,17 @@
-from datasets import load_dataset
+import argparse
 from collections import Counter
 from tqdm import tqdm
 
-dataset_name = "daominhwysi/toanmath.com_25k"
-dataset = load_dataset(dataset_name)
+from src.data.scripts.parquet_stream import open_examples
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset", type=str, default="daominhwysi/toanmath.com_25k")
+parser.add_argument("--parquet-dir", type=str, default=None, help="Read a local parquet copy instead of the hub")
+parser.add_argument("--no-streaming", action="store_true", help="Download the full dataset with load_dataset first")
+args = parser.parse_args()
+
+dataset = open_examples(args.dataset, parquet_dir=args.parquet_dir, streaming=not args.no_streaming,
+                        columns=['label_raw'], decode_images=False)
 
 id2label = {0: 'abstract',
  1: 'algorithm',
@@ -38,7 +46,7 @@ class_counts = Counter()
 print("Counting class distributions...")
 
 # Iterate through the training set
-for example in tqdm(dataset['train']):
+for example in tqdm(dataset):
     raw_labels = example['label_raw'].strip()
     if not raw_labels:
         continue
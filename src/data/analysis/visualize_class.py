@@ -2,9 +2,19 @@ import os
 from tqdm import tqdm
 from PIL import Image, ImageDraw
 from collections import Counter
-from datasets import load_dataset
-dataset_name = "daominhwysi/toanmath.com_25k"
-dataset = load_dataset(dataset_name)
+import argparse
+from src.data.scripts.parquet_stream import open_examples
+from src.data.scripts.page_cache import add_page_cache_args, page_cache_from_args
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset", type=str, default="daominhwysi/toanmath.com_25k")
+parser.add_argument("--parquet-dir", type=str, default=None, help="Read a local parquet copy instead of the hub")
+parser.add_argument("--no-streaming", action="store_true", help="Download the full dataset with load_dataset first")
+add_page_cache_args(parser)
+args = parser.parse_args()
+
+dataset = open_examples(args.dataset, parquet_dir=args.parquet_dir, streaming=not args.no_streaming,
+                        columns=['image', 'label_raw'], page_cache=page_cache_from_args(args))
 
 id2label = {0: 'abstract',
  1: 'algorithm',
@@ -42,7 +52,7 @@ saved_counts = Counter()
 print("Starting visualization process...")
 
 # 2. Iterate through the dataset once
-for idx, example in enumerate(tqdm(dataset['train'])):
+for idx, example in enumerate(tqdm(dataset)):
     img = example['image']
     W, H = img.size
     raw_labels = example['label_raw'].strip()
@@ -0,0 +1,52 @@
+import sys
+import runpy
+
+# Subcommand -> (module run as __main__, one-line description).
+# Modules are only imported when their subcommand runs, so `--help` and
+# dispatch stay fast no matter how heavy a script's dependencies are.
+COMMANDS = {
+    "hash": ("src.data.scripts.generate_embeddings", "Compute pHashes of a local image dir or a HF parquet repo"),
+    "select": ("src.data.scripts.select_samples_by_hash", "Select diverse samples by pHash and extract them"),
+    "convert": ("src.data.scripts.convert_images", "Convert a parquet dataset to image files"),
+    "merge": ("src.data.scripts.merge_shards", "Merge and verify the outputs of sharded multi-machine runs"),
+    "extract-roi": ("src.data.scripts.extract_roi", "Crop labelled regions of interest from the dataset"),
+    "layout": ("src.data.scripts.analyze_layout_dataset", "Run layout detection over a page directory"),
+    "layout-check": ("src.data.scripts.layout_backend_check", "Parity check and benchmark of layout backends"),
+    "label": ("src.data.labelling.processor", "Label dataset pages with Gemini"),
+    "fused": ("src.data.labelling.fused_pipeline", "Layout detection -> draw boxes -> Gemini labelling in one pass"),
+    "count-classes": ("src.data.analysis.count_class", "Count layout classes in label_raw"),
+    "visualize-classes": ("src.data.analysis.visualize_class", "Draw layout classes on sample pages"),
+    "pipeline": ("src.data.scripts.pipeline_runner", "Re-run only the pipeline stages whose inputs, params or code changed"),
+    "page-cache": ("src.data.scripts.page_cache", "Inspect or trim the shared decoded-page cache"),
+    "bench": ("src.data.scripts.benchmark_suite", "Benchmark the pipeline hot paths on synthetic data"),
+    "bench-hash-decode": ("src.data.scripts.benchmark_hash_decode", "Benchmark reduced-resolution decoding for pHash"),
+    "import-time": ("src.data.scripts.benchmark_import_time", "Measure cold import time of the pipeline modules"),
+}
+
+def print_usage(out=sys.stdout):
+    width = max(map(len, COMMANDS))
+    print("usage: python -m src.data.cli <command> [args...]\n", file=out)
+    print("commands:", file=out)
+    for name, (_, description) in COMMANDS.items():
+        print(f"  {name:<{width}}  {description}", file=out)
+    print("\nRun `python -m src.data.cli <command> --help` for a command's options.", file=out)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print_usage()
+        return 0
+    name = argv[0]
+    if name not in COMMANDS:
+        print(f"Unknown command: {name}\n", file=sys.stderr)
+        print_usage(sys.stderr)
+        return 2
+    module = COMMANDS[name][0]
+    # The script sees its own argv, as if started with `python -m <module>`.
+    # alter_sys also installs it as __main__, which spawned worker processes re-import.
+    sys.argv = [f"{sys.argv[0]} {name}"] + argv[1:]
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
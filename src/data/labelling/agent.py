@@ -1,11 +1,16 @@
 import os
+import time
 import asyncio
+import logging
 from typing import Union, List
 from google import genai
 from google.genai import types, errors
 from dotenv import load_dotenv
+from src.data.scripts.stage_metrics import metrics
+from src.data.labelling.usage import usage_tracker, usage_from_response
 
 # Set up logging
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
@@ -29,28 +34,45 @@ async def GeminiAgent(
     contents: Union[types.ContentListUnion, types.ContentListUnionDict],
     config: types.GenerateContentConfigOrDict,
     retry_delay: float = 1.0,
-    max_retries: int = 5 # Adjusted based on needs
+    max_retries: int = 5, # Adjusted based on needs
+    call_stats: dict = None
 ):
+    """
+    Calls the model with key rotation and retries.
+    If call_stats is given, it is filled with the number of attempts and the
+    index of the key that answered (for usage accounting).
+    """
     delay = retry_delay
     retry_count = 0
+    if call_stats is None:
+        call_stats = {}
+    call_stats["attempts"] = 0
 
     while True:
         # Lấy key LRU
         api_key = await get_lru_api_key()
         client = genai.Client(api_key=api_key)
+        call_stats["attempts"] += 1
+        call_stats["key"] = f"key{_api_keys.index(api_key)}"
 
         try:
-            response = await client.aio.models.generate_content(
-                model=model,
-                contents=contents,
-                config=config
-            )
+            start = time.perf_counter()
+            try:
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=config
+                )
+            finally:
+                metrics.observe("gemini.request_seconds", time.perf_counter() - start)
+            metrics.inc("gemini.requests")
 
             if not response.text or not response.text.strip():
                 # Some safety checks for response validity
                 if hasattr(response, 'candidates') and response.candidates:
                     finish_reason = response.candidates[0].finish_reason
-                    print(f"[GeminiAgent] Empty response text. Finish reason: {finish_reason}")
+                    logger.warning("[GeminiAgent] Empty response text. Finish reason: %s", finish_reason)
+                metrics.inc("gemini.empty_responses")
                 raise ValueError("GeminiAgent: response.text is không hợp lệ")
 
             return response
@@ -58,17 +80,20 @@ async def GeminiAgent(
         except errors.APIError as e:
             code = e.code
             msg = e.message or ""
-            print(f"[GeminiAgent] APIError (Code {code}): {msg}")
+            logger.warning("[GeminiAgent] APIError (Code %s): %s", code, msg)
+            metrics.inc("gemini.api_errors", code=str(code))
 
             if code == 429:
                 # Chỉ cần log và loop tiếp để lấy key khác
-                print(f"[GeminiAgent] Key `{api_key[:8]}...` got rate-limited, rotating to next key.")
+                logger.info("[GeminiAgent] Key `%s...` got rate-limited, rotating to next key.", api_key[:8])
+                metrics.inc("gemini.rate_limited")
                 # reset delay cho lần dùng key mới
                 delay = retry_delay
                 continue
 
             if str(code).startswith("5"):
-                print(f"[GeminiAgent] Server error {code}, waiting {delay:.1f}s then retrying...")
+                logger.info("[GeminiAgent] Server error %s, waiting %.1fs then retrying...", code, delay)
+                metrics.inc("gemini.retries")
                 await asyncio.sleep(delay)
                 delay = min(delay * 1.5, 60)
                 continue
@@ -76,17 +101,31 @@ async def GeminiAgent(
             # Các lỗi 4xx khác – retry tối đa
             retry_count += 1
             if retry_count > max_retries:
-                print(f"[GeminiAgent] Client error {code} exceeded {max_retries} retries, stopping.")
+                logger.error("[GeminiAgent] Client error %s exceeded %d retries, stopping.", code, max_retries)
+                metrics.inc("gemini.failed")
                 raise
-            print(f"[GeminiAgent] Client error {code}, retrying {retry_count}/{max_retries} after {delay:.1f}s...")
+            logger.info("[GeminiAgent] Client error %s, retrying %d/%d after %.1fs...", code, retry_count, max_retries, delay)
+            metrics.inc("gemini.retries")
             await asyncio.sleep(delay)
             delay = min(delay * 1.5, 60)
 
         except Exception as e:
-            print(f"[GeminiAgent] Unknown error: {type(e).__name__} – {e}")
+            logger.error("[GeminiAgent] Unknown error: %s – %s", type(e).__name__, e)
+            metrics.inc("gemini.failed")
             raise
 
 async def generate(image_bytes: bytes, prompt: str = "Please describe this image in detail."):
+    text, _ = await generate_with_usage(image_bytes, prompt=prompt)
+    return text
+
+async def generate_with_usage(image_bytes: bytes, prompt: str = "Please describe this image in detail.",
+                              prompt_type: str = "other", media_resolution: str = "MEDIA_RESOLUTION_HIGH",
+                              thinking_level: str = "MINIMAL", route: str = None):
+    """
+    Like generate(), but also returns the usage entry of the call: token counts
+    from usage_metadata, retries, latency and key. The entry is also recorded
+    in usage_tracker under prompt_type and route (see routing.Router).
+    """
     # Note: Ensure this model name is available in your region/project
     model = "gemini-3-flash-preview" # experiment version verified, do not change
 
@@ -105,17 +144,24 @@ async def generate(image_bytes: bytes, prompt: str = "Please describe this image
 
     generate_content_config = types.GenerateContentConfig(
         thinking_config=types.ThinkingConfig(
-            thinking_level="MINIMAL",
+            thinking_level=thinking_level,
         ),
-        media_resolution="MEDIA_RESOLUTION_HIGH",
+        media_resolution=media_resolution,
     )
 
+    call_stats = {}
+    start = time.perf_counter()
     response = await GeminiAgent(
         model=model,
         contents=contents,
-        config=generate_content_config
+        config=generate_content_config,
+        call_stats=call_stats
     )
-    return response.text
+    usage = usage_tracker.record(
+        model, prompt_type, call_stats.get("key"), usage_from_response(response),
+        latency=time.perf_counter() - start, retries=call_stats["attempts"] - 1, route=route,
+    )
+    return response.text, usage
 
 if __name__ == "__main__":
     # Ensure you have an image.jpg or change this path
@@ -0,0 +1,190 @@
+import os
+import json
+import numpy as np
+from src.data.scripts.batch_phash import phash_image, hashes_to_hex
+from src.data.scripts.hamming_index import MultiIndexHash, hamming_distance
+from src.data.scripts.stage_metrics import metrics
+from src.data.labelling.usage import PRICING, request_cost
+
+POLICIES = ["off", "flag", "reuse"]
+# Hashes added since the last MultiIndexHash build are scanned linearly
+REBUILD_EVERY = 1024
+
+class LabelledPage:
+    """
+    A page in the reuse index. Its labelling result is in memory (record), at a
+    byte offset of the JSONL output, or pending (future) while its request is
+    in flight. A page whose labelling failed stays in the index as failed and
+    is never matched again.
+    """
+
+    def __init__(self, name, num_tags, record=None, offset=None, future=None):
+        self.name = name
+        self.num_tags = num_tags
+        self.record = record
+        self.offset = offset
+        self.future = future
+        self.failed = False
+
+class LabelIndex:
+    """
+    Growing pHash index of labelled pages. Lookups use a MultiIndexHash over
+    the pages seen so far, rebuilt every REBUILD_EVERY additions, plus a
+    linear scan of the newest hashes.
+    """
+
+    def __init__(self, max_distance=2):
+        self.max_distance = max_distance
+        self.hashes = []
+        self.pages = []
+        self._index = None
+        self._indexed = 0
+
+    def __len__(self):
+        return len(self.pages)
+
+    def add(self, h, page):
+        self.hashes.append(np.uint64(h))
+        self.pages.append(page)
+        if len(self.hashes) - self._indexed >= REBUILD_EVERY:
+            self._index = MultiIndexHash(np.array(self.hashes, dtype=np.uint64), self.max_distance)
+            self._indexed = len(self.hashes)
+
+    def nearest(self, h, accept=None):
+        """Closest page within max_distance (that accept(page) allows), as (page, distance), or (None, None)."""
+        candidates = []
+        if self._index is not None:
+            ids, distances = self._index.query(h)
+            candidates.extend(zip(ids.tolist(), distances.tolist()))
+        if len(self.hashes) > self._indexed:
+            recent = np.array(self.hashes[self._indexed:], dtype=np.uint64)
+            distances = hamming_distance(recent, h)
+            for i in np.flatnonzero(distances <= self.max_distance):
+                candidates.append((self._indexed + int(i), int(distances[i])))
+        for i, distance in sorted(candidates, key=lambda c: (c[1], c[0])):
+            if accept is None or accept(self.pages[i]):
+                return self.pages[i], distance
+        return None, None
+
+class Deduplicator:
+    """
+    Near-duplicate check before a page is sent to Gemini. Each page's pHash is
+    looked up among the pages labelled so far (and in earlier runs); a match
+    within `radius` bits with the same number of drawn figure tags is:
+    - policy "flag": still labelled, and the output records the match
+    - policy "reuse": not sent; the matched page's result is copied
+    Counts the API calls, tokens and estimated cost avoided, priced like the
+    usage report (price_input/price_output override PRICING, USD per 1M tokens).
+    """
+
+    def __init__(self, policy="reuse", radius=2, price_input=None, price_output=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy}, expected one of {POLICIES}")
+        self.policy = policy
+        self.radius = radius
+        self.price_input = price_input
+        self.price_output = price_output
+        self.index = LabelIndex(radius)
+        self.output_path = None
+        self.stats = {"pages": 0, "unique": 0, "flagged": 0, "reused": 0,
+                      "tokens_avoided": 0, "cost_avoided_usd": 0.0}
+
+    @property
+    def enabled(self):
+        return self.policy != "off"
+
+    def load(self, output_path):
+        """Indexes the pages of an existing JSONL output that carry a phash, so reuse spans runs."""
+        self.output_path = output_path
+        if not self.enabled or not os.path.exists(output_path):
+            return 0
+        with open(output_path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if "phash" in record and "reused_from" not in record:
+                        page = LabelledPage(record["name"], len(record.get("tags") or {}), offset=offset)
+                        self.index.add(int(record["phash"], 16), page)
+                except (json.JSONDecodeError, KeyError, ValueError):
+                    pass
+                offset += len(line)
+        return len(self.index)
+
+    def match(self, h, num_tags):
+        """(page, distance) of the nearest labelled page this page may reuse or be flagged against."""
+        self.stats["pages"] += 1
+        if not self.enabled:
+            return None, None
+        page, distance = self.index.nearest(h, accept=lambda p: not p.failed and p.num_tags == num_tags)
+        if page is None:
+            self.stats["unique"] += 1
+            metrics.inc("dedup.unique")
+        elif self.policy == "flag":
+            self.stats["flagged"] += 1
+            metrics.inc("dedup.flagged")
+        return page, distance
+
+    def add(self, h, page):
+        if self.enabled:
+            self.index.add(h, page)
+        return page
+
+    def mark_failed(self, page):
+        """Takes a page whose labelling failed out of matching; pending duplicates get None."""
+        page.failed = True
+        if page.future is not None:
+            page.future.set_result(None)
+            page.future = None
+
+    async def source_record(self, page):
+        """The labelling result of an indexed page, waiting for it if still in flight (None if it failed)."""
+        if page.failed:
+            return None
+        if page.future is not None:
+            return await page.future
+        if page.record is not None:
+            return page.record
+        with open(self.output_path, "rb") as f:
+            f.seek(page.offset)
+            return json.loads(f.readline())
+
+    def record_reuse(self, source):
+        """Counts one avoided request, priced like the source page's request."""
+        usage = source.get("usage") or {}
+        self.stats["reused"] += 1
+        self.stats["tokens_avoided"] += usage.get("input", 0) + usage.get("output", 0) + usage.get("thinking", 0)
+        p_in, p_out = PRICING.get(usage.get("model"), (0.0, 0.0))
+        self.stats["cost_avoided_usd"] += request_cost(
+            usage, self.price_input if self.price_input is not None else p_in,
+            self.price_output if self.price_output is not None else p_out)
+        metrics.inc("dedup.reused")
+
+    def print_report(self):
+        if not self.enabled or not self.stats["pages"]:
+            return self.stats
+        s = self.stats
+        print("\n" + "=" * 60)
+        print(f"Near-duplicate check (policy={self.policy}, radius={self.radius})")
+        print(f"  pages checked:      {s['pages']}")
+        print(f"  unique:             {s['unique']}")
+        print(f"  flagged:            {s['flagged']}")
+        print(f"  API calls avoided:  {s['reused']} ({s['reused'] / s['pages'] * 100:.1f}%)")
+        print(f"  tokens avoided:     {s['tokens_avoided']}")
+        print(f"  est. cost avoided:  ${s['cost_avoided_usd']:.4f}")
+        print("=" * 60)
+        return s
+
+def page_phash(img):
+    """pHash of a decoded page (PIL image) as (uint64, 16-char hex)."""
+    h = phash_image(img)
+    return h, hashes_to_hex([h])[0]
+
+def add_dedup_args(parser):
+    parser.add_argument("--dedup", choices=POLICIES, default="off",
+                        help="Near-duplicate pages: flag them, or reuse the matched page's result instead of calling the API")
+    parser.add_argument("--dedup-radius", type=int, default=2, help="Max pHash Hamming distance of a near duplicate")
+
+def dedup_from_args(args):
+    """Deduplicator priced with the same --price-input/--price-output as the usage report."""
+    return Deduplicator(args.dedup, args.dedup_radius, args.price_input, args.price_output)
@@ -7,6 +7,7 @@ import concurrent.futures
 from functools import lru_cache
 import os
 from collections import OrderedDict
+from src.data.scripts.stage_metrics import metrics
 # Load model
 
 # --------- CACHE CHO COLORS VÀ CONSTANTS ----------
@@ -60,7 +61,8 @@ def draw_boxes(
 ):
     if boxes is None or len(boxes) == 0:
         return img.copy(), {}
-    print(f"Recieving {len(boxes)} boxes while drawing")
+    metrics.inc("draw_boxes.calls")
+    metrics.inc("draw_boxes.boxes", len(boxes))
     h_img, w_img = img.shape[:2]
     box_thickness = max(1, int(base_box_thickness * min(w_img, h_img) / 1000))
     out = img.copy()
@@ -0,0 +1,274 @@
+import os
+import json
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+import numpy as np
+import cv2
+from PIL import Image
+from tqdm import tqdm
+from src.data.labelling.processor import yolo_to_pixel_boxes, build_request, label_image, normalize_tag_bboxes
+from src.data.scripts.layout_loader import PrefetchLoader, target_size_for
+from src.data.scripts.layout_backends import load_layout_detector, BACKENDS, DEFAULT_ONNX_PATH
+from src.data.scripts.layout_manifest import LayoutManifest, reverse_label_map, detections_to_yolo
+from src.data.labelling.usage import usage_tracker, add_usage_args
+from src.data.labelling.routing import Router, add_routing_args, router_from_args
+from src.data.labelling.dedup import Deduplicator, LabelledPage, page_phash, add_dedup_args, dedup_from_args
+from src.data.scripts.stage_metrics import metrics, add_metrics_args, configure_from_args
+from src.data.scripts.page_cache import add_page_cache_args, page_cache_from_args
+from src.data.scripts.sharding import select_shard, sharded_path, add_shard_args, check_shard_args
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".webp"]
+
+def detect_pages(layout_detector, images, size_cfg):
+    """
+    Runs layout detection on model-size copies of already decoded full-resolution pages.
+    Returns ([(width, height) the detector saw], results).
+    """
+    resized = []
+    for img in images:
+        target = target_size_for(img.size, size_cfg)
+        resized.append(img.resize(target, Image.Resampling.BILINEAR) if target and target != img.size else img)
+    results = layout_detector(resized, batch_size=len(resized))
+    return [r.size for r in resized], results
+
+def prepare_page(img, det_size, img_results, label2id):
+    """
+    Maps one page's detections to YOLO boxes and builds its request (colour
+    conversion, box drawing) on the full-resolution page. CPU-bound: the
+    pipeline runs it in a worker thread so in-flight requests keep going.
+    Returns (yolo boxes, labels, sample_boxes, target_img, prompt, prompt_type, tag_to_bbox).
+    """
+    W, H = img.size
+    boxes = detections_to_yolo(img_results, det_size[0], det_size[1], label2id)
+    labels = [(label_id, x_c, y_c, w_n, h_n) for label_id, _, x_c, y_c, w_n, h_n in boxes]
+    sample_boxes = yolo_to_pixel_boxes(labels, W, H)
+    img_cv2 = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+    target_img, prompt, prompt_type, _, tag_to_bbox = build_request(img_cv2, sample_boxes)
+    return boxes, labels, sample_boxes, target_img, prompt, prompt_type, tag_to_bbox
+
+def load_done_names(output_path):
+    """Names of pages already in the JSONL output, for resume."""
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["name"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return done
+
+async def run_fused_pipeline(image_files, output_path, layout_detector, batch_size=8, num_workers=4,
+                             prefetch_batches=2, concurrency=8, manifest=None, drawn_dir=None, page_cache=None,
+                             router=None, dedup=None):
+    """
+    Layout detection -> class 3/14 filter -> draw_boxes -> Gemini, in one process.
+    Each page is decoded once. Detection runs on a resized copy and its boxes are
+    mapped back to the full page, which goes to draw_boxes as a NumPy array.
+    The only encode left is the JPEG payload for the API. Up to `concurrency`
+    requests are in flight while the next batches are decoded and detected.
+    Results are appended to output_path as JSON lines.
+    With page_cache, decoded pages are shared with other stages and runs.
+    router (routing.Router) picks resolution, thinking level and prompt per page
+    from its detections (None: the default route for every page). dedup (dedup.Deduplicator) flags near-duplicate pages
+    or reuses their earlier result instead of calling the API; every record
+    stores its pHash so later runs can match against it.
+    """
+    router = router or Router(enabled=False)
+    dedup = dedup or Deduplicator("off")
+    if dedup.load(output_path):
+        print(f"Near-duplicate index: {len(dedup.index)} labelled pages.")
+    label2id = reverse_label_map(layout_detector.model.config.id2label)
+    size_cfg = getattr(layout_detector.image_processor, "size", None)
+    batches = [image_files[i : i + batch_size] for i in range(0, len(image_files), batch_size)]
+    # Full-resolution decode: the page is reused for drawing and the payload
+    loader = iter(PrefetchLoader(batches, size_cfg=None, num_workers=num_workers, prefetch_batches=prefetch_batches,
+                                 page_cache=page_cache))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    failed = 0
+
+    with open(output_path, "a", encoding="utf-8") as out, tqdm(total=len(image_files), desc="Labelling") as pbar:
+
+        def write_record(record, page=None):
+            offset = out.tell()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if page is not None:
+                # Later duplicates read the result back from the file
+                page.future.set_result(record)
+                page.future, page.offset = None, offset
+
+        async def label_page(record, target_img, prompt, prompt_type, tag_to_bbox, route, page=None):
+            nonlocal failed
+            name, W, H = record["name"], record["width"], record["height"]
+            try:
+                thinking, final_ocr_text, usage = await label_image(target_img, prompt, prompt_type, tag_to_bbox, W, H,
+                                                                    route=route)
+            except Exception as e:
+                print(f"Error labelling {name}: {e}")
+                metrics.inc("fused.failed", stage="label")
+                failed += 1
+                if page is not None:
+                    dedup.mark_failed(page)
+                return
+            finally:
+                semaphore.release()
+                pbar.update(1)
+
+            if drawn_dir and tag_to_bbox:
+                cv2.imwrite(os.path.join(drawn_dir, f"{Path(name).stem}.png"), target_img)
+            write_record({**record, "thinking": thinking, "ocr_results": final_ocr_text, "usage": usage}, page)
+
+        async def reuse_page(record, source_page, distance, target_img, prompt, prompt_type, tag_to_bbox, route):
+            source = await dedup.source_record(source_page)
+            if source is None:
+                # The matched page failed: label this one after all
+                await semaphore.acquire()
+                await label_page(record, target_img, prompt, prompt_type, tag_to_bbox, route)
+                return
+            dedup.record_reuse(source)
+            pbar.update(1)
+            write_record({**record, "thinking": source.get("thinking"), "ocr_results": source.get("ocr_results"),
+                          "usage": None, "reused_from": source_page.name, "duplicate_distance": distance})
+
+        try:
+            while True:
+                with metrics.stage("fused.wait_decode", profile=False):
+                    batch = await asyncio.to_thread(next, loader, None)
+                if batch is None:
+                    break
+                for p, e in batch.errors:
+                    print(f"Error opening {p}: {e}")
+                    metrics.inc("fused.failed", stage="decode")
+                    pbar.update(1)
+                    failed += 1
+                if not batch.images:
+                    continue
+
+                try:
+                    with metrics.stage("fused.detect", profile=False):
+                        det_sizes, results = await asyncio.to_thread(detect_pages, layout_detector, batch.images, size_cfg)
+                except Exception as e:
+                    print(f"Error during detection: {e}")
+                    metrics.inc("fused.failed", len(batch.images), stage="detect")
+                    pbar.update(len(batch.images))
+                    failed += len(batch.images)
+                    continue
+
+                with metrics.stage("fused.phash", profile=False):
+                    hashes = await asyncio.to_thread(lambda images: [page_phash(img) for img in images], batch.images)
+
+                with metrics.stage("fused.prepare", profile=False):
+                    prepared = await asyncio.to_thread(
+                        lambda: [prepare_page(img, det_size, img_results, label2id)
+                                 for img, det_size, img_results in zip(batch.images, det_sizes, results)])
+
+                rows = []
+                for path, img, (h, phash_hex), page_request in zip(batch.paths, batch.images, hashes, prepared):
+                    W, H = img.size
+                    boxes, labels, sample_boxes, target_img, prompt, prompt_type, tag_to_bbox = page_request
+                    rows.append((path.name, W, H, boxes))
+                    route, features = router.route(labels)
+                    record = {
+                        "name": path.name,
+                        "width": W,
+                        "height": H,
+                        "phash": phash_hex,
+                        "objects": sample_boxes,
+                        "tags": normalize_tag_bboxes(tag_to_bbox, W, H),
+                        "route": route["name"],
+                        "features": features,
+                    }
+
+                    source_page, distance = dedup.match(h, len(tag_to_bbox))
+                    if source_page is not None and dedup.policy == "reuse":
+                        task = asyncio.create_task(reuse_page(record, source_page, distance, target_img, prompt,
+                                                              prompt_type, tag_to_bbox, route))
+                    else:
+                        if source_page is not None:
+                            record.update(duplicate_of=source_page.name, duplicate_distance=distance)
+                        page = None
+                        if dedup.enabled:
+                            page = dedup.add(h, LabelledPage(path.name, len(tag_to_bbox),
+                                                             future=asyncio.get_running_loop().create_future()))
+                        # Backpressure: decode/detect no further ahead than the API can take
+                        with metrics.stage("fused.wait_api_slot", profile=False):
+                            await semaphore.acquire()
+                        task = asyncio.create_task(label_page(record, target_img, prompt, prompt_type, tag_to_bbox, route, page))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                if manifest is not None:
+                    manifest.append(rows)
+        finally:
+            loader.close()
+            await asyncio.gather(*tasks)
+
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Fused layout detection -> draw_boxes -> Gemini labelling")
+    parser.add_argument("--image-dir", type=str, default="data/selected_samples_25k/images")
+    parser.add_argument("--output", type=str, default="output_dev/fused_labels.jsonl", help="JSON lines output (resumable)")
+    parser.add_argument("--manifest", type=str, default=None, help="Also record the layout detections in this manifest")
+    parser.add_argument("--drawn-dir", type=str, default=None, help="Save pages with drawn boxes here")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--loader-workers", type=int, default=4)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8, help="Gemini requests in flight")
+    parser.add_argument("--backend", choices=BACKENDS, default="eager")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--onnx-path", type=str, default=DEFAULT_ONNX_PATH)
+    add_page_cache_args(parser)
+    add_routing_args(parser)
+    add_dedup_args(parser)
+    add_shard_args(parser, "image directory")
+    add_metrics_args(parser)
+    add_usage_args(parser)
+    args = parser.parse_args()
+    check_shard_args(args)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    configure_from_args(args)
+
+    # Every shard writes (and resumes from) its own output; merge_shards combines them
+    args.output = sharded_path(args.output, args.shard_index, args.num_shards)
+    done = load_done_names(args.output)
+    image_files = select_shard(sorted(p for p in Path(args.image_dir).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS),
+                               args.shard_index, args.num_shards, key=lambda p: p.name)
+    image_files = [p for p in image_files if p.name not in done]
+    if args.limit:
+        image_files = image_files[:args.limit]
+    if not image_files:
+        print("All images have already been processed.")
+        return
+    print(f"Found {len(image_files)} images to process ({len(done)} already done).")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    if args.drawn_dir:
+        os.makedirs(args.drawn_dir, exist_ok=True)
+    manifest = LayoutManifest(args.manifest) if args.manifest else None
+
+    layout_detector = load_layout_detector(args.backend, num_threads=args.threads, onnx_path=args.onnx_path)
+    dedup = dedup_from_args(args)
+    failed = asyncio.run(run_fused_pipeline(
+        image_files, args.output, layout_detector, batch_size=args.batch_size, num_workers=args.loader_workers,
+        prefetch_batches=args.prefetch, concurrency=args.concurrency, manifest=manifest, drawn_dir=args.drawn_dir,
+        page_cache=page_cache_from_args(args), router=router_from_args(args), dedup=dedup,
+    ))
+    if manifest is not None:
+        manifest.close()
+    print(f"\nDone. {len(image_files) - failed} pages labelled, {failed} failed.")
+    metrics.print_summary()
+    usage_tracker.print_report(args.price_input, args.price_output)
+    dedup.print_report()
+    if args.usage_report:
+        usage_tracker.save(args.usage_report, args.price_input, args.price_output)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 import asyncio
-from datasets import load_dataset
+import logging
+import argparse
+import functools
 from tqdm import tqdm
 import os
+import json
 import numpy as np
 import cv2
 from src.data.labelling.draw_boxes import draw_boxes
-from src.data.labelling.agent import generate
+from src.data.labelling.usage import usage_tracker, add_usage_args
+from src.data.labelling.routing import ROUTES, DEFAULT_ROUTE, add_routing_args, router_from_args
+from src.data.labelling.dedup import LabelledPage, page_phash, add_dedup_args, dedup_from_args
 from src.data.labelling.post_processor import extract_response, replace_tags_with_normalized_bboxes
+from src.data.scripts.parquet_stream import open_examples
+from src.data.scripts.page_cache import add_page_cache_args, page_cache_from_args
+from src.data.scripts.sharding import shard_of, row_key, sharded_path, add_shard_args, check_shard_args
+from src.data.scripts.stage_metrics import metrics, add_metrics_args, configure_from_args
 
 
 # Load prompts from files
@@ -17,50 +26,129 @@ def read_prompt(path):
 # Path relative to this script
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROMPT_DIR = os.path.join(SCRIPT_DIR, "prompt")
-figure_prompt_content = read_prompt(os.path.join(PROMPT_DIR, "figure.md"))
-text_prompt_content = read_prompt(os.path.join(PROMPT_DIR, "text.md"))
 
-async def process_dataset(dataset):
+@functools.lru_cache(maxsize=None)
+def load_prompt(name):
+    """Reads prompt/<name>.md once, on first use (the same string object afterwards)."""
+    return read_prompt(os.path.join(PROMPT_DIR, f"{name}.md"))
+
+TARGET_CLASSES = {3, 14}
+
+def parse_label_raw(raw_labels):
+    """Parses YOLO label text into (cls_id, x_c, y_c, w_n, h_n) tuples."""
+    labels = []
+    for line in raw_labels.strip().split('\n'):
+        parts = line.split()
+        if not parts:
+            continue
+        x_c, y_c, w_n, h_n = map(float, parts[1:5])
+        labels.append((int(parts[0]), x_c, y_c, w_n, h_n))
+    return labels
+
+def yolo_to_pixel_boxes(labels, W, H, target_classes=TARGET_CLASSES):
+    """Keeps the target classes and converts normalized YOLO boxes to pixel [x1, y1, x2, y2]."""
+    sample_boxes = []
+    for cls_id, x_c, y_c, w_n, h_n in labels:
+        if cls_id in target_classes:
+            x1 = (x_c - w_n / 2) * W
+            y1 = (y_c - h_n / 2) * H
+            x2 = (x_c + w_n / 2) * W
+            y2 = (y_c + h_n / 2) * H
+
+            sample_boxes.append({
+                'bbox': [x1, y1, x2, y2],
+                'cls_id': cls_id
+            })
+    return sample_boxes
+
+def build_request(img_cv2, sample_boxes):
     """
-    Iterates through each sample and parses YOLO boxes.
+    Decides which image and prompt to send: pages with objects get the boxes drawn
+    and the figure prompt, others go as is with the text prompt.
+    Returns (target_img, prompt, prompt_type, cropped_objects, tag_to_bbox).
+    """
+    if sample_boxes:
+        boxes_only = [obj['bbox'] for obj in sample_boxes]
+        with metrics.stage("labelling.draw_boxes"):
+            out_img, cropped_objects, tag_to_bbox = draw_boxes(img_cv2, boxes_only)
+        return out_img, load_prompt("figure"), "figure", cropped_objects, tag_to_bbox
+    return img_cv2, load_prompt("text"), "text", {}, {}
+
+def normalize_tag_bboxes(tag_to_bbox, W, H):
+    """Scales tag -> pixel bbox to the 0-1000 range used in the OCR output."""
+    tag_to_normalized_bbox = {}
+    for tag, bbox in tag_to_bbox.items():
+        x1, y1, x2, y2 = bbox
+        nx1 = int(round(x1 * 1000 / W))
+        ny1 = int(round(y1 * 1000 / H))
+        nx2 = int(round(x2 * 1000 / W))
+        ny2 = int(round(y2 * 1000 / H))
+        tag_to_normalized_bbox[tag] = [nx1, ny1, nx2, ny2]
+    return tag_to_normalized_bbox
+
+async def label_image(target_img, prompt, prompt_type, tag_to_bbox, W, H, route=None):
+    """
+    Sends the page to the agent and post-processes the answer.
+    prompt_type ("figure" or "text", from build_request) is the usage bucket.
+    route (from routing.Router) sets the media resolution, thinking level and,
+    for pages without drawn boxes, optionally the prompt; None keeps the defaults.
+    Returns (thinking, final_ocr_text, usage) where usage holds the call's tokens, retries and latency.
+    """
+    # Deferred: google-genai is only needed once a request is actually sent
+    from src.data.labelling.agent import generate_with_usage
+
+    # Call the agent on the full image
+    # The JPEG encode of a full page is CPU-bound: keep it off the event loop
+    with metrics.stage("labelling.encode", profile=False):
+        image_bytes = await asyncio.to_thread(lambda: cv2.imencode('.jpg', target_img)[1].tobytes())
+
+    route = route or {"name": DEFAULT_ROUTE, **ROUTES[DEFAULT_ROUTE]}
+    if route.get("prompt") and not tag_to_bbox:
+        prompt, prompt_type = load_prompt(route["prompt"]), route["prompt"]
+
+    with metrics.stage("labelling.generate", profile=False, route=route["name"]):
+        raw_response, usage = await generate_with_usage(
+            image_bytes, prompt=prompt, prompt_type=prompt_type, media_resolution=route["media_resolution"],
+            thinking_level=route["thinking_level"], route=route["name"],
+        )
+
+    with metrics.stage("labelling.postprocess"):
+        extracted = extract_response(raw_response)
+        thinking = extracted.thinking_block
+        ocr_text = extracted.document or raw_response
+
+        # Normalize tag_to_bbox for replacement
+        tag_to_normalized_bbox = normalize_tag_bboxes(tag_to_bbox, W, H)
+        final_ocr_text = replace_tags_with_normalized_bboxes(ocr_text, tag_to_normalized_bbox)
+    metrics.inc("labelling.pages")
+    return thinking, final_ocr_text, usage
+
+async def process_dataset(examples, router=None, dedup=None, shard_index=0, num_shards=1):
+    """
+    Iterates through each sample (any iterable of dataset rows) and parses YOLO boxes.
     Only returns objects with class 3 (chart) and 14 (image).
+    router (routing.Router) picks the request settings of each page from all its boxes.
+    dedup (dedup.Deduplicator) flags or reuses near-duplicates of pages already labelled.
+    With num_shards > 1, only rows whose key (path or file_name column, else
+    row index) falls in shard_index are used.
     """
     processed_results = []
-    target_classes = {3, 14}
 
     found_with_objects = False
     found_without_objects = False
 
     print("Processing dataset...")
-    for idx, example in enumerate(tqdm(dataset['train'])):
+    for idx, example in enumerate(tqdm(examples)):
         if found_with_objects and found_without_objects:
             break
+        name = row_key(example, idx)
+        if num_shards > 1 and shard_of(name, num_shards) != shard_index:
+            continue
 
         img = example['image']
         W, H = img.size
-        raw_labels = example['label_raw'].strip()
-
-        sample_boxes = []
-        if raw_labels:
-            for line in raw_labels.split('\n'):
-                parts = line.split()
-                if not parts:
-                    continue
-
-                cls_id = int(parts[0])
-                if cls_id in target_classes:
-                    coords = list(map(float, parts[1:]))
-                    x_c, y_c, w_n, h_n = coords
-
-                    x1 = (x_c - w_n / 2) * W
-                    y1 = (y_c - h_n / 2) * H
-                    x2 = (x_c + w_n / 2) * W
-                    y2 = (y_c + h_n / 2) * H
-
-                    sample_boxes.append({
-                        'bbox': [x1, y1, x2, y2],
-                        'cls_id': cls_id
-                    })
+        labels = parse_label_raw(example['label_raw'])
+        sample_boxes = yolo_to_pixel_boxes(labels, W, H)
 
         # Logic to only process one of each type
         is_with_objects = len(sample_boxes) > 0
@@ -78,37 +166,23 @@ async def process_dataset(dataset):
         img_cv2 = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
 
         # Decide which image and prompt to use
-        tag_to_bbox = {}
-        if sample_boxes:
-            boxes_only = [obj['bbox'] for obj in sample_boxes]
-            out_img, cropped_objects, tag_to_bbox = draw_boxes(img_cv2, boxes_only)
-            target_img = out_img
-            prompt = figure_prompt_content
+        target_img, prompt, prompt_type, cropped_objects, tag_to_bbox = build_request(img_cv2, sample_boxes)
+        route, features = router.route(labels) if router else (None, None)
+
+        source_page = distance = None
+        if dedup is not None and dedup.enabled:
+            h, phash_hex = page_phash(img)
+            source_page, distance = dedup.match(h, len(tag_to_bbox))
+        if source_page is not None and dedup.policy == "reuse":
+            source = await dedup.source_record(source_page)
+            dedup.record_reuse(source)
+            thinking, final_ocr_text, usage = source['thinking'], source['ocr_results'], None
+            print(f"Sample {idx} reuses the result of {source_page.name} (distance {distance})")
         else:
-            target_img = img_cv2
-            prompt = text_prompt_content
-            cropped_objects = {}
-
-        # Call the agent on the full image
-        _, buffer = cv2.imencode('.jpg', target_img)
-        image_bytes = buffer.tobytes()
-
-        raw_response = await generate(image_bytes, prompt=prompt)
-        extracted = extract_response(raw_response)
-        thinking = extracted.thinking_block
-        ocr_text = extracted.document or raw_response
-
-        # Normalize tag_to_bbox for replacement
-        tag_to_normalized_bbox = {}
-        for tag, bbox in tag_to_bbox.items():
-            x1, y1, x2, y2 = bbox
-            nx1 = int(round(x1 * 1000 / W))
-            ny1 = int(round(y1 * 1000 / H))
-            nx2 = int(round(x2 * 1000 / W))
-            ny2 = int(round(y2 * 1000 / H))
-            tag_to_normalized_bbox[tag] = [nx1, ny1, nx2, ny2]
-
-        final_ocr_text = replace_tags_with_normalized_bboxes(ocr_text, tag_to_normalized_bbox)
+            thinking, final_ocr_text, usage = await label_image(target_img, prompt, prompt_type, tag_to_bbox, W, H, route=route)
+            if dedup is not None and dedup.enabled:
+                dedup.add(h, LabelledPage(name, len(tag_to_bbox),
+                                          record={'thinking': thinking, 'ocr_results': final_ocr_text, 'usage': usage}))
 
         print(f"\n--- Sample {idx} Thinking ---\n{thinking}\n")
         print(f"\n--- Sample {idx} Final OCR Result ---\n{final_ocr_text}\n")
@@ -118,19 +192,61 @@ async def process_dataset(dataset):
         cv2.imwrite(save_path, target_img)
 
         processed_results.append({
+            'name': name,
             'sample_idx': idx,
             'image': img,
             'objects': sample_boxes,
+            'thinking': thinking,
             'ocr_results': final_ocr_text,
+            'usage': usage,
+            'route': route["name"] if route else DEFAULT_ROUTE,
+            'features': features,
+            'duplicate_of': source_page.name if source_page is not None else None,
             'crops': list(cropped_objects.keys())
         })
 
     return processed_results
 
+def save_results(results, output_path):
+    """Writes the results (without the images) as JSON lines, in one step so a shard file is never partial."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for result in results:
+            record = {k: v for k, v in result.items() if k != 'image'}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, output_path)
+
 if __name__ == "__main__":
-    dataset_name = "daominhwysi/toanmath.com_25k"
-    dataset = load_dataset(dataset_name)
+    parser = argparse.ArgumentParser(description="Label one page with and one without figures")
+    parser.add_argument("--dataset", type=str, default="daominhwysi/toanmath.com_25k")
+    parser.add_argument("--parquet-dir", type=str, default=None, help="Read a local parquet copy instead of the hub")
+    parser.add_argument("--no-streaming", action="store_true", help="Download the full dataset with load_dataset first")
+    parser.add_argument("--output", type=str, default="output_dev/processed.jsonl",
+                        help="JSON lines results (one file per shard, combined with `merge labels`)")
+    add_page_cache_args(parser)
+    add_routing_args(parser)
+    add_dedup_args(parser)
+    add_shard_args(parser, "dataset rows")
+    add_metrics_args(parser)
+    add_usage_args(parser)
+    args = parser.parse_args()
+    check_shard_args(args)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    configure_from_args(args)
+
+    examples = open_examples(args.dataset, parquet_dir=args.parquet_dir, streaming=not args.no_streaming,
+                             page_cache=page_cache_from_args(args))
     output_dir = "output_dev/draw_boxes"
     os.makedirs(output_dir, exist_ok=True)
-    results = asyncio.run(process_dataset(dataset))
-    print(f"\nProcessing complete. Found {len(results)} samples.")
+    dedup = dedup_from_args(args)
+    results = asyncio.run(process_dataset(examples, router=router_from_args(args), dedup=dedup,
+                                          shard_index=args.shard_index, num_shards=args.num_shards))
+    output_path = sharded_path(args.output, args.shard_index, args.num_shards)
+    save_results(results, output_path)
+    print(f"\nProcessing complete. Found {len(results)} samples, written to {output_path}.")
+    metrics.print_summary()
+    usage_tracker.print_report(args.price_input, args.price_output)
+    dedup.print_report()
+    if args.usage_report:
+        usage_tracker.save(args.usage_report, args.price_input, args.price_output)
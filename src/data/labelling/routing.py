@@ -0,0 +1,103 @@
+import json
+
+# PP-DocLayoutV3 class ids (see extract_roi.id2label)
+FIGURE_CLASSES = {3, 14}
+FORMULA_CLASSES = {5, 11, 15}
+TABLE_CLASSES = {21}
+TEXT_CLASSES = {4, 17, 22, 23}
+
+# Request settings per route. "default" is what every page got before routing.
+# A route may also name a prompt file (prompt/<name>.md) used instead of the
+# text prompt; figure pages always keep the figure prompt.
+ROUTES = {
+    "blank": {"media_resolution": "MEDIA_RESOLUTION_LOW", "thinking_level": "MINIMAL"},
+    "simple": {"media_resolution": "MEDIA_RESOLUTION_MEDIUM", "thinking_level": "MINIMAL"},
+    "default": {"media_resolution": "MEDIA_RESOLUTION_HIGH", "thinking_level": "MINIMAL"},
+    "dense": {"media_resolution": "MEDIA_RESOLUTION_HIGH", "thinking_level": "LOW"},
+}
+DEFAULT_ROUTE = "default"
+
+THRESHOLDS = {
+    # Nearly empty page: few boxes covering little of the page
+    "blank_max_boxes": 2,
+    "blank_max_coverage": 0.1,
+    # Plain text page: no formulas or tables, not too many blocks
+    "simple_max_boxes": 12,
+    # Formula sheet: many formula boxes or a large formula area
+    "dense_min_formulas": 8,
+    "dense_min_formula_area": 0.25,
+}
+
+def page_features(labels):
+    """
+    Layout statistics of a page from its normalized YOLO boxes
+    ((cls_id, x_c, y_c, w_n, h_n) tuples, as from parse_label_raw).
+    Areas are fractions of the page; overlapping boxes are counted twice.
+    """
+    features = {"boxes": len(labels), "figures": 0, "formulas": 0, "tables": 0,
+                "text_area": 0.0, "formula_area": 0.0, "coverage": 0.0}
+    for cls_id, _, _, w_n, h_n in labels:
+        area = w_n * h_n
+        features["coverage"] += area
+        if cls_id in FIGURE_CLASSES:
+            features["figures"] += 1
+        elif cls_id in FORMULA_CLASSES:
+            features["formulas"] += 1
+            features["formula_area"] += area
+        elif cls_id in TABLE_CLASSES:
+            features["tables"] += 1
+        elif cls_id in TEXT_CLASSES:
+            features["text_area"] += area
+    for key in ("text_area", "formula_area", "coverage"):
+        features[key] = round(min(features[key], 1.0), 4)
+    return features
+
+def choose_route(features, thresholds=THRESHOLDS):
+    """Route name for a page's features."""
+    dense = (features["tables"] > 0
+             or features["formulas"] >= thresholds["dense_min_formulas"]
+             or features["formula_area"] >= thresholds["dense_min_formula_area"])
+    if features["figures"]:
+        # Drawn IM tags must stay legible: never below the default resolution
+        return "dense" if dense else DEFAULT_ROUTE
+    if features["boxes"] <= thresholds["blank_max_boxes"] and features["coverage"] <= thresholds["blank_max_coverage"]:
+        return "blank"
+    if dense:
+        return "dense"
+    if features["formulas"] == 0 and features["boxes"] <= thresholds["simple_max_boxes"]:
+        return "simple"
+    return DEFAULT_ROUTE
+
+class Router:
+    """
+    Chooses media resolution, thinking level and prompt per page from its layout
+    boxes. Disabled, every page takes the default route (the old fixed settings).
+    """
+
+    def __init__(self, routes=None, thresholds=None, enabled=True):
+        self.routes = {**ROUTES, **(routes or {})}
+        self.thresholds = {**THRESHOLDS, **(thresholds or {})}
+        self.enabled = enabled
+
+    def route(self, labels):
+        """Returns (route dict with its "name", features)."""
+        features = page_features(labels)
+        name = choose_route(features, self.thresholds) if self.enabled else DEFAULT_ROUTE
+        return {"name": name, **self.routes[name]}, features
+
+def load_router(path=None, enabled=True):
+    """Router with routes/thresholds overridden from a JSON file {"routes": {...}, "thresholds": {...}}."""
+    config = {}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    return Router(config.get("routes"), config.get("thresholds"), enabled)
+
+def add_routing_args(parser):
+    # Opt-in until label quality under the cheaper routes has been measured
+    parser.add_argument("--routing", choices=["auto", "off"], default="off",
+                        help="Per-page request settings from the layout boxes (auto), or the default route for every page")
+    parser.add_argument("--routes", type=str, default=None, help="JSON overriding the routes and thresholds")
+
+def router_from_args(args):
+    return load_router(args.routes, enabled=args.routing == "auto")
@@ -0,0 +1,123 @@
+import json
+import time
+import threading
+from src.data.scripts.stage_metrics import metrics
+
+# USD per 1M tokens (input, output). Thinking tokens are billed as output.
+# Check the current price list before relying on the estimate; override with --price-input/--price-output.
+PRICING = {
+    "gemini-3-flash-preview": (0.50, 3.00),
+}
+
+TOKEN_FIELDS = {
+    "input": "prompt_token_count",
+    "output": "candidates_token_count",
+    "thinking": "thoughts_token_count",
+    "cached": "cached_content_token_count",
+    "total": "total_token_count",
+}
+
+def usage_from_response(response):
+    """Token counts from a response's usage_metadata (missing fields count as 0)."""
+    meta = getattr(response, "usage_metadata", None)
+    usage = {name: int(getattr(meta, field, None) or 0) for name, field in TOKEN_FIELDS.items()}
+    # Input tokens per modality (image vs text), when the API reports them
+    for detail in getattr(meta, "prompt_tokens_details", None) or []:
+        modality = str(getattr(detail, "modality", "unknown")).split(".")[-1].lower()
+        usage[f"input_{modality}"] = int(getattr(detail, "token_count", 0) or 0)
+    return usage
+
+def request_cost(usage, price_input, price_output):
+    return (usage.get("input", 0) * price_input + (usage.get("output", 0) + usage.get("thinking", 0)) * price_output) / 1e6
+
+class UsageTracker:
+    """
+    Per-request token usage, retries and latency of Gemini calls, aggregated
+    per prompt type (figure/text), per route and per API key.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.started = time.time()
+
+    def record(self, model, prompt_type, key_id, usage, latency, retries, route=None):
+        route = route or "default"
+        entry = {"model": model, "prompt_type": prompt_type, "route": route, "key": key_id,
+                 "latency_s": latency, "retries": retries, **usage}
+        with self.lock:
+            self.requests.append(entry)
+        for kind in ("input", "output", "thinking"):
+            metrics.inc("gemini.tokens", usage.get(kind, 0), kind=kind, prompt=prompt_type, route=route)
+        metrics.observe("gemini.call_seconds", latency, prompt=prompt_type, route=route)
+        return entry
+
+    def aggregate(self, by, price_input=None, price_output=None):
+        """Totals grouped by 'prompt_type', 'route' or 'key'."""
+        groups = {}
+        with self.lock:
+            requests = list(self.requests)
+        for r in requests:
+            g = groups.setdefault(r[by], {"requests": 0, "input": 0, "output": 0, "thinking": 0,
+                                          "retries": 0, "latency_s": 0.0, "cost_usd": 0.0})
+            g["requests"] += 1
+            for kind in ("input", "output", "thinking", "retries", "latency_s"):
+                g[kind] += r.get(kind, 0)
+            p_in, p_out = PRICING.get(r["model"], (0.0, 0.0))
+            g["cost_usd"] += request_cost(r, price_input if price_input is not None else p_in,
+                                          price_output if price_output is not None else p_out)
+        for g in groups.values():
+            generated = g["output"] + g["thinking"]
+            g["mean_latency_s"] = g["latency_s"] / g["requests"]
+            # Generation speed while a request is open (summed over concurrent requests)
+            g["output_tokens_per_s"] = generated / g["latency_s"] if g["latency_s"] else 0.0
+            g["cost_per_page_usd"] = g["cost_usd"] / g["requests"]
+        return groups
+
+    def report(self, price_input=None, price_output=None):
+        wall = time.time() - self.started
+        by_prompt = self.aggregate("prompt_type", price_input, price_output)
+        total_tokens = sum(g["input"] + g["output"] + g["thinking"] for g in by_prompt.values())
+        return {
+            "wall_s": wall,
+            "requests": sum(g["requests"] for g in by_prompt.values()),
+            "cost_usd": sum(g["cost_usd"] for g in by_prompt.values()),
+            "tokens_per_s": total_tokens / wall if wall > 0 else 0.0,
+            "by_prompt_type": by_prompt,
+            "by_route": self.aggregate("route", price_input, price_output),
+            "by_key": self.aggregate("key", price_input, price_output),
+        }
+
+    def print_report(self, price_input=None, price_output=None):
+        report = self.report(price_input, price_output)
+        if not report["requests"]:
+            return report
+        for title, groups in (("Prompt", report["by_prompt_type"]), ("Route", report["by_route"]),
+                              ("Key", report["by_key"])):
+            print("\n" + "=" * 100)
+            print(f"{title:<10} | {'reqs':>5} | {'input':>9} | {'output':>8} | {'thinking':>8} | {'retries':>7} | "
+                  f"{'lat s':>6} | {'tok/s':>6} | {'$/page':>8} | {'$ total':>8}")
+            print("-" * 100)
+            for name, g in sorted(groups.items(), key=lambda item: str(item[0])):
+                print(f"{str(name):<10} | {g['requests']:>5} | {g['input']:>9} | {g['output']:>8} | {g['thinking']:>8} | "
+                      f"{g['retries']:>7} | {g['mean_latency_s']:>6.2f} | {g['output_tokens_per_s']:>6.1f} | "
+                      f"{g['cost_per_page_usd']:>8.5f} | {g['cost_usd']:>8.4f}")
+        print("=" * 100)
+        print(f"{report['requests']} requests in {report['wall_s']:.0f}s | {report['tokens_per_s']:.1f} tokens/s | "
+              f"estimated cost ${report['cost_usd']:.4f}")
+        return report
+
+    def save(self, path, price_input=None, price_output=None):
+        """Writes the aggregated report and every request to a JSON file."""
+        with self.lock:
+            requests = list(self.requests)
+        with open(path, "w") as f:
+            json.dump({**self.report(price_input, price_output), "requests_detail": requests}, f, indent=2)
+
+# Process-wide tracker filled by agent.generate_with_usage
+usage_tracker = UsageTracker()
+
+def add_usage_args(parser):
+    parser.add_argument("--price-input", type=float, default=None, help="USD per 1M input tokens (default: PRICING)")
+    parser.add_argument("--price-output", type=float, default=None, help="USD per 1M output+thinking tokens")
+    parser.add_argument("--usage-report", type=str, default=None, help="Write the token/cost report JSON here")
@@ -1,19 +1,20 @@
-print("1. Loading OS/Pathlib...", flush=True)
 import os
+import time
+import queue
 import shutil
+import argparse
+import multiprocessing as mp
 from pathlib import Path
-
-print("2. Loading PIL/TQDM...", flush=True)
-from PIL import Image
 from tqdm import tqdm
 
-print("3. Loading Torch (this usually hangs)...", flush=True)
-import torch
-
-print("4. Loading Transformers...", flush=True)
-from transformers import pipeline
-
-print("5. All imports finished!", flush=True)
+# torch/transformers are imported inside the functions that need them: they
+# take seconds to load, and spawned workers and --help/--export-only don't need them
+from src.data.scripts.stage_metrics import metrics, add_metrics_args, configure_from_args
+from src.data.scripts.page_cache import add_page_cache_args, page_cache_from_args
+from src.data.scripts.sharding import shard_of, add_shard_args, check_shard_args
+from src.data.scripts.layout_loader import PrefetchLoader, load_page, plan_batches
+from src.data.scripts.layout_manifest import LayoutManifest, manifest_path, reverse_label_map, detections_to_yolo
+from src.data.scripts.layout_backends import load_layout_detector, BACKENDS, DEFAULT_ONNX_PATH, MODEL_ID
 
 def flatten_images(base_dir):
     """
@@ -46,103 +47,315 @@ def flatten_images(base_dir):
         except OSError:
             print(f"Warning: Could not remove directory {subdir}. It might not be empty.")
 
-def run_layout_analysis(base_dir):
+def annotate_batches(layout_detector, batches, id2label, options, on_batch=None):
+    """
+    Runs the detector over batches of image paths and appends each batch's
+    detections to the manifest at options["manifest"] in one transaction.
+    Pages are decoded (and pre-resized to the model input size) on loader
+    workers while the previous batch runs through the model.
+    on_batch(num_pages) is called after every batch. Returns timing stats.
+    """
+    size_cfg = getattr(layout_detector.image_processor, "size", None) if options["pre_resize"] else None
+    loader = PrefetchLoader(batches, size_cfg=size_cfg, num_workers=options["loader_workers"],
+                            prefetch_batches=options["prefetch"], use_processes=options["loader_processes"],
+                            page_cache=options.get("page_cache"))
+
+    label2id = reverse_label_map(id2label)
+    manifest = LayoutManifest(options["manifest"])
+    pages = 0
+    model_time = 0.0
+    write_time = 0.0
+    run_start = time.perf_counter()
+    for batch in loader:
+        for p, e in batch.errors:
+            print(f"Error opening {p}: {e}")
+        metrics.inc("layout.decode_errors", len(batch.errors))
+
+        valid_paths = batch.paths
+        batch_images = batch.images
+        if batch_images:
+            start = time.perf_counter()
+            try:
+                # Without batch_size the pipeline runs the pages one by one
+                results = layout_detector(batch_images, batch_size=len(batch_images))
+            except Exception as e:
+                print(f"Error during detection: {e}")
+                metrics.inc("layout.detect_errors", len(batch_images))
+                results = None
+            elapsed = time.perf_counter() - start
+            model_time += elapsed
+            metrics.observe("layout.model_seconds", elapsed)
+            metrics.observe("layout.model_page_seconds", elapsed / len(batch_images))
+
+            if results is not None:
+                start = time.perf_counter()
+                rows = []
+                for img_path, img_results, img_obj, orig_size in zip(valid_paths, results, batch_images, batch.orig_sizes):
+                    img_width, img_height = img_obj.size
+                    boxes = detections_to_yolo(img_results, img_width, img_height, label2id)
+                    rows.append((img_path.name, orig_size[0], orig_size[1], boxes))
+                manifest.append(rows)
+                elapsed = time.perf_counter() - start
+                write_time += elapsed
+                metrics.observe("layout.write_seconds", elapsed)
+                metrics.inc("layout.pages", len(valid_paths))
+                pages += len(valid_paths)
+
+        if on_batch:
+            on_batch(len(valid_paths) + len(batch.errors))
+    manifest.close()
+
+    return {
+        "pages": pages,
+        "wall_time": time.perf_counter() - run_start,
+        "model_time": model_time,
+        "wait_time": loader.wait_time,
+        "write_time": write_time,
+        "decode_time": loader.decode_time,
+    }
+
+def print_timing(stats):
+    wall_time = max(stats["wall_time"], 1e-9)
+    print("\n" + "=" * 45)
+    print(f"Wall time:           {stats['wall_time']:8.1f}s ({stats['pages'] / wall_time:.2f} pages/s)")
+    print(f"Model:               {stats['model_time']:8.1f}s ({stats['model_time'] / wall_time * 100:5.1f}%)")
+    print(f"Waiting for decode:  {stats['wait_time']:8.1f}s ({stats['wait_time'] / wall_time * 100:5.1f}%)")
+    print(f"Writing manifest:    {stats['write_time']:8.1f}s ({stats['write_time'] / wall_time * 100:5.1f}%)")
+    print(f"Decode (worker sum): {stats['decode_time']:8.1f}s")
+    print("=" * 45)
+
+def search_batch_size(layout_detector, sample_paths, size_cfg, candidates=(1, 2, 4, 8, 16, 32), rounds=2):
+    """
+    Measures the detector's pages/s at growing batch sizes on sample pages.
+    Stops at the first size that fails (e.g. out of memory) or is clearly
+    slower than the best so far. Returns (best batch size, pixel budget), where
+    the budget is sized from the largest sample page so big scans stay safe.
+    """
+    images = [img for _, img, _, _, error in map(load_page, [(p, size_cfg) for p in sample_paths]) if error is None]
+    if not images:
+        return None, None
+
+    # Warm-up so lazy initialization doesn't count against batch size 1
+    layout_detector(images[:1])
+    best_bs, best_pps = 1, 0.0
+    print("Searching batch size...")
+    for bs in candidates:
+        if bs > len(images):
+            break
+        batch = images[:bs]
+        try:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                layout_detector(batch, batch_size=bs)
+            pps = rounds * bs / (time.perf_counter() - start)
+        except (RuntimeError, MemoryError) as e:
+            # torch.cuda.OutOfMemoryError is a RuntimeError
+            print(f"  batch {bs:>3}: failed ({e.__class__.__name__}), stopping search")
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            break
+        print(f"  batch {bs:>3}: {pps:.2f} pages/s")
+        if pps > best_pps:
+            best_bs, best_pps = bs, pps
+        elif pps < best_pps * 0.9:
+            break
+
+    max_page_pixels = max(img.size[0] * img.size[1] for img in images)
+    print(f"Best batch size: {best_bs} ({best_pps:.2f} pages/s)")
+    return best_bs, best_bs * max_page_pixels
+
+def partition_cores(num_processes):
+    """Splits the CPUs this process may use into num_processes contiguous groups."""
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * num_processes
+    cores = sorted(os.sched_getaffinity(0))
+    per_worker = max(1, len(cores) // num_processes)
+    return [set(cores[i * per_worker:(i + 1) * per_worker]) or set(cores) for i in range(num_processes)]
+
+def layout_worker(worker_id, cores, num_threads, work_queue, stats_queue, base_dir, options):
+    """Worker process: own model instance, pinned cores and thread share, pulls batches from work_queue."""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(num_threads)
+    layout_detector = load_layout_detector(options["backend"], device=-1, num_threads=num_threads,
+                                           onnx_path=options["onnx_path"])
+    id2label = layout_detector.model.config.id2label
+
+    def batches():
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            yield [Path(p) for p in item]
+
+    if options.get("metrics_args") is not None:
+        configure_from_args(options["metrics_args"], tag=f"worker{worker_id}")
+    stats = annotate_batches(layout_detector, batches(), id2label, options,
+                             on_batch=lambda n: stats_queue.put(("progress", worker_id, n)))
+    # Worker processes exit without running atexit hooks
+    metrics.close()
+    stats_queue.put(("done", worker_id, stats))
+
+def run_multiprocess(base_dir, batches, num_pages, num_processes, num_threads, options):
+    """Annotates batches with num_processes model instances pulling from one shared queue."""
+    total_threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    threads_per_worker = num_threads or max(1, total_threads // num_processes)
+    cores = partition_cores(num_processes)
+
+    if options["backend"] == "onnx" and not os.path.exists(options["onnx_path"]):
+        # Export once here so workers don't race on the same file
+        load_layout_detector("onnx", device=-1, onnx_path=options["onnx_path"])
+
+    ctx = mp.get_context("spawn")
+    work_queue = ctx.Queue()
+    stats_queue = ctx.Queue()
+    # Batches go in a fixed order; workers take the next one when they are free
+    for batch in batches:
+        work_queue.put([str(p) for p in batch])
+    for _ in range(num_processes):
+        work_queue.put(None)
+
+    print(f"Starting {num_processes} workers with {threads_per_worker} threads each...")
+    workers = [
+        ctx.Process(target=layout_worker,
+                    args=(i, cores[i], threads_per_worker, work_queue, stats_queue, base_dir, options))
+        for i in range(num_processes)
+    ]
+    run_start = time.perf_counter()
+    for w in workers:
+        w.start()
+
+    worker_stats = {}
+    with tqdm(total=num_pages, desc="Annotating") as pbar:
+        while len(worker_stats) < num_processes:
+            try:
+                kind, worker_id, payload = stats_queue.get(timeout=5)
+            except queue.Empty:
+                if not any(w.is_alive() for w in workers):
+                    print("All workers exited before finishing.")
+                    break
+                continue
+            if kind == "progress":
+                pbar.update(payload)
+            else:
+                worker_stats[worker_id] = payload
+    for w in workers:
+        w.join()
+    wall_time = time.perf_counter() - run_start
+
+    print("\n" + "=" * 62)
+    print(f"{'Worker':<7} | {'Cores':<12} | {'Pages':>6} | {'pages/s':>8} | {'model %':>7} | {'wait %':>6}")
+    print("-" * 62)
+    for worker_id in sorted(worker_stats):
+        st = worker_stats[worker_id]
+        core_str = f"{min(cores[worker_id])}-{max(cores[worker_id])}" if cores[worker_id] else "-"
+        wt = max(st["wall_time"], 1e-9)
+        print(f"{worker_id:<7} | {core_str:<12} | {st['pages']:>6} | {st['pages'] / wt:>8.2f} | "
+              f"{st['model_time'] / wt * 100:>6.1f}% | {st['wait_time'] / wt * 100:>5.1f}%")
+    total_pages = sum(st["pages"] for st in worker_stats.values())
+    print("-" * 62)
+    print(f"Total: {total_pages} pages in {wall_time:.1f}s ({total_pages / max(wall_time, 1e-9):.2f} pages/s)")
+    print("=" * 62)
+
+def run_layout_analysis(base_dir, batch_size=8, num_workers=4, prefetch_batches=2,
+                        use_processes=False, pre_resize=True, backend="eager", num_threads=None,
+                        onnx_path=DEFAULT_ONNX_PATH, num_processes=1, shard_index=0, num_shards=1,
+                        max_batch_pixels=None, auto_batch=False, metrics_args=None, page_cache=None):
     """
-    Uses DocLayout model to annotate images and save in YOLO format.
+    Uses DocLayout model to annotate images. Detections (normalized YOLO boxes)
+    go to a SQLite manifest in base_dir, which is also what resume reads;
+    export_labels writes the YOLO .txt files from it.
+    With max_batch_pixels, pages are batched by resized shape up to that many
+    (padded) pixels per batch, batch_size being the upper bound on pages.
+    auto_batch measures throughput on sample pages to pick both.
+    With num_processes > 1, several CPU model instances share the work.
+    With num_shards > 1, only the files of shard_index are processed, so
+    several machines can split the same image directory.
+    page_cache (a PageCache) keeps the decoded, resized pages for later runs.
     """
     images_dir = Path(base_dir) / "images"
     labels_dir = Path(base_dir) / "labels"
-    labels_dir.mkdir(parents=True, exist_ok=True)
 
     image_files = [f for f in images_dir.iterdir() if f.is_file() and f.suffix.lower() in [".jpg", ".jpeg", ".png", ".webp"]]
 
-    # Skip already processed images
-    image_files = [f for f in image_files if not (labels_dir / f"{f.stem}.txt").exists()]
+    if num_shards > 1:
+        image_files = [f for f in image_files if shard_of(f.name, num_shards) == shard_index]
+        print(f"Shard {shard_index}/{num_shards}: {len(image_files)} images.")
+
+    # Skip already processed images: pages in the manifest, plus label files
+    # of older runs (one directory listing instead of a stat per image)
+    manifest_file = manifest_path(base_dir, shard_index, num_shards)
+    manifest = LayoutManifest(manifest_file)
+    done_names = manifest.processed_names()
+    manifest.close()
+    done_stems = {p.stem for p in labels_dir.iterdir() if p.suffix == ".txt"} if labels_dir.exists() else set()
+    image_files = [f for f in image_files if f.name not in done_names and f.stem not in done_stems]
 
     if not image_files:
         print("All images have already been processed.")
         return
 
-    print("Loading model...")
-    device = 0 if torch.cuda.is_available() else -1
-    layout_detector = pipeline(
-        "object-detection",
-        model="PaddlePaddle/PP-DocLayoutV3_safetensors",
-        device=device
-    )
-
-    # Label mapping (keeping the raw IDs from the model)
-    id2label = layout_detector.model.config.id2label
-    print(f"Model ID to Label mapping: {id2label}")
-
+    # Deterministic order, identical on every run
+    image_files.sort()
+    options = {
+        "pre_resize": pre_resize,
+        "loader_workers": num_workers,
+        "prefetch": prefetch_batches,
+        "loader_processes": use_processes,
+        "backend": backend,
+        "onnx_path": onnx_path,
+        "manifest": str(manifest_file),
+        "metrics_args": metrics_args,
+        "page_cache": page_cache,
+    }
     print(f"Found {len(image_files)} images to process.")
 
-    # Process in batches for better performance
-    batch_size = 8
-    for i in tqdm(range(0, len(image_files), batch_size), desc="Processing Batches"):
-        batch_paths = image_files[i : i + batch_size]
-        batch_images = []
-        valid_paths = []
+    # Sample pages spread over the whole directory for the batch size search
+    sample_paths = image_files[:: max(1, len(image_files) // 32)][:32]
 
-        for p in batch_paths:
-            try:
-                img = Image.open(p).convert("RGB")
-                batch_images.append(img)
-                valid_paths.append(p)
-            except Exception as e:
-                print(f"Error opening {p}: {e}")
+    if num_processes > 1:
+        if auto_batch:
+            # Search with one worker's thread share, the setting the workers will run with
+            total_threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+            probe = load_layout_detector(backend, device=-1, num_threads=num_threads or max(1, total_threads // num_processes),
+                                         onnx_path=onnx_path)
+            size_cfg = getattr(probe.image_processor, "size", None) if pre_resize else None
+            found_bs, found_pixels = search_batch_size(probe, sample_paths, size_cfg)
+            batch_size, max_batch_pixels = found_bs or batch_size, found_pixels or max_batch_pixels
+            del probe
+        else:
+            from transformers import AutoImageProcessor
+            size_cfg = AutoImageProcessor.from_pretrained(MODEL_ID).size if pre_resize and max_batch_pixels else None
+        batches = plan_batches(image_files, size_cfg, max_batch_pixels, batch_size, num_workers)
+        print(f"Planned {len(batches)} batches.")
+        run_multiprocess(base_dir, batches, len(image_files), num_processes, num_threads, options)
+        from transformers import AutoConfig
+        id2label = AutoConfig.from_pretrained(MODEL_ID).id2label
+    else:
+        print(f"Loading model ({backend} backend)...")
+        import torch
+        device = 0 if torch.cuda.is_available() else -1
+        if device != -1 and backend != "eager":
+            print(f"Backend {backend} is CPU-only, using eager on GPU.")
+            options["backend"] = backend = "eager"
+        layout_detector = load_layout_detector(backend, device=device, num_threads=num_threads, onnx_path=onnx_path)
 
-        if not batch_images:
-            continue
+        size_cfg = getattr(layout_detector.image_processor, "size", None) if pre_resize else None
+        if auto_batch:
+            found_bs, found_pixels = search_batch_size(layout_detector, sample_paths, size_cfg)
+            batch_size, max_batch_pixels = found_bs or batch_size, found_pixels or max_batch_pixels
+        batches = plan_batches(image_files, size_cfg, max_batch_pixels, batch_size, num_workers)
+        print(f"Planned {len(batches)} batches.")
 
-        try:
-            results = layout_detector(batch_images)
-        except Exception as e:
-            print(f"Error during detection: {e}")
-            continue
-
-        for img_path, img_results, img_obj in zip(valid_paths, results, batch_images):
-            img_width, img_height = img_obj.size
-            label_file = labels_dir / f"{img_path.stem}.txt"
-
-            with open(label_file, "w") as f:
-                for res in img_results:
-                    # YOLO format: class_id x_center y_center width height (normalized)
-                    box = res["box"]
-                    xmin, ymin, xmax, ymax = box["xmin"], box["ymin"], box["xmax"], box["ymax"]
-
-                    # Ensure coordinates are within image bounds
-                    xmin = max(0, xmin)
-                    ymin = max(0, ymin)
-                    xmax = min(img_width, xmax)
-                    ymax = min(img_height, ymax)
-
-                    width = xmax - xmin
-                    height = ymax - ymin
-                    x_center = xmin + width / 2
-                    y_center = ymin + height / 2
-
-                    # Normalize
-                    x_center /= img_width
-                    y_center /= img_height
-                    width /= img_width
-                    height /= img_height
-
-                    label_id = -1
-                    # Extract numeric ID from label name if needed,
-                    # but pipeline usually returns the predicted class index in the dict if accessed correctly.
-                    # Or we can find the ID from id2label.
-                    label_name = res["label"]
-                    # Find the ID for this label name. Note: some names repeat,
-                    # we'll use the first one that matches or the model might return ID directly.
-                    # Actually, Transformers pipeline object-detection returns 'label' as the string name.
-                    for idx, name in id2label.items():
-                        if name == label_name:
-                            label_id = idx
-                            break
-
-                    if label_id != -1:
-                        f.write(f"{label_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
+        # Label mapping (keeping the raw IDs from the model)
+        id2label = layout_detector.model.config.id2label
+        print(f"Model ID to Label mapping: {id2label}")
+
+        with tqdm(total=len(image_files), desc="Processing Pages") as pbar:
+            stats = annotate_batches(layout_detector, batches, id2label, options, on_batch=pbar.update)
+        print_timing(stats)
 
     # Create a simple data.yaml for information
     with open(Path(base_dir) / "data.yaml", "w") as f:
@@ -153,12 +366,66 @@ def run_layout_analysis(base_dir):
             name = id2label.get(idx, f"class_{idx}")
             f.write(f"  {idx}: {name}\n")
 
+def export_labels(base_dir, shard_index=0, num_shards=1):
+    """Writes labels/<stem>.txt in YOLO format for every page in the manifest."""
+    manifest = LayoutManifest(manifest_path(base_dir, shard_index, num_shards))
+    count = manifest.export_yolo(Path(base_dir) / "labels")
+    manifest.close()
+    print(f"Exported {count} label files to {Path(base_dir) / 'labels'}")
+
 if __name__ == "__main__":
-    DATA_DIR = "data/selected_samples_25k"
+    parser = argparse.ArgumentParser(description="Flatten selected samples and annotate them with PP-DocLayoutV3")
+    parser.add_argument("--data-dir", type=str, default="data/selected_samples_25k")
+    parser.add_argument("--batch-size", type=int, default=8, help="Pages per batch (upper bound with --max-batch-pixels)")
+    parser.add_argument("--max-batch-pixels", type=int, default=None,
+                        help="Batch pages of similar resized shape up to this many padded pixels per batch")
+    parser.add_argument("--auto-batch", action="store_true",
+                        help="Pick batch size and pixel budget from measured throughput on sample pages")
+    parser.add_argument("--loader-workers", type=int, default=4, help="Threads (or processes) decoding pages")
+    parser.add_argument("--prefetch", type=int, default=2, help="Batches decoded ahead of the model")
+    parser.add_argument("--loader-processes", action="store_true", help="Decode in processes instead of threads")
+    parser.add_argument("--no-pre-resize", action="store_true", help="Pass full-size pages to the pipeline")
+    parser.add_argument("--backend", choices=BACKENDS, default="eager",
+                        help="CPU inference backend (check parity first with layout_backend_check)")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for the model")
+    parser.add_argument("--onnx-path", type=str, default=DEFAULT_ONNX_PATH, help="Exported model for --backend onnx")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="CPU worker processes, each with its own model and a share of the cores")
+    add_shard_args(parser, "image directory")
+    parser.add_argument("--export-yolo", action="store_true", help="Write YOLO .txt labels from the manifest afterwards")
+    parser.add_argument("--export-only", action="store_true", help="Only export YOLO labels from an existing manifest")
+    parser.add_argument("--flatten-only", action="store_true", help="Only flatten the image directory")
+    add_page_cache_args(parser)
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    check_shard_args(args)
+    configure_from_args(args)
+
+    DATA_DIR = args.data_dir
+    if args.export_only:
+        export_labels(DATA_DIR, args.shard_index, args.num_shards)
+        raise SystemExit(0)
+
     print("Step 1: Flatten")
     # 
-    flatten_images(DATA_DIR)
+    if args.num_shards > 1:
+        # Every machine must see the same flattened names before sharding
+        print("Sharded run: skipping flatten (run it once before starting the shards).")
+    else:
+        flatten_images(DATA_DIR)
+    if args.flatten_only:
+        raise SystemExit(0)
     print("Step 2: Annotate")
 
     # 
-    run_layout_analysis(DATA_DIR)
+    run_layout_analysis(DATA_DIR, batch_size=args.batch_size, num_workers=args.loader_workers,
+                        prefetch_batches=args.prefetch, use_processes=args.loader_processes,
+                        pre_resize=not args.no_pre_resize, backend=args.backend,
+                        num_threads=args.threads, onnx_path=args.onnx_path, num_processes=args.processes,
+                        shard_index=args.shard_index, num_shards=args.num_shards,
+                        max_batch_pixels=args.max_batch_pixels, auto_batch=args.auto_batch, metrics_args=args,
+                        page_cache=page_cache_from_args(args))
+
+    if args.export_yolo:
+        print("Step 3: Export YOLO labels")
+        export_labels(DATA_DIR, args.shard_index, args.num_shards)
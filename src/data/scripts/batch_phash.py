@@ -0,0 +1,72 @@
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8          # 8x8 hash = 64 bits
+HIGHFREQ_FACTOR = 4    # imagehash default, thumbnails are 32x32
+IMG_SIZE = HASH_SIZE * HIGHFREQ_FACTOR
+
+def phash_thumbnail(img, hash_size=HASH_SIZE, highfreq_factor=HIGHFREQ_FACTOR):
+    """
+    Resizes a PIL image exactly like imagehash.phash does.
+    Returns a (hash_size * highfreq_factor)-square uint8 array.
+    """
+    img_size = hash_size * highfreq_factor
+    return np.asarray(img.convert('L').resize((img_size, img_size), Image.Resampling.LANCZOS))
+
+def dct_matrix(n, k):
+    """First k rows of the unnormalized DCT-II matrix of size n (same scaling as scipy.fftpack.dct)."""
+    rows = np.arange(k)[:, None]
+    cols = np.arange(n)[None, :]
+    return 2.0 * np.cos(np.pi * rows * (2 * cols + 1) / (2 * n))
+
+def pack_bits(bits):
+    """Packs an (N, 64) boolean array into uint64 hashes, first bit = most significant (imagehash order)."""
+    packed = np.packbits(bits.reshape(len(bits), -1).astype(np.uint8), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+def unpack_bits(hashes):
+    """Inverse of pack_bits. Returns an (N, 64) uint8 array of bits."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    return np.unpackbits(hashes.astype('>u8').view(np.uint8).reshape(-1, 8), axis=1)
+
+def hashes_to_hex(hashes):
+    """Formats uint64 hashes as 16-char hex strings, identical to str(imagehash.ImageHash)."""
+    return [f"{int(h):016x}" for h in np.asarray(hashes, dtype=np.uint64)]
+
+def phash_batch(pixels, hash_size=HASH_SIZE, method="fftpack"):
+    """
+    Computes pHashes for a stack of pre-resized grayscale thumbnails.
+    pixels: (N, img_size, img_size) array, e.g. stacked phash_thumbnail() outputs.
+    hash_size must be 8: hashes are packed into uint64.
+    method:
+    - "fftpack": batched scipy.fftpack.dct, bit-compatible with imagehash.phash.
+    - "matrix": only the low-frequency block via two matrix products. Faster, but
+      coefficients equal to the median (flat pages) may round differently.
+    Returns an (N,) uint64 array.
+    """
+    if hash_size * hash_size != 64:
+        raise ValueError(f"Hashes are packed into uint64, so hash_size must be 8, got {hash_size}")
+    pixels = np.asarray(pixels)
+    if pixels.ndim == 2:
+        pixels = pixels[None]
+    if len(pixels) == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    if method == "fftpack":
+        # Deferred: scipy costs ~0.2s to import and most users of this module only pack/unpack
+        import scipy.fftpack
+        dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+        low = dct[:, :hash_size, :hash_size]
+    elif method == "matrix":
+        d = dct_matrix(pixels.shape[1], hash_size)
+        low = d @ pixels.astype(np.float64) @ d.T
+    else:
+        raise ValueError(f"Unknown DCT method: {method}")
+
+    med = np.median(low.reshape(len(low), -1), axis=1)
+    bits = low > med[:, None, None]
+    return pack_bits(bits)
+
+def phash_image(img, hash_size=HASH_SIZE, highfreq_factor=HIGHFREQ_FACTOR):
+    """Computes pHash of an opened PIL image as a packed uint64 (64 bits)."""
+    return phash_batch(phash_thumbnail(img, hash_size, highfreq_factor), hash_size=hash_size)[0]
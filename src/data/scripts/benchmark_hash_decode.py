@@ -0,0 +1,105 @@
+import os
+import io
+import sys
+import time
+import argparse
+import numpy as np
+import pyarrow.parquet as pq
+import imagehash
+from PIL import Image
+from tqdm.auto import tqdm
+from src.data.scripts.hash_decode import open_for_hash, HASH_DECODE_SIZE, get_turbojpeg
+
+HASH_SIZE = 8
+
+def load_samples(image_dir=None, parquet_path=None, limit=200):
+    """Loads encoded image bytes from a local image directory or a parquet file."""
+    samples = []
+    if parquet_path:
+        parquet_file = pq.ParquetFile(parquet_path)
+        for batch in parquet_file.iter_batches(batch_size=256, columns=['image']):
+            for img in batch.column('image').to_pylist():
+                if isinstance(img, dict):
+                    img = img.get('bytes')
+                if img is not None:
+                    samples.append(img)
+                if len(samples) >= limit:
+                    return samples
+        return samples
+
+    for root, _, files in os.walk(image_dir):
+        for f in sorted(files):
+            if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
+                with open(os.path.join(root, f), 'rb') as fh:
+                    samples.append(fh.read())
+                if len(samples) >= limit:
+                    return samples
+    return samples
+
+def hash_full(data):
+    """Current path: full-size decode, imagehash does the resize."""
+    with Image.open(io.BytesIO(data)) as img:
+        return imagehash.phash(img, hash_size=HASH_SIZE)
+
+def hash_reduced(data, min_side, use_turbojpeg):
+    return imagehash.phash(open_for_hash(data, min_side=min_side, use_turbojpeg=use_turbojpeg),
+                           hash_size=HASH_SIZE)
+
+def run_benchmark(samples, min_side=HASH_DECODE_SIZE, use_turbojpeg=True):
+    """Hashes every sample with both decode paths. Returns (full_time, reduced_time, distances)."""
+    full_hashes = []
+    start = time.perf_counter()
+    for data in tqdm(samples, desc="Full decode", leave=False):
+        full_hashes.append(hash_full(data))
+    full_time = time.perf_counter() - start
+
+    reduced_hashes = []
+    start = time.perf_counter()
+    for data in tqdm(samples, desc="Reduced decode", leave=False):
+        reduced_hashes.append(hash_reduced(data, min_side, use_turbojpeg))
+    reduced_time = time.perf_counter() - start
+
+    distances = np.array([a - b for a, b in zip(full_hashes, reduced_hashes)], dtype=np.int32)
+    return full_time, reduced_time, distances
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reduced-resolution decoding for pHash")
+    parser.add_argument("--image-dir", type=str, help="Local directory containing images")
+    parser.add_argument("--parquet", type=str, help="Parquet file with an 'image' column")
+    parser.add_argument("--limit", type=int, default=200, help="Number of images to benchmark")
+    parser.add_argument("--min-side", type=int, default=HASH_DECODE_SIZE, help="Minimum decoded short side")
+    parser.add_argument("--no-turbojpeg", action="store_true", help="Use PIL draft() only for JPEG")
+    parser.add_argument("--max-distance", type=int, default=4,
+                        help="Fail if the 99th percentile Hamming distance exceeds this")
+
+    args = parser.parse_args()
+    if not args.image_dir and not args.parquet:
+        parser.error("one of --image-dir or --parquet is required")
+
+    samples = load_samples(args.image_dir, args.parquet, args.limit)
+    if not samples:
+        print("No images found.")
+        return
+    use_turbojpeg = not args.no_turbojpeg
+    print(f"Benchmarking {len(samples)} images (min side {args.min_side}, "
+          f"TurboJPEG {'on' if use_turbojpeg and get_turbojpeg() else 'off'})...")
+
+    full_time, reduced_time, distances = run_benchmark(samples, args.min_side, use_turbojpeg)
+
+    n = len(samples)
+    p99 = float(np.percentile(distances, 99))
+    print("\n" + "=" * 45)
+    print(f"Full decode:    {n / full_time:8.1f} img/s")
+    print(f"Reduced decode: {n / reduced_time:8.1f} img/s  ({full_time / reduced_time:.2f}x)")
+    print("-" * 45)
+    print(f"Hamming distance: mean {distances.mean():.2f} | p99 {p99:.1f} | max {distances.max()}")
+    print(f"Identical hashes: {(distances == 0).mean() * 100:.1f}%")
+    print("=" * 45)
+
+    if p99 > args.max_distance:
+        print(f"FAIL: p99 Hamming distance {p99:.1f} > {args.max_distance}")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
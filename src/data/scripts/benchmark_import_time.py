@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+# Modules whose import cost every command (and every spawned worker) pays
+MODULES = [
+    "src.data.cli",
+    "src.data.scripts.stage_metrics",
+    "src.data.scripts.batch_phash",
+    "src.data.scripts.hash_store",
+    "src.data.scripts.hamming_index",
+    "src.data.scripts.layout_loader",
+    "src.data.scripts.layout_backends",
+    "src.data.scripts.parquet_stream",
+    "src.data.scripts.generate_embeddings",
+    "src.data.scripts.select_samples_by_hash",
+    "src.data.scripts.convert_images",
+    "src.data.scripts.analyze_layout_dataset",
+    "src.data.labelling.draw_boxes",
+    "src.data.labelling.post_processor",
+    "src.data.labelling.processor",
+    "src.data.labelling.fused_pipeline",
+]
+
+def import_once(module, importtime=False):
+    """
+    Imports module in a fresh interpreter. Returns (seconds, -X importtime
+    stderr or None), or (None, error) when the import fails.
+    """
+    code = ("import time, importlib; start = time.perf_counter(); "
+            f"importlib.import_module({module!r}); print(time.perf_counter() - start)")
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
+    if proc.returncode != 0:
+        return None, proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"
+    return float(proc.stdout.strip().splitlines()[-1]), proc.stderr if importtime else None
+
+def top_imports(importtime_log, top=5):
+    """Slowest packages by cumulative time from a -X importtime log, as (name, seconds)."""
+    entries = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        # Top-level entries only: nested ones are already counted in their parent
+        if name.startswith(" ") and not name.startswith("  "):
+            entries.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(entries, key=lambda e: e[1], reverse=True)[:top]
+
+def measure_module(module, repeat=3, top=5):
+    times, error = [], None
+    for _ in range(repeat):
+        seconds, error = import_once(module)
+        if seconds is None:
+            return {"module": module, "error": error}
+        times.append(seconds)
+    _, log = import_once(module, importtime=True)
+    return {"module": module, "median_s": statistics.median(times), "min_s": min(times),
+            "top": top_imports(log or "", top)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold import time of the pipeline modules, each in a fresh interpreter")
+    parser.add_argument("modules", nargs="*", default=None, help="Modules to measure (default: the pipeline modules)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=3, help="Slowest imported packages to list per module")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if any module takes longer to import")
+    parser.add_argument("--output", type=str, default=None, help="Write results JSON here")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'Module':<45} | {'median s':>8} | slowest imports")
+    print("-" * 100)
+    for module in args.modules or MODULES:
+        r = measure_module(module, args.repeat, args.top)
+        results.append(r)
+        if "error" in r:
+            print(f"{module:<45} | {'-':>8} | {r['error']}")
+            continue
+        top = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in r["top"])
+        print(f"{module:<45} | {r['median_s']:>8.3f} | {top}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.max_seconds is not None:
+        slow = [r["module"] for r in results if r.get("median_s", 0) > args.max_seconds]
+        if slow:
+            print(f"FAIL: {len(slow)} module(s) import slower than {args.max_seconds}s: {', '.join(slow)}")
+            sys.exit(1)
+        print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import contextlib
+import multiprocessing as mp
+from datetime import datetime
+import numpy as np
+import cv2
+import PIL
+from src.data.scripts.synthetic_data import (
+    synthetic_page, synthetic_response, write_synthetic_images, write_synthetic_parquet
+)
+
+DEFAULT_BASELINE = os.path.join("benchmarks", "baseline.json")
+
+def machine_info():
+    """Where the numbers came from; results are only comparable on similar machines."""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "pillow": PIL.__version__,
+    }
+
+def measure(fn, items=1, repeat=5, warmup=1, min_time=0.05):
+    """
+    Times fn() `repeat` times after `warmup` untimed calls. Fast calls are
+    looped until one sample takes at least min_time, like timeit's autorange.
+    Returns median/min seconds per call and items per second at the median.
+    """
+    for _ in range(max(1, warmup)):
+        start = time.perf_counter()
+        fn()
+        once = time.perf_counter() - start
+    number = max(1, int(min_time / once)) if once < min_time else 1
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    median = float(np.median(times))
+    return {"median_s": median, "min_s": float(min(times)), "repeat": repeat, "number": number,
+            "items": items, "items_per_s": items / median if median > 0 else 0.0}
+
+@contextlib.contextmanager
+def quiet():
+    """Silences per-call prints of the code under test."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+# --- Benchmarks: each yields (name, params, result) for every scale ---
+def bench_draw_boxes(scales, repeat):
+    from src.data.labelling.draw_boxes import draw_boxes
+    for (width, height), num_boxes in scales["draw_boxes"]:
+        page, _ = synthetic_page(width, height, num_figures=0, seed=num_boxes)
+        rng = np.random.default_rng(num_boxes)
+        x1 = rng.integers(0, width - 200, num_boxes)
+        y1 = rng.integers(0, height - 200, num_boxes)
+        boxes = np.stack([x1, y1, x1 + rng.integers(50, 200, num_boxes), y1 + rng.integers(50, 200, num_boxes)], axis=1)
+        with quiet():
+            result = measure(lambda: draw_boxes(page, boxes), items=1, repeat=repeat)
+        yield f"draw_boxes[{width}x{height},boxes={num_boxes}]", {"width": width, "height": height, "boxes": num_boxes}, result
+
+def bench_font_scale(scales, repeat):
+    from src.data.labelling.draw_boxes import calculate_max_font_scale
+    for num_calls in scales["font_scale"]:
+        rng = np.random.default_rng(num_calls)
+        sizes = list(zip(rng.integers(20, 800, num_calls).tolist(), rng.integers(20, 600, num_calls).tolist()))
+
+        def run():
+            for i, (w, h) in enumerate(sizes):
+                calculate_max_font_scale(f"IM{i % 20 + 1}", w, h)
+        yield f"calculate_max_font_scale[calls={num_calls}]", {"calls": num_calls}, measure(run, items=num_calls, repeat=repeat)
+
+def bench_extract_response(scales, repeat):
+    from src.data.labelling.post_processor import extract_response, replace_tags_with_normalized_bboxes
+    for num_paragraphs in scales["extract_response"]:
+        text = synthetic_response(num_paragraphs=num_paragraphs, num_figures=4, seed=num_paragraphs)
+        tags = {f"IM{i + 1}": [10 * i, 20, 100 + 10 * i, 200] for i in range(4)}
+
+        def run():
+            extracted = extract_response(text)
+            replace_tags_with_normalized_bboxes(extracted.document or text, tags)
+        params = {"paragraphs": num_paragraphs, "chars": len(text)}
+        yield f"extract_response[chars={len(text)}]", params, measure(run, items=1, repeat=repeat)
+
+def bench_compute_phash(scales, repeat, work_dir):
+    from src.data.scripts.generate_embeddings import compute_phash
+    for (width, height), num_images in scales["compute_phash"]:
+        image_dir = os.path.join(work_dir, f"phash_{width}x{height}_{num_images}")
+        rel_paths = write_synthetic_images(image_dir, num_images, width, height)
+        for reduced in (False, True):
+            def run():
+                for rel_path in rel_paths:
+                    compute_phash((image_dir, rel_path, reduced))
+            name = f"compute_phash[{width}x{height},images={num_images},reduced={reduced}]"
+            params = {"width": width, "height": height, "images": num_images, "reduced_decode": reduced}
+            yield name, params, measure(run, items=num_images, repeat=repeat)
+
+def bench_hex_encoding(scales, repeat):
+    # get_hex_from_hash was replaced by the vectorized hashes_to_hex on packed uint64 hashes
+    from src.data.scripts.batch_phash import hashes_to_hex
+    for num_hashes in scales["hex"]:
+        hashes = np.random.default_rng(num_hashes).integers(0, 2**63, num_hashes, dtype=np.uint64)
+        yield f"hashes_to_hex[n={num_hashes}]", {"hashes": num_hashes}, measure(lambda: hashes_to_hex(hashes), items=num_hashes, repeat=repeat)
+
+def bench_parquet_extraction(scales, repeat, work_dir):
+    from src.data.scripts.convert_images import convert_parquet_to_images
+    for num_rows, workers in scales["parquet"]:
+        parquet_path = os.path.join(work_dir, f"extract_{num_rows}.parquet")
+        write_synthetic_parquet(parquet_path, num_rows=num_rows)
+        out_dir = os.path.join(work_dir, f"extract_{num_rows}_out")
+
+        def run():
+            shutil.rmtree(out_dir, ignore_errors=True)
+            convert_parquet_to_images(parquet_path, out_dir, num_workers=workers)
+        with quiet():
+            result = measure(run, items=num_rows, repeat=max(1, repeat // 2))
+        yield f"convert_parquet_to_images[rows={num_rows},workers={workers}]", {"rows": num_rows, "workers": workers}, result
+
+BENCHMARKS = {
+    "draw_boxes": bench_draw_boxes,
+    "font_scale": bench_font_scale,
+    "extract_response": bench_extract_response,
+    "compute_phash": bench_compute_phash,
+    "hex": bench_hex_encoding,
+    "parquet": bench_parquet_extraction,
+}
+NEEDS_WORK_DIR = {"compute_phash", "parquet"}
+
+SCALES = {
+    "quick": {
+        "draw_boxes": [((1240, 1754), 2), ((1240, 1754), 8)],
+        "font_scale": [200],
+        "extract_response": [20, 200],
+        "compute_phash": [((1240, 1754), 8)],
+        "hex": [10_000],
+        "parquet": [(32, 2)],
+    },
+    "full": {
+        "draw_boxes": [((1240, 1754), 2), ((1240, 1754), 8), ((2480, 3508), 8), ((2480, 3508), 32)],
+        "font_scale": [200, 2000],
+        "extract_response": [20, 200, 2000],
+        "compute_phash": [((1240, 1754), 32), ((2480, 3508), 16)],
+        "hex": [10_000, 1_000_000],
+        "parquet": [(128, 2), (512, max(1, mp.cpu_count() - 1))],
+    },
+}
+
+def run_suite(scale="quick", only=None, repeat=5):
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for group, bench in BENCHMARKS.items():
+            if only and group not in only:
+                continue
+            args = (SCALES[scale], repeat, work_dir) if group in NEEDS_WORK_DIR else (SCALES[scale], repeat)
+            for name, params, result in bench(*args):
+                results[name] = {"group": group, "params": params, **result}
+                print(f"{name:<60} {result['median_s'] * 1000:10.2f} ms  {result['items_per_s']:10.1f} items/s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Prints current vs baseline medians. Returns the names that got slower than the tolerance."""
+    regressions = []
+    print("\n" + "=" * 86)
+    print(f"{'Benchmark':<60} | {'baseline':>9} | {'ratio':>6} |")
+    print("-" * 86)
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            print(f"{name:<60} | {'-':>9} | {'new':>6} |")
+            continue
+        ratio = result["median_s"] / base["median_s"] if base["median_s"] > 0 else 1.0
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<60} | {base['median_s'] * 1000:7.2f}ms | {ratio:5.2f}x | {flag}")
+    print("=" * 86)
+    if baseline.get("machine") != machine_info():
+        print("Note: baseline was recorded on a different machine/environment.")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline hot paths on synthetic data (offline, CPU)")
+    parser.add_argument("--scale", choices=list(SCALES), default="quick")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run only these benchmark groups")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=str, default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run_suite(args.scale, args.only, args.repeat)
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "scale": args.scale,
+        "machine": machine_info(),
+        "results": results,
+    }
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"FAIL: {len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance * 100:.0f}%")
+            sys.exit(1)
+        print("OK")
+    else:
+        print(f"No baseline at {args.baseline} (create one with --save-baseline).")
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ warnings.simplefilter('ignore', Image.DecompressionBombWarning)
 from tqdm.auto import tqdm
 import multiprocessing as mp
 from concurrent.futures import ProcessPoolExecutor
+from src.data.scripts.stage_metrics import metrics, add_metrics_args, configure_from_args
 
 def save_image(args):
     """Worker function to save a single image."""
@@ -99,8 +100,12 @@ def convert_parquet_to_images(parquet_path, output_dir, num_workers=None, limit=
             tasks = [(img, path, output_dir) for img, path in zip(images, paths)]
 
             # Execute tasks
-            results = list(executor.map(save_image, tasks))
-            processed_count += sum(1 for r in results if r)
+            with metrics.stage("extraction.save_batch"):
+                results = list(executor.map(save_image, tasks))
+            saved = sum(1 for r in results if r)
+            metrics.inc("extraction.images", saved)
+            metrics.inc("extraction.failed_images", len(results) - saved)
+            processed_count += saved
 
     print(f"Successfully converted {processed_count} images to {output_dir}")
 
@@ -110,8 +115,10 @@ def main():
     parser.add_argument("--output", type=str, required=True, help="Directory to save images")
     parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
     parser.add_argument("--limit", type=int, default=None, help="Limit the number of images to process")
+    add_metrics_args(parser)
 
     args = parser.parse_args()
+    configure_from_args(args)
 
     convert_parquet_to_images(args.input, args.output, args.workers, args.limit)
 
@@ -0,0 +1,130 @@
+import os
+import re
+import numpy as np
+from tqdm.auto import tqdm
+from src.data.scripts.hamming_index import hamming_distance
+
+PAGE_SUFFIX = re.compile(r"_page_\d+$")
+
+def document_ids(paths):
+    """
+    Maps each relative page path to an integer source-document id.
+    The document is the parent directory if there is one, otherwise the file
+    stem without its '_page_N' suffix (flattened names like 'doc_page_35.webp').
+    """
+    docs = []
+    for p in paths:
+        parent = os.path.dirname(p)
+        docs.append(parent if parent else PAGE_SUFFIX.sub("", os.path.splitext(os.path.basename(p))[0]))
+    _, ids = np.unique(np.array(docs), return_inverse=True)
+    return ids.ravel()
+
+def prefix_buckets(hashes, bits=12):
+    """Coarse hash clusters: the top `bits` bits of each pHash."""
+    return (np.asarray(hashes, dtype=np.uint64) >> np.uint64(64 - bits)).astype(np.int64)
+
+def stratified_selection(strata, n, seed=0):
+    """
+    Cluster-then-stratify: takes items round-robin across strata (one per stratum
+    per round, random order inside a stratum), so small strata are fully covered
+    before large ones contribute a second item. Returns selected indices.
+    """
+    strata = np.asarray(strata)
+    rng = np.random.default_rng(seed)
+    tiebreak = rng.random(len(strata))
+    # Rank of each item inside its stratum, in random order
+    order = np.lexsort((tiebreak, strata))
+    sorted_strata = strata[order]
+    starts = np.flatnonzero(np.r_[True, sorted_strata[1:] != sorted_strata[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    rank = np.empty(len(strata), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - group_start
+    # Round-robin: all rank-0 items first, then rank-1, ...
+    return np.lexsort((tiebreak, rank))[:n]
+
+def farthest_point_sampling(hashes, n, seed=0, pool_size=None):
+    """
+    Greedy farthest-point sampling in Hamming space. Each step picks the hash
+    farthest from everything chosen so far, updating a running min-distance
+    array with one vectorized XOR + popcount over the pool.
+    pool_size bounds time and memory on very large corpora by running on a
+    uniform random subset. Once every remaining hash duplicates a chosen one,
+    the rest is drawn at random from the unselected items.
+    Returns unique selected indices into hashes.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    rng = np.random.default_rng(seed)
+    pool = np.arange(len(hashes))
+    if pool_size and pool_size < len(hashes):
+        pool = np.sort(rng.choice(len(hashes), size=pool_size, replace=False))
+    pool_hashes = hashes[pool]
+    n = min(n, len(pool))
+    if n <= 0:
+        # Empty store, or dedupe removed everything
+        return np.empty(0, dtype=np.int64)
+
+    selected = np.empty(n, dtype=np.int64)
+    # Signed so chosen items can be masked out of the argmax with -1
+    min_dist = np.full(len(pool), 255, dtype=np.int16)
+    current = rng.integers(len(pool))
+    for step in tqdm(range(n), desc="Farthest-point sampling", leave=False):
+        selected[step] = current
+        np.minimum(min_dist, hamming_distance(pool_hashes, pool_hashes[current]), out=min_dist)
+        min_dist[current] = -1
+        current = int(np.argmax(min_dist))
+        if min_dist[current] <= 0 and step + 1 < n:
+            # Only exact duplicates of chosen hashes are left: no point is farther than another
+            rest = np.flatnonzero(min_dist >= 0)
+            selected[step + 1:] = rng.choice(rest, size=n - step - 1, replace=False)
+            break
+    return pool[selected]
+
+def nearest_neighbor_distances(hashes, sample_size=2000, batch_size=256, seed=0):
+    """
+    Hamming distance from each of (up to) sample_size items to its nearest other
+    item in the set, computed in batches so memory stays at batch_size x N bytes.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    rng = np.random.default_rng(seed)
+    sample = np.arange(len(hashes))
+    if len(hashes) > sample_size:
+        sample = rng.choice(len(hashes), size=sample_size, replace=False)
+
+    nn = np.empty(len(sample), dtype=np.uint8)
+    for start in range(0, len(sample), batch_size):
+        idx = sample[start:start + batch_size]
+        dist = hamming_distance(hashes[idx][:, None], hashes[None, :])
+        # Exclude each item's distance to itself
+        dist[np.arange(len(idx)), idx] = 255
+        nn[start:start + batch_size] = dist.min(axis=1)
+    return nn
+
+def diversity_report(hashes, doc_ids=None, duplicate_distance=4, prefix_bits=12):
+    """Coverage and spread statistics of a selected set of hashes."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    nn = nearest_neighbor_distances(hashes) if len(hashes) > 1 else np.zeros(0, dtype=np.uint8)
+    report = {
+        "size": int(len(hashes)),
+        "unique_hashes": int(len(np.unique(hashes))),
+        "prefix_buckets": int(len(np.unique(prefix_buckets(hashes, prefix_bits)))),
+        "mean_nn_distance": float(nn.mean()) if len(nn) else 0.0,
+        "near_duplicate_rate": float((nn <= duplicate_distance).mean()) if len(nn) else 0.0,
+    }
+    if doc_ids is not None:
+        report["documents"] = int(len(np.unique(doc_ids)))
+    return report
+
+def print_diversity_comparison(reports):
+    """Prints diversity reports side by side, e.g. {"hash-order": ..., "fps": ...}."""
+    names = list(reports)
+    keys = list(reports[names[0]])
+    print("\n" + "=" * (24 + 16 * len(names)))
+    print(f"{'Metric':<24}" + "".join(f"{name:>16}" for name in names))
+    print("-" * (24 + 16 * len(names)))
+    for key in keys:
+        row = f"{key:<24}"
+        for name in names:
+            value = reports[name].get(key, "")
+            row += f"{value:>16.3f}" if isinstance(value, float) else f"{value:>16}"
+        print(row)
+    print("=" * (24 + 16 * len(names)))
@@ -9,12 +9,16 @@ import argparse
 from PIL import Image
 Image.MAX_IMAGE_PIXELS = 20000000
 warnings.simplefilter('ignore', Image.DecompressionBombWarning)
-from huggingface_hub import hf_hub_download, list_repo_files
 from tqdm.auto import tqdm
 import pyarrow.parquet as pq
 import shutil
-import imagehash
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
+from src.data.scripts.hash_decode import open_for_hash
+from src.data.scripts.batch_phash import phash_thumbnail, phash_batch, phash_image
+from src.data.scripts.hash_store import write_shard, shard_path, consolidate, LOCAL_SHARD
+from src.data.scripts.stage_metrics import metrics, add_metrics_args, configure_from_args
+from src.data.scripts.shard_scheduler import HubSource, LocalSource, ShardProgress, run_shard_scheduler
+from src.data.scripts.sharding import select_shard, shard_suffix, sharded_path, add_shard_args, check_shard_args
 
 # --- 1. Configuration ---
 # Set workers to CPU count // 2 to avoid OOM and Pipe pressure
@@ -29,15 +33,61 @@ if __name__ == "__main__":
 # --- 2. Dataset Class for Disk Loading ---
 def compute_phash(args):
     """Worker function to compute pHash for a single image."""
-    image_root, rel_path = args
+    image_root, rel_path, reduced_decode = args
     img_path = os.path.join(image_root, rel_path)
     try:
+        if reduced_decode:
+            return phash_image(open_for_hash(img_path)), rel_path, True
         with Image.open(img_path) as img:
-            # Generate pHash and convert to flat boolean array (64 bits)
-            hash_obj = imagehash.phash(img, hash_size=HASH_SIZE)
-            return hash_obj.hash.flatten().astype(np.float32), rel_path, True
+            return phash_image(img), rel_path, True
     except Exception:
-        return np.zeros(HASH_SIZE * HASH_SIZE, dtype=np.float32), rel_path, False
+        return np.uint64(0), rel_path, False
+
+def hash_row_groups(args):
+    """
+    Worker function to hash a range of Arrow row groups of a parquet file.
+    Image bytes are decoded in memory, nothing is written to disk, and the
+    thumbnails of the whole range are hashed in one batch.
+    Returns (hashes, valid_paths, locations, num_failed), where locations holds
+    the (row group, row offset) of every valid path.
+    """
+    parquet_path, row_groups, reduced_decode = args
+    parquet_file = pq.ParquetFile(parquet_path)
+    thumbnails = []
+    valid_paths = []
+    locations = []
+    num_failed = 0
+
+    for rg in row_groups:
+        offset = 0
+        for batch in parquet_file.iter_batches(batch_size=BATCH_SIZE, row_groups=[rg],
+                                               columns=['image', 'path']):
+            images = batch.column('image').to_pylist()
+            paths = batch.column('path').to_pylist()
+            for img_bytes, rel_path in zip(images, paths):
+                row_offset = offset
+                offset += 1
+                # If it's a dict (HF format), get bytes
+                if isinstance(img_bytes, dict):
+                    img_bytes = img_bytes.get('bytes')
+                if img_bytes is None:
+                    num_failed += 1
+                    continue
+                try:
+                    if reduced_decode:
+                        thumbnails.append(phash_thumbnail(open_for_hash(img_bytes)))
+                    else:
+                        with Image.open(io.BytesIO(img_bytes)) as img:
+                            thumbnails.append(phash_thumbnail(img))
+                    valid_paths.append(rel_path)
+                    locations.append((rg, row_offset))
+                except Exception:
+                    num_failed += 1
+
+    locations = np.array(locations, dtype=np.uint32).reshape(-1, 2)
+    if not thumbnails:
+        return np.zeros(0, dtype=np.uint64), valid_paths, locations, num_failed
+    return phash_batch(np.stack(thumbnails), hash_size=HASH_SIZE), valid_paths, locations, num_failed
 
 def save_single_image(args):
     """Worker function to save a single image to disk."""
@@ -59,6 +109,55 @@ def save_single_image(args):
         return False
 
 # --- 3. Helper Functions ---
+def row_locations(parquet_file, rows):
+    """Converts global row indices of a parquet file to (row group, row offset) pairs."""
+    metadata = parquet_file.metadata
+    starts = np.cumsum([0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+    rows = np.asarray(rows, dtype=np.int64)
+    row_groups = np.searchsorted(starts, rows, side='right') - 1
+    return np.stack([row_groups, rows - starts[row_groups]], axis=1).astype(np.uint32)
+
+def hash_parquet_via_disk(parquet_path, filename, temp_image_dir, workers, reduced_decode=False):
+    """
+    Extracts all images of a parquet to disk, then hashes them from disk.
+    Returns (hashes, valid_paths, locations).
+    """
+    print(f"Extracting images from {filename}...")
+    parquet_file = pq.ParquetFile(parquet_path)
+    all_paths = []
+
+    # Step 1: Extract all images to disk first (Safer approach)
+    os.makedirs(temp_image_dir, exist_ok=True)
+    num_batches = (parquet_file.metadata.num_rows // 1024) + 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in tqdm(parquet_file.iter_batches(batch_size=1024),
+                         total=num_batches, desc=f"Extracting {filename}", leave=False):
+            batch_dict = batch.to_pydict()
+            images = batch_dict.get('image', [])
+            paths = batch_dict.get('path', [])
+
+            tasks = [(img, path, temp_image_dir) for img, path in zip(images, paths)]
+            list(executor.map(save_single_image, tasks))
+            all_paths.extend(paths)
+
+    # Step 2: Generate hashes from disk
+    tqdm.write(f"Generating hashes for {len(all_paths)} images...")
+
+    all_hashes = []
+    valid_paths = []
+    valid_rows = []
+
+    tasks = [(temp_image_dir, path, reduced_decode) for path in all_paths]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for row, (hash_value, path, success) in enumerate(tqdm(executor.map(compute_phash, tasks),
+                                                               total=len(tasks), desc="  → Hashing", leave=False)):
+            if success:
+                all_hashes.append(hash_value)
+                valid_paths.append(path)
+                valid_rows.append(row)
+
+    return all_hashes, valid_paths, row_locations(parquet_file, valid_rows)
 
 # --- 4. Main Processing Logic ---
 def main():
@@ -68,21 +167,39 @@ def main():
     parser.add_argument("--output-dir", type=str, default="data/toanmath_embeddings", help="Base directory for embeddings")
     parser.add_argument("--workers", type=int, default=NUM_WORKERS)
     parser.add_argument("--limit", type=int, help="Limit number of files/images to process")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="Hash parquet images in memory (single pass, no temp image files)")
+    parser.add_argument("--parquet-dir", type=str,
+                        help="Local directory of parquet files used instead of --repo (implies --in-memory)")
+    parser.add_argument("--prefetch", type=int, default=1, help="Shards to download ahead of hashing (in-memory mode)")
+    parser.add_argument("--concurrent-shards", type=int, default=1, help="Shards hashed at the same time (in-memory mode)")
+    parser.add_argument("--disk-budget-gb", type=float, help="Max size of downloaded shards kept on disk at once")
+    parser.add_argument("--reduced-decode", action="store_true",
+                        help="Decode images at reduced resolution before hashing (faster, near-identical hashes)")
+    add_shard_args(parser, "parquet files (or local images)")
+    add_metrics_args(parser)
 
     args = parser.parse_args()
+    check_shard_args(args)
+    configure_from_args(args)
 
-    # Paths setup
+    # Paths setup. Each shard of a multi-machine run keeps its own progress file;
+    # per-parquet outputs never collide, and merge_shards combines them.
     embed_dir = os.path.join(args.output_dir, 'embeddings')
-    progress_file = os.path.join(args.output_dir, 'progress.json')
+    progress_file = sharded_path(os.path.join(args.output_dir, 'progress.json'), args.shard_index, args.num_shards)
     local_temp_dir = os.path.join(os.getcwd(), 'temp_data')
     os.makedirs(embed_dir, exist_ok=True)
 
     if args.image_dir:
         # Local Image mode
         process_local_images(args, embed_dir)
+    elif args.in_memory or args.parquet_dir:
+        # Parquet mode with download/compute overlap and row-group progress
+        process_parquet_shards(args, embed_dir, progress_file, local_temp_dir)
     else:
         # HF Parquet mode
         process_hf_repo(args, embed_dir, progress_file, local_temp_dir)
+    metrics.print_summary("hashing")
 
 def process_local_images(args, embed_dir):
     """Processes images from a local directory."""
@@ -93,34 +210,33 @@ def process_local_images(args, embed_dir):
             if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
                 image_paths.append(os.path.relpath(os.path.join(root, f), args.image_dir))
 
+    image_paths = select_shard(sorted(image_paths), args.shard_index, args.num_shards)
     if args.limit:
         image_paths = image_paths[:args.limit]
 
     print(f"Found {len(image_paths)} images.")
 
-    all_embeddings = []
+    all_hashes = []
     valid_paths = []
 
-    tasks = [(args.image_dir, path) for path in image_paths]
+    tasks = [(args.image_dir, path, args.reduced_decode) for path in image_paths]
 
     with ProcessPoolExecutor(max_workers=args.workers) as executor:
-        for features, path, success in tqdm(executor.map(compute_phash, tasks),
-                                           total=len(tasks), desc="Generating hashes"):
+        for hash_value, path, success in tqdm(executor.map(compute_phash, tasks),
+                                             total=len(tasks), desc="Generating hashes"):
             if success:
-                all_embeddings.append(features)
+                all_hashes.append(hash_value)
                 valid_paths.append(path)
 
-    if all_embeddings:
-        save_path = os.path.join(embed_dir, "local_images.npz")
-        np.savez_compressed(
-            save_path,
-            embeddings=np.vstack(all_embeddings),
-            paths=np.array(valid_paths)
-        )
-        print(f"Saved embeddings to {save_path}")
+    # Written even when empty, so merge_shards can tell an empty shard from a missing one
+    save_path = os.path.join(embed_dir, f"{LOCAL_SHARD}{shard_suffix(args.shard_index, args.num_shards)}.npz")
+    write_shard(save_path, all_hashes, valid_paths)
+    print(f"Saved {len(all_hashes)} hashes to {save_path}")
 
 def process_hf_repo(args, embed_dir, progress_file, local_temp_dir):
     """Processes parquets from a HuggingFace repo (extracting to images first)."""
+    from huggingface_hub import hf_hub_download, list_repo_files
+
     # Closure to handle global-like progress file
     def load_prog():
         if os.path.exists(progress_file):
@@ -136,7 +252,7 @@ def process_hf_repo(args, embed_dir, progress_file, local_temp_dir):
             json.dump(progress_data, f, indent=4)
 
     all_files = list_repo_files(repo_id=args.repo, repo_type="dataset")
-    parquet_files = sorted([f for f in all_files if f.endswith('.parquet')])
+    parquet_files = select_shard(sorted([f for f in all_files if f.endswith('.parquet')]), args.shard_index, args.num_shards)
     progress = load_prog()
     files_to_process = [f for f in parquet_files if f not in progress["processed_files"]]
 
@@ -144,7 +260,7 @@ def process_hf_repo(args, embed_dir, progress_file, local_temp_dir):
         files_to_process = files_to_process[:args.limit]
 
     for filename in tqdm(files_to_process, desc="Files"):
-        save_path = os.path.join(embed_dir, filename.replace('.parquet', '.npz'))
+        save_path = shard_path(embed_dir, filename)
         temp_image_dir = os.path.join(local_temp_dir, "extracted_images", filename.replace('.parquet', ''))
 
         try:
@@ -153,47 +269,12 @@ def process_hf_repo(args, embed_dir, progress_file, local_temp_dir):
                 repo_type="dataset", local_dir=local_temp_dir
             )
 
-            print(f"Extracting images from {filename}...")
-            parquet_file = pq.ParquetFile(downloaded_path)
-            all_paths = []
-
-            # Step 1: Extract all images to disk first (Safer approach)
-            os.makedirs(temp_image_dir, exist_ok=True)
-            num_batches = (parquet_file.metadata.num_rows // 1024) + 1
-            with ProcessPoolExecutor(max_workers=args.workers) as executor:
-                for batch in tqdm(parquet_file.iter_batches(batch_size=1024),
-                                 total=num_batches, desc=f"Extracting {filename}", leave=False):
-                    batch_dict = batch.to_pydict()
-                    images = batch_dict.get('image', [])
-                    paths = batch_dict.get('path', [])
-
-                    tasks = [(img, path, temp_image_dir) for img, path in zip(images, paths)]
-                    list(executor.map(save_single_image, tasks))
-                    all_paths.extend(paths)
-
-            # Step 2: Generate hashes from disk
-            tqdm.write(f"Generating hashes for {len(all_paths)} images...")
-
-            all_embeddings = []
-            valid_paths = []
-
-            tasks = [(temp_image_dir, path) for path in all_paths]
-
-            with ProcessPoolExecutor(max_workers=args.workers) as executor:
-                for features, path, success in tqdm(executor.map(compute_phash, tasks),
-                                                   total=len(tasks), desc="  → Hashing", leave=False):
-                    if success:
-                        all_embeddings.append(features)
-                        valid_paths.append(path)
-
-            if all_embeddings:
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                np.savez_compressed(
-                    save_path,
-                    embeddings=np.vstack(all_embeddings),
-                    paths=np.array(valid_paths)
-                )
-                save_prog(filename, progress)
+            all_hashes, valid_paths, locations = hash_parquet_via_disk(
+                downloaded_path, filename, temp_image_dir, args.workers, reduced_decode=args.reduced_decode)
+
+            # An empty shard marks a parquet whose images all failed as done
+            write_shard(save_path, all_hashes, valid_paths, locations)
+            save_prog(filename, progress)
 
         except Exception as e:
             print(f"Error processing {filename}: {e}")
@@ -205,5 +286,44 @@ def process_hf_repo(args, embed_dir, progress_file, local_temp_dir):
             if 'downloaded_path' in locals() and os.path.exists(downloaded_path):
                 os.remove(downloaded_path)
 
+    consolidate_unless_sharded(args, embed_dir)
+
+def process_parquet_shards(args, embed_dir, progress_file, local_temp_dir):
+    """
+    Hashes parquet shards in memory from a HuggingFace repo or a local parquet directory.
+    Downloads of the next shards overlap with hashing, and progress is recorded per
+    row group so an interrupted shard resumes where it stopped.
+    """
+    if args.parquet_dir:
+        source = LocalSource(args.parquet_dir)
+    else:
+        source = HubSource(args.repo, local_temp_dir)
+
+    progress = ShardProgress(progress_file, os.path.join(args.output_dir, 'partial' + shard_suffix(args.shard_index, args.num_shards)))
+    files = source.list_files()
+    files_to_process = [f for f in select_shard(sorted(files), args.shard_index, args.num_shards) if not progress.is_done(f)]
+
+    if args.limit:
+        files_to_process = files_to_process[:args.limit]
+
+    disk_budget = int(args.disk_budget_gb * 1024 ** 3) if args.disk_budget_gb else None
+    run_shard_scheduler(
+        source, {f: files[f] for f in files_to_process}, embed_dir, progress,
+        hash_row_groups, hash_args=(args.reduced_decode,),
+        workers=args.workers, prefetch=args.prefetch,
+        concurrent_shards=args.concurrent_shards, disk_budget=disk_budget
+    )
+
+    consolidate_unless_sharded(args, embed_dir)
+
+def consolidate_unless_sharded(args, embed_dir):
+    """Merges all per-shard files into one memory-mappable store; sharded runs are merged with merge_shards."""
+    if args.num_shards > 1:
+        print(f"Shard {args.shard_index}/{args.num_shards} done. Once every shard has finished, build the store with:\n"
+              f"  python -m src.data.cli merge hashes <output dirs of all shards> --output <dir>")
+        return
+    store_path = consolidate(embed_dir)
+    print(f"Consolidated hash store written to {store_path}")
+
 if __name__ == "__main__":
     main()
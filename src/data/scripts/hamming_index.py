@@ -0,0 +1,195 @@
+import numpy as np
+
+HASH_BITS = 64
+ALL_BITS = (1 << HASH_BITS) - 1
+# Runs of one chunk key longer than this are split again on the remaining bits
+MAX_RUN = 64
+
+# Byte popcount table, used when np.bitwise_count (numpy >= 2.0) is unavailable
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount64(x):
+    """Vectorized popcount of a uint64 array."""
+    x = np.asarray(x, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x).astype(np.uint8)
+    return _POPCOUNT_TABLE[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def hamming_distance(a, b):
+    """Element-wise (broadcasting) Hamming distance between uint64 hashes."""
+    return popcount64(np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64)))
+
+def split_mask(mask, num_chunks):
+    """Splits the set bits of mask into num_chunks masks of consecutive set bits, as equal as possible."""
+    bits = [b for b in range(HASH_BITS - 1, -1, -1) if mask >> b & 1]
+    masks = []
+    for i in range(num_chunks):
+        part = bits[len(bits) * i // num_chunks:len(bits) * (i + 1) // num_chunks]
+        masks.append(sum(1 << b for b in part))
+    return masks
+
+def chunk_ranges(num_chunks, bits=HASH_BITS):
+    """Splits the hash bits into num_chunks contiguous (shift, width) ranges."""
+    widths = [bits // num_chunks + (1 if i < bits % num_chunks else 0) for i in range(num_chunks)]
+    ranges = []
+    shift = bits
+    for width in widths:
+        shift -= width
+        ranges.append((shift, width))
+    return ranges
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over 64-bit pHashes.
+    The hash is split into max_distance + 1 chunks; by the pigeonhole principle
+    two hashes within max_distance agree exactly on at least one chunk, so each
+    chunk is a sorted exact-match table and candidates are verified with popcount.
+    Identical hashes are collapsed first, so exact duplicates cost nothing.
+    """
+
+    def __init__(self, hashes, max_distance=4):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"max_distance must be in [0, {HASH_BITS}), got {max_distance}")
+        self.max_distance = max_distance
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        # unique_hashes[inverse] == hashes
+        self.unique_hashes, self.inverse = np.unique(self.hashes, return_inverse=True)
+        self.inverse = self.inverse.ravel()
+
+        self.chunks = []
+        for shift, width in chunk_ranges(max_distance + 1):
+            keys = (self.unique_hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            order = np.argsort(keys, kind='stable')
+            self.chunks.append((shift, width, keys[order], order))
+
+        # Members of each unique hash, for expanding results back to corpus ids
+        self._members_order = np.argsort(self.inverse, kind='stable')
+        self._members_start = np.searchsorted(self.inverse[self._members_order],
+                                              np.arange(len(self.unique_hashes) + 1))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _expand(self, unique_ids):
+        """Returns corpus ids of every hash equal to one of unique_ids."""
+        if len(unique_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([
+            self._members_order[self._members_start[u]:self._members_start[u + 1]] for u in unique_ids
+        ])
+
+    def query(self, h, max_distance=None):
+        """
+        Finds all corpus entries within max_distance of hash h.
+        Returns (ids, distances) sorted by distance.
+        """
+        d = self.max_distance if max_distance is None else max_distance
+        if d > self.max_distance:
+            raise ValueError(f"Index was built for max_distance={self.max_distance}, got {d}")
+        h = np.uint64(h)
+
+        candidates = []
+        for shift, width, sorted_keys, order in self.chunks:
+            key = (h >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            lo = np.searchsorted(sorted_keys, key, side='left')
+            hi = np.searchsorted(sorted_keys, key, side='right')
+            candidates.append(order[lo:hi])
+        candidates = np.unique(np.concatenate(candidates))
+
+        distances = hamming_distance(self.unique_hashes[candidates], h)
+        matched = candidates[distances <= d]
+        matched_dist = distances[distances <= d]
+
+        ids = self._expand(matched)
+        counts = self._members_start[matched + 1] - self._members_start[matched]
+        ids_dist = np.repeat(matched_dist, counts)
+        order = np.argsort(ids_dist, kind='stable')
+        return ids[order], ids_dist[order]
+
+    def unique_pairs(self, max_distance=None):
+        """
+        All pairs of distinct unique hashes within max_distance, as (i, j) arrays of
+        unique-hash indices (a pair may appear more than once). Each chunk table
+        is scanned with a growing offset k, comparing neighbours that share a
+        chunk key, so the work is vectorized. Runs of one key longer than MAX_RUN
+        (e.g. near-blank pages) are split again on their remaining bits instead.
+        """
+        d = self.max_distance if max_distance is None else max_distance
+        if d > self.max_distance:
+            raise ValueError(f"Index was built for max_distance={self.max_distance}, got {d}")
+        out = []
+        for shift, width, sorted_keys, order in self.chunks:
+            chunk_mask = ((1 << width) - 1) << shift
+            self._scan_runs(sorted_keys, order, ALL_BITS, chunk_mask, d, out)
+        if not out:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate([i for i, _ in out]), np.concatenate([j for _, j in out])
+
+    def _scan_runs(self, sorted_keys, ids, free_mask, chunk_mask, d, out):
+        """
+        Pairs within d among ids sharing a key of one sorted chunk table. Offset k
+        only visits positions whose run extends k further, so the work is the
+        number of same-key pairs; oversized runs go to _close_pairs.
+        """
+        _, starts, counts = np.unique(sorted_keys, return_index=True, return_counts=True)
+        for start, count in zip(starts[counts > MAX_RUN], counts[counts > MAX_RUN]):
+            self._close_pairs(ids[start:start + count], free_mask & ~chunk_mask, d, out)
+        # End (exclusive) of the run of equal keys each position belongs to
+        run_end = np.repeat(starts + np.where(counts > MAX_RUN, 0, counts), counts)
+        pos = np.flatnonzero(run_end - np.arange(len(sorted_keys)) > 1)
+        k = 1
+        while len(pos):
+            i, j = ids[pos], ids[pos + k]
+            close = hamming_distance(self.unique_hashes[i], self.unique_hashes[j]) <= d
+            out.append((i[close], j[close]))
+            k += 1
+            pos = pos[pos + k < run_end[pos]]
+
+    def _close_pairs(self, ids, free_mask, d, out):
+        """
+        Pairs within d among ids whose hashes agree outside free_mask. The free
+        bits are split into d + 1 chunks again (the pigeonhole argument holds on
+        them alone); small groups are compared all against all.
+        """
+        hashes = self.unique_hashes[ids]
+        if len(ids) <= MAX_RUN or bin(free_mask).count('1') <= d:
+            # With at most d free bits there are at most 2**d distinct hashes here
+            i, j = np.triu_indices(len(ids), 1)
+            close = hamming_distance(hashes[i], hashes[j]) <= d
+            out.append((ids[i[close]], ids[j[close]]))
+            return
+        for chunk_mask in split_mask(free_mask, d + 1):
+            keys = hashes & np.uint64(chunk_mask)
+            order = np.argsort(keys, kind='stable')
+            self._scan_runs(keys[order], ids[order], free_mask, chunk_mask, d, out)
+
+    def clusters(self, max_distance=None):
+        """
+        Groups the corpus into near-duplicate clusters (connected components of
+        the 'within max_distance' graph). Returns a cluster label per corpus entry.
+        """
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        n = len(self.unique_hashes)
+        i, j = self.unique_pairs(max_distance)
+        graph = coo_matrix((np.ones(len(i), dtype=np.int32), (i, j)), shape=(n, n))
+        _, unique_labels = connected_components(graph, directed=False)
+        return unique_labels[self.inverse]
+
+def cluster_representatives(labels):
+    """Returns the first corpus index of every cluster, in corpus order."""
+    _, first = np.unique(labels, return_index=True)
+    return np.sort(first)
+
+def cluster_report(labels):
+    """Summary statistics of a cluster labelling."""
+    sizes = np.bincount(labels)
+    sizes = sizes[sizes > 0]
+    return {
+        "num_items": int(len(labels)),
+        "num_clusters": int(len(sizes)),
+        "num_duplicates": int(len(labels) - len(sizes)),
+        "largest_cluster": int(sizes.max()) if len(sizes) else 0,
+        "clusters_with_duplicates": int((sizes > 1).sum()),
+    }
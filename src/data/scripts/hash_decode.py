@@ -0,0 +1,89 @@
+import io
+import warnings
+import numpy as np
+from PIL import Image
+Image.MAX_IMAGE_PIXELS = 20000000
+warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_GRAY
+except ImportError:  # pyturbojpeg (or libturbojpeg) is optional
+    TurboJPEG = None
+
+# pHash only looks at a 32x32 grayscale thumbnail, so decoding the
+# shorter side to ~256px keeps the LANCZOS downscale close to the full-size one
+HASH_DECODE_SIZE = 256
+
+_turbo = None
+
+def get_turbojpeg():
+    """Returns a process-wide TurboJPEG instance, or None if unavailable."""
+    global _turbo
+    if _turbo is None and TurboJPEG is not None:
+        try:
+            _turbo = TurboJPEG()
+        except Exception:
+            # Python bindings installed but the shared library is missing
+            return None
+    return _turbo
+
+def is_jpeg(data):
+    return data[:3] == b'\xff\xd8\xff'
+
+def turbojpeg_scaling_factor(turbo, width, height, min_side):
+    """Picks the smallest TurboJPEG scaling factor that keeps the shorter side >= min_side."""
+    best = (1, 1)
+    short_side = min(width, height)
+    for num, denom in turbo.scaling_factors:
+        # Only downscaling factors are useful here
+        if num >= denom:
+            continue
+        if short_side * num // denom >= min_side and num / denom < best[0] / best[1]:
+            best = (num, denom)
+    return best
+
+def decode_jpeg_turbo(data, min_side=HASH_DECODE_SIZE):
+    """Decodes a JPEG straight to grayscale at a reduced DCT scale. Returns None if TurboJPEG is unavailable."""
+    turbo = get_turbojpeg()
+    if turbo is None:
+        return None
+    width, height, _, _ = turbo.decode_header(data)
+    scaling_factor = turbojpeg_scaling_factor(turbo, width, height, min_side)
+    arr = turbo.decode(data, pixel_format=TJPF_GRAY, scaling_factor=scaling_factor)
+    return Image.fromarray(np.ascontiguousarray(arr[:, :, 0]))
+
+def reduce_to_min_side(img, min_side=HASH_DECODE_SIZE):
+    """Integer box-reduces an already decoded image so the shorter side stays >= min_side."""
+    factor = min(img.size) // min_side
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+def open_for_hash(source, min_side=HASH_DECODE_SIZE, use_turbojpeg=True):
+    """
+    Opens an image (path or encoded bytes) at the smallest resolution sufficient for pHash.
+    - JPEG: TurboJPEG scaled decode, or PIL draft() (DCT scaling) as fallback.
+    - WebP/PNG: Pillow has no scaled decode for these, so the page is decoded once
+      and box-reduced before the LANCZOS resize in imagehash.
+    Returns a grayscale PIL image.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+
+    if use_turbojpeg and is_jpeg(data):
+        try:
+            img = decode_jpeg_turbo(data, min_side)
+            if img is not None:
+                return reduce_to_min_side(img, min_side)
+        except Exception:
+            # Fall back to PIL for anything TurboJPEG refuses
+            pass
+
+    with Image.open(io.BytesIO(data)) as img:
+        # No-op for non-JPEG formats
+        img.draft('L', (min_side, min_side))
+        img = img.convert('L')
+    return reduce_to_min_side(img, min_side)
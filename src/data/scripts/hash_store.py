@@ -0,0 +1,205 @@
+import os
+import glob
+import json
+import numpy as np
+from src.data.scripts.batch_phash import pack_bits
+
+# Single-file store layout (little endian):
+#   MAGIC | uint64 header length | JSON header | padding | 64-byte aligned arrays
+# The header lists the parquet file names (shard table) and the offset/dtype/shape
+# of every array, so the loader can np.memmap each one without reading it.
+MAGIC = b"PHSTORE1"
+ALIGN = 64
+STORE_NAME = "hashes.store"
+LOCAL_SHARD = "local_images"
+RECORD_DTYPE = np.dtype([('hash', '<u8'), ('shard', '<u4'), ('path', '<u4')])
+# Row location of a page inside its parquet: (row group, row offset within the group).
+# Shards hashed before locations were recorded use NO_LOCATION.
+NO_LOCATION = np.uint32(0xFFFFFFFF)
+
+def shard_path(shard_dir, parquet_filename):
+    """Per-shard file written right after a parquet is hashed."""
+    return os.path.join(shard_dir, parquet_filename.replace('.parquet', '.npz'))
+
+def write_shard(save_path, hashes, paths, locations=None):
+    """
+    Writes one shard: packed uint64 hashes, their relative paths and, for parquet
+    shards, an (N, 2) uint32 array of (row group, row offset) locations.
+    """
+    os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+    if locations is None:
+        locations = np.full((len(paths), 2), NO_LOCATION, dtype=np.uint32)
+    np.savez(save_path, hashes=np.asarray(hashes, dtype=np.uint64), paths=np.array(paths, dtype=str),
+             locations=np.asarray(locations, dtype=np.uint32).reshape(-1, 2))
+
+def read_shard(npz_path):
+    """
+    Reads one shard file. Also accepts the legacy format, where hashes were
+    stored as (N, 64) float32 'embeddings' in np.savez_compressed.
+    Returns (hashes uint64, paths list, locations (N, 2) uint32).
+    """
+    with np.load(npz_path) as data:
+        if 'hashes' in data:
+            hashes = data['hashes'].astype(np.uint64)
+        else:
+            hashes = pack_bits(data['embeddings'] > 0.5)
+        paths = data['paths'].tolist()
+        if 'locations' in data:
+            locations = data['locations'].astype(np.uint32).reshape(-1, 2)
+        else:
+            locations = np.full((len(paths), 2), NO_LOCATION, dtype=np.uint32)
+    return hashes, paths, locations
+
+def encode_strings(strings):
+    """Builds a string table: (utf-8 blob as uint8, int64 offsets of length N+1)."""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def write_store(out_path, hashes, shard_ids, paths, shards, locations=None):
+    """Writes the consolidated single-file store."""
+    path_blob, path_offsets = encode_strings(paths)
+    if locations is None:
+        locations = np.full((len(paths), 2), NO_LOCATION, dtype=np.uint32)
+    locations = np.asarray(locations, dtype=np.uint32).reshape(-1, 2)
+    arrays = {
+        'hashes': np.ascontiguousarray(hashes, dtype='<u8'),
+        'shard_ids': np.ascontiguousarray(shard_ids, dtype='<u4'),
+        'row_groups': np.ascontiguousarray(locations[:, 0], dtype='<u4'),
+        'row_offsets': np.ascontiguousarray(locations[:, 1], dtype='<u4'),
+        'path_offsets': path_offsets.astype('<i8'),
+        'path_blob': path_blob,
+    }
+
+    # Offsets depend on the header length, so lay out relative offsets first
+    layout = {}
+    rel = 0
+    for name, arr in arrays.items():
+        rel = _align(rel)
+        layout[name] = [rel, arr.dtype.str, list(arr.shape)]
+        rel += arr.nbytes
+    header = {"count": len(arrays['hashes']), "shards": list(shards), "arrays": layout}
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array(len(header_bytes), dtype='<u8').tobytes())
+        f.write(header_bytes)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name][0])
+            f.write(arr.tobytes())
+        f.truncate(data_start + _align(rel))
+    os.replace(tmp_path, out_path)
+
+def is_local_shard(rel_path):
+    """local_images.npz, or local_images-00000-of-00004.npz of a sharded local run."""
+    return os.path.basename(rel_path).startswith(LOCAL_SHARD)
+
+def parquet_shard_files(shard_dir):
+    """
+    Per-parquet shard files under shard_dir as {parquet name in the repo: npz path}
+    (e.g. data/train-00000.parquet -> shard_dir/data/train-00000.npz).
+    """
+    shard_files = {}
+    for npz_path in glob.glob(os.path.join(shard_dir, "**", "*.npz"), recursive=True):
+        rel_path = os.path.relpath(npz_path, shard_dir)
+        if not is_local_shard(rel_path):
+            shard_files[rel_path.replace(os.sep, '/').replace('.npz', '.parquet')] = npz_path
+    return shard_files
+
+def write_store_from_shards(shard_files, out_path):
+    """Writes the store from {parquet name: npz path}, ordered by parquet name so the result is deterministic."""
+    all_hashes, all_shard_ids, all_paths, all_locations, shards = [], [], [], [], []
+    for shard_id, name in enumerate(sorted(shard_files)):
+        hashes, paths, locations = read_shard(shard_files[name])
+        shards.append(name)
+        all_hashes.append(hashes)
+        all_shard_ids.append(np.full(len(hashes), shard_id, dtype=np.uint32))
+        all_paths.extend(paths)
+        all_locations.append(locations)
+
+    hashes = np.concatenate(all_hashes) if all_hashes else np.zeros(0, dtype=np.uint64)
+    shard_ids = np.concatenate(all_shard_ids) if all_shard_ids else np.zeros(0, dtype=np.uint32)
+    locations = np.concatenate(all_locations) if all_locations else np.zeros((0, 2), dtype=np.uint32)
+    write_store(out_path, hashes, shard_ids, all_paths, shards, locations)
+    return out_path
+
+def consolidate(shard_dir, out_path=None):
+    """
+    Merges every per-shard file in shard_dir into one store file
+    (defaults to hashes.store next to shard_dir).
+    Shards are ordered by parquet file name so the result is deterministic.
+    """
+    if out_path is None:
+        out_path = os.path.join(os.path.dirname(os.path.normpath(shard_dir)), STORE_NAME)
+    return write_store_from_shards(parquet_shard_files(shard_dir), out_path)
+
+def stale_shards(shard_dir, store_path):
+    """
+    Parquet names of the shard files in shard_dir that a rebuild of store_path
+    would pick up: written after the store, or not in it. All of them if the
+    store does not exist.
+    """
+    shard_files = parquet_shard_files(shard_dir) if os.path.isdir(shard_dir) else {}
+    if not os.path.exists(store_path):
+        return sorted(shard_files)
+    built = os.stat(store_path).st_mtime_ns
+    known = set(HashStore(store_path).shards)
+    return sorted(name for name, npz_path in shard_files.items()
+                  if name not in known or os.stat(npz_path).st_mtime_ns > built)
+
+class HashStore:
+    """Read-only, memory-mapped view of a consolidated hash store."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a hash store file")
+            header_len = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = _align(len(MAGIC) + 8 + header_len)
+
+        self.shards = header["shards"]
+        arrays = {}
+        for name, (rel, dtype, shape) in header["arrays"].items():
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, mode='r', dtype=dtype, shape=tuple(shape),
+                                         offset=data_start + rel)
+        self.hashes = arrays['hashes']
+        self.shard_ids = arrays['shard_ids']
+        # Stores written before row locations existed have no such arrays
+        self.row_groups = arrays.get('row_groups', np.full(len(self.hashes), NO_LOCATION, dtype=np.uint32))
+        self.row_offsets = arrays.get('row_offsets', np.full(len(self.hashes), NO_LOCATION, dtype=np.uint32))
+        self._path_offsets = arrays['path_offsets']
+        self._path_blob = arrays['path_blob']
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def records(self):
+        """Returns the corpus as a structured array of (hash, shard id, path id)."""
+        records = np.empty(len(self), dtype=RECORD_DTYPE)
+        records['hash'] = self.hashes
+        records['shard'] = self.shard_ids
+        records['path'] = np.arange(len(self), dtype=np.uint32)
+        return records
+
+    def get_path(self, i):
+        start, end = self._path_offsets[i], self._path_offsets[i + 1]
+        return self._path_blob[start:end].tobytes().decode('utf-8')
+
+    def get_paths(self, indices):
+        return [self.get_path(i) for i in indices]
+
+    def get_shard(self, i):
+        return self.shards[self.shard_ids[i]]
@@ -0,0 +1,118 @@
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+from src.data.scripts.layout_loader import load_page
+from src.data.scripts.layout_backends import load_layout_detector, BACKENDS, DEFAULT_ONNX_PATH
+
+def box_iou(a, b):
+    """IoU of two pipeline boxes ({"xmin", "ymin", "xmax", "ymax"})."""
+    ix = max(0, min(a["xmax"], b["xmax"]) - max(a["xmin"], b["xmin"]))
+    iy = max(0, min(a["ymax"], b["ymax"]) - max(a["ymin"], b["ymin"]))
+    inter = ix * iy
+    area_a = (a["xmax"] - a["xmin"]) * (a["ymax"] - a["ymin"])
+    area_b = (b["xmax"] - b["xmin"]) * (b["ymax"] - b["ymin"])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+def match_page(reference, candidate, iou_threshold):
+    """
+    Greedily matches candidate detections to reference detections of the same label.
+    Returns (matched count, list of IoUs of matched pairs).
+    """
+    used = set()
+    ious = []
+    for ref in sorted(reference, key=lambda r: -r["score"]):
+        best, best_iou = None, iou_threshold
+        for j, cand in enumerate(candidate):
+            if j in used or cand["label"] != ref["label"]:
+                continue
+            iou = box_iou(ref["box"], cand["box"])
+            if iou >= best_iou:
+                best, best_iou = j, iou
+        if best is not None:
+            used.add(best)
+            ious.append(best_iou)
+    return len(ious), ious
+
+def run_detector(detector, images, batch_size):
+    """Runs a detector over all images. Returns (results, pages/s)."""
+    results = []
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        results.extend(detector(images[i : i + batch_size]))
+    return results, len(images) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity check and benchmark of layout backends against eager")
+    parser.add_argument("--image-dir", type=str, default="data/selected_samples_25k/images")
+    parser.add_argument("--limit", type=int, default=32, help="Number of sample pages")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["int8", "onnx"])
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for every backend")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--onnx-path", type=str, default=DEFAULT_ONNX_PATH)
+    parser.add_argument("--iou", type=float, default=0.9, help="IoU for a box to count as matching")
+    parser.add_argument("--min-match-rate", type=float, default=0.95,
+                        help="Fail if fewer reference boxes than this are matched")
+    parser.add_argument("--report", type=str, default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in Path(args.image_dir).iterdir()
+                   if p.suffix.lower() in [".jpg", ".jpeg", ".png", ".webp"])[:args.limit]
+    if not paths:
+        print(f"No images found in {args.image_dir}.")
+        return
+
+    eager = load_layout_detector("eager", num_threads=args.threads)
+    size_cfg = getattr(eager.image_processor, "size", None)
+    images = [img for _, img, _, _, error in map(load_page, [(p, size_cfg) for p in paths]) if error is None]
+    print(f"Loaded {len(images)} sample pages.")
+
+    # Warm-up so lazy initialization doesn't count against eager
+    eager(images[:1])
+    reference, eager_pps = run_detector(eager, images, args.batch_size)
+    num_ref = sum(len(r) for r in reference)
+
+    rows = [("eager", eager_pps, 1.0, 1.0)]
+    failed = False
+    for backend in args.backends:
+        if backend == "eager":
+            continue
+        detector = load_layout_detector(backend, num_threads=args.threads, onnx_path=args.onnx_path)
+        # compile/onnx pay one-off costs on the first call
+        detector(images[:1])
+        results, pps = run_detector(detector, images, args.batch_size)
+
+        matched, ious = 0, []
+        for ref, cand in zip(reference, results):
+            m, page_ious = match_page(ref, cand, args.iou)
+            matched += m
+            ious.extend(page_ious)
+        match_rate = matched / num_ref if num_ref else 1.0
+        rows.append((backend, pps, match_rate, float(np.mean(ious)) if ious else 0.0))
+        failed |= match_rate < args.min_match_rate
+
+    print("\n" + "=" * 60)
+    print(f"{'Backend':<10} | {'pages/s':>8} | {'speedup':>7} | {'match rate':>10} | {'mean IoU':>8}")
+    print("-" * 60)
+    for backend, pps, match_rate, mean_iou in rows:
+        print(f"{backend:<10} | {pps:>8.2f} | {pps / eager_pps:>6.2f}x | {match_rate * 100:>9.1f}% | {mean_iou:>8.3f}")
+    print("=" * 60)
+    print(f"Reference boxes: {num_ref} on {len(images)} pages (threads: {args.threads or 'default'})")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"pages": len(images), "reference_boxes": num_ref, "threads": args.threads,
+                       "batch_size": args.batch_size, "iou": args.iou,
+                       "backends": [{"backend": b, "pages_per_s": pps, "speedup": pps / eager_pps,
+                                     "match_rate": rate, "mean_iou": iou} for b, pps, rate, iou in rows]},
+                      f, indent=2)
+
+    if failed:
+        print(f"FAIL: a backend matched fewer than {args.min_match_rate * 100:.0f}% of eager boxes at IoU {args.iou}")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
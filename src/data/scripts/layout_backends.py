@@ -0,0 +1,156 @@
+import os
+import importlib.util
+import numpy as np
+
+MODEL_ID = "PaddlePaddle/PP-DocLayoutV3_safetensors"
+BACKENDS = ["eager", "compile", "int8", "onnx"]
+DEFAULT_ONNX_PATH = os.path.join("models", "pp_doclayoutv3.onnx")
+# Optional packages per backend (module -> package); install with `pixi install -e onnx`
+OPTIONAL_DEPENDENCIES = {"onnx": {"onnxruntime": "onnxruntime"}}
+# Model outputs read by PPDocLayoutV3ImageProcessor.post_process_object_detection;
+# the ONNX graph returns only these (no hidden states, intermediate or encoder outputs)
+POSTPROCESS_OUTPUTS = ["logits", "pred_boxes", "order_logits", "out_masks"]
+# out_masks is (batch, queries, height / 4, width / 4)
+OUTPUT_DYNAMIC_AXES = {"out_masks": {0: "batch", 2: "mask_height", 3: "mask_width"}}
+
+def missing_dependency_message(backend, packages):
+    return (f"--backend {backend} needs {', '.join(packages)}, which is not installed. "
+            f"Install it with `pip install {' '.join(packages)}` or use the pixi '{backend}' environment "
+            f"(`pixi run -e {backend} ...`), or pick another backend.")
+
+def check_backend_dependencies(backend):
+    """Raises ImportError naming the missing packages of a backend, before any model is loaded."""
+    missing = [package for module, package in OPTIONAL_DEPENDENCIES.get(backend, {}).items()
+               if importlib.util.find_spec(module) is None]
+    if missing:
+        raise ImportError(missing_dependency_message(backend, missing))
+
+def load_layout_detector(backend="eager", device=-1, num_threads=None, onnx_path=DEFAULT_ONNX_PATH):
+    """
+    Loads PP-DocLayoutV3 behind a pipeline-compatible callable:
+    detector(images) -> [[{"score", "label", "box": {...}}, ...], ...]
+    - eager:   the transformers pipeline as is.
+    - compile: torch.compile on the model (CPU inductor).
+    - int8:    dynamic int8 quantization of the Linear layers.
+    - onnx:    ONNX Runtime session (exported once to onnx_path).
+    num_threads sets the intra-op thread count of torch / ONNX Runtime.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+    check_backend_dependencies(backend)
+    # Imported here so importing this module (e.g. for BACKENDS) stays cheap
+    import torch
+    from transformers import pipeline
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    detector = pipeline("object-detection", model=MODEL_ID, device=device)
+    detector.model.eval()
+
+    if backend == "compile":
+        detector.model = torch.compile(detector.model)
+    elif backend == "int8":
+        detector.model = torch.ao.quantization.quantize_dynamic(
+            detector.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif backend == "onnx":
+        return OnnxLayoutDetector(detector, onnx_path, num_threads)
+    return detector
+
+def _outputs_as_tuple(model, output_names):
+    """Export wrapper module: returns the model's tensor outputs as a flat tuple."""
+    import torch
+
+    class _OutputsAsTuple(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+            self.output_names = output_names
+
+        def forward(self, pixel_values):
+            outputs = self.model(pixel_values=pixel_values)
+            return tuple(outputs[name] for name in self.output_names)
+
+    return _OutputsAsTuple()
+
+class OnnxLayoutDetector:
+    """
+    Runs the detector through ONNX Runtime, reusing the pipeline's image
+    processor for pre/post-processing so outputs match the eager pipeline.
+    Post-processing reads logits and pred_boxes (scores, labels, boxes),
+    order_logits (reading order the detections are sorted by) and out_masks
+    (polygon points, thresholded like the scores); those four are exported
+    and the other fields of the output class are left as None.
+    """
+
+    def __init__(self, detector, onnx_path=DEFAULT_ONNX_PATH, num_threads=None):
+        import torch
+        import onnxruntime as ort
+
+        self.model = detector.model  # kept for config/id2label
+        self.image_processor = detector.image_processor
+
+        # Run once to check the outputs post-processing needs are plain tensors
+        dummy = self.image_processor(images=[np.zeros((64, 64, 3), dtype=np.uint8)], return_tensors="pt")
+        with torch.no_grad():
+            sample_outputs = self.model(pixel_values=dummy["pixel_values"])
+        self.output_cls = type(sample_outputs)
+        missing = [name for name in POSTPROCESS_OUTPUTS if not isinstance(sample_outputs.get(name), torch.Tensor)]
+        if missing:
+            raise ValueError(f"{MODEL_ID} returned no {missing} tensors, which post-processing needs; "
+                             f"got {sorted(sample_outputs.keys())}")
+        self.output_names = list(POSTPROCESS_OUTPUTS)
+
+        if not os.path.exists(onnx_path):
+            self.export(onnx_path, dummy["pixel_values"])
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def export(self, onnx_path, pixel_values):
+        import torch
+
+        print(f"Exporting {MODEL_ID} to {onnx_path}...")
+        os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+        wrapper = _outputs_as_tuple(self.model, self.output_names).eval()
+        try:
+            with torch.no_grad():
+                torch.onnx.export(
+                    wrapper, (pixel_values,), onnx_path,
+                    input_names=["pixel_values"], output_names=self.output_names,
+                    dynamic_axes={"pixel_values": {0: "batch", 2: "height", 3: "width"},
+                                  **{name: OUTPUT_DYNAMIC_AXES.get(name, {0: "batch"}) for name in self.output_names}},
+                    opset_version=17,
+                )
+        except ModuleNotFoundError as e:
+            # The exporter pulls in onnx (and onnxscript in recent torch) only when exporting
+            raise ImportError(missing_dependency_message("onnx", [e.name or "onnx"])) from e
+
+    def __call__(self, images, threshold=0.5, **kwargs):
+        import torch
+
+        single = not isinstance(images, (list, tuple))
+        if single:
+            images = [images]
+        inputs = self.image_processor(images=list(images), return_tensors="np")
+        values = self.session.run(self.output_names, {"pixel_values": inputs["pixel_values"].astype(np.float32)})
+        outputs = self.output_cls(**{name: torch.from_numpy(v) for name, v in zip(self.output_names, values)})
+
+        target_sizes = torch.tensor([(img.size[1], img.size[0]) for img in images])
+        processed = self.image_processor.post_process_object_detection(
+            outputs, threshold=threshold, target_sizes=target_sizes
+        )
+        id2label = self.model.config.id2label
+        results = []
+        for p in processed:
+            page = []
+            for score, label, box in zip(p["scores"].tolist(), p["labels"].tolist(), p["boxes"].tolist()):
+                xmin, ymin, xmax, ymax = box
+                page.append({"score": score, "label": id2label[label],
+                             "box": {"xmin": int(xmin), "ymin": int(ymin), "xmax": int(xmax), "ymax": int(ymax)}})
+            results.append(page)
+        return results[0] if single else results
@@ -0,0 +1,189 @@
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image
+
+# Bucket granularity of resized shapes; pages within one step pad together
+SHAPE_STEP = 32
+
+def target_size_for(orig_size, size_cfg):
+    """
+    Computes the (width, height) the model's image processor would resize to.
+    size_cfg is image_processor.size: either {"height", "width"} or {"shortest_edge"[, "longest_edge"]}.
+    Returns None if the config is unknown (no pre-resize).
+    """
+    if not size_cfg:
+        return None
+    w, h = orig_size
+    if "height" in size_cfg and "width" in size_cfg:
+        return size_cfg["width"], size_cfg["height"]
+    if "shortest_edge" in size_cfg:
+        scale = size_cfg["shortest_edge"] / min(w, h)
+        if size_cfg.get("longest_edge"):
+            scale = min(scale, size_cfg["longest_edge"] / max(w, h))
+        return max(1, round(w * scale)), max(1, round(h * scale))
+    return None
+
+def read_page_size(path):
+    """Image (width, height) from the file header only, or None if unreadable."""
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None
+
+def plan_batches(paths, size_cfg=None, max_pixels=None, max_batch_size=8, num_workers=8):
+    """
+    Groups pages into batches of similar resized shape.
+    Pages are bucketed by their model input shape (rounded up to SHAPE_STEP) and
+    sorted, so a batch pads to little more than its largest page. A batch is
+    closed when batch_size x padded shape would exceed max_pixels or it reaches
+    max_batch_size. Only file headers are read. Unreadable files get their own
+    batch so the loader reports them. Returns a list of path lists.
+    """
+    if not max_pixels:
+        return [paths[i : i + max_batch_size] for i in range(0, len(paths), max_batch_size)]
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        sizes = list(executor.map(read_page_size, paths))
+
+    shaped, unreadable = [], []
+    for path, size in zip(paths, sizes):
+        if size is None:
+            unreadable.append(path)
+            continue
+        w, h = target_size_for(size, size_cfg) or size
+        shaped.append((-(-h // SHAPE_STEP) * SHAPE_STEP, -(-w // SHAPE_STEP) * SHAPE_STEP, path))
+    shaped.sort(key=lambda item: (item[0], item[1], str(item[2])))
+
+    batches, current = [], []
+    max_h = max_w = 0
+    for h, w, path in shaped:
+        new_h, new_w = max(max_h, h), max(max_w, w)
+        if current and (len(current) >= max_batch_size or (len(current) + 1) * new_h * new_w > max_pixels):
+            batches.append(current)
+            current, new_h, new_w = [], h, w
+        current.append(path)
+        max_h, max_w = new_h, new_w
+    if current:
+        batches.append(current)
+    if unreadable:
+        batches.append(unreadable)
+    return batches
+
+def load_page(args):
+    """
+    Worker function: decodes one page as RGB, pre-resized to the model input size.
+    JPEGs use draft() so the codec skips most of the full-resolution decode.
+    args is (path, size_cfg) or (path, size_cfg, page_cache); with a PageCache
+    the decoded page is read from / stored in the shared on-disk cache.
+    Returns (path, image or None, original size, decode seconds, error).
+    """
+    path, size_cfg = args[0], args[1]
+    page_cache = args[2] if len(args) > 2 else None
+    start = time.perf_counter()
+    try:
+        if page_cache is not None:
+            array, orig_size = page_cache.load(path, lambda size: target_size_for(size, size_cfg))
+            return path, Image.fromarray(array), orig_size, time.perf_counter() - start, None
+        with Image.open(path) as img:
+            orig_size = img.size
+            target = target_size_for(orig_size, size_cfg)
+            if target:
+                img.draft('RGB', target)
+            img = img.convert("RGB")
+        if target and img.size != target:
+            img = img.resize(target, Image.Resampling.BILINEAR)
+        return path, img, orig_size, time.perf_counter() - start, None
+    except Exception as e:
+        return path, None, None, time.perf_counter() - start, e
+
+class PageBatch:
+    """Decoded pages of one batch; pages that failed to decode are listed in errors."""
+
+    def __init__(self, paths, images, orig_sizes, errors):
+        self.paths = paths
+        self.images = images
+        self.orig_sizes = orig_sizes
+        self.errors = errors
+
+class PrefetchLoader:
+    """
+    Decodes the next batches on worker threads (or processes) into a bounded
+    queue while the current batch runs through the model.
+    Iterating yields PageBatch objects; `batches` is a list of path lists.
+    Timing: decode_time is the summed worker decode time, wait_time is how long
+    the consumer was blocked waiting for data.
+    """
+
+    def __init__(self, batches, size_cfg=None, num_workers=4, prefetch_batches=2, use_processes=False,
+                 page_cache=None):
+        self.batches = batches
+        self.size_cfg = size_cfg
+        self.page_cache = page_cache
+        self.num_workers = num_workers
+        self.prefetch_batches = prefetch_batches
+        self.use_processes = use_processes
+        self.decode_time = 0.0
+        self.wait_time = 0.0
+
+    def _produce(self, executor, out_queue, stop):
+        batches = iter(self.batches)
+        pending = deque()
+
+        def submit_next():
+            batch_paths = next(batches, None)
+            if batch_paths is None:
+                return
+            pending.append([executor.submit(load_page, (p, self.size_cfg, self.page_cache)) for p in batch_paths])
+
+        try:
+            # Keep the decode of the next batches in flight, not just the current one
+            for _ in range(max(1, self.prefetch_batches)):
+                submit_next()
+            while pending and not stop.is_set():
+                futures = pending.popleft()
+                submit_next()
+                paths, images, sizes, errors = [], [], [], []
+                for future in futures:
+                    path, img, orig_size, seconds, error = future.result()
+                    self.decode_time += seconds
+                    if error is not None:
+                        errors.append((path, error))
+                        continue
+                    paths.append(path)
+                    images.append(img)
+                    sizes.append(orig_size)
+                out_queue.put(PageBatch(paths, images, sizes, errors))
+        except Exception as e:
+            out_queue.put(e)
+        finally:
+            out_queue.put(None)
+
+    def __iter__(self):
+        executor_cls = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        out_queue = queue.Queue(maxsize=max(1, self.prefetch_batches))
+        stop = threading.Event()
+        with executor_cls(max_workers=self.num_workers) as executor:
+            producer = threading.Thread(target=self._produce, args=(executor, out_queue, stop), daemon=True)
+            producer.start()
+            try:
+                while True:
+                    start = time.perf_counter()
+                    item = out_queue.get()
+                    self.wait_time += time.perf_counter() - start
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                stop.set()
+                # Drain so the producer is never stuck on a full queue
+                while producer.is_alive():
+                    try:
+                        out_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
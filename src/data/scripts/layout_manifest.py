@@ -0,0 +1,137 @@
+import os
+import time
+import sqlite3
+from pathlib import Path
+
+MANIFEST_NAME = "layout_manifest.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    name TEXT PRIMARY KEY,
+    width INTEGER,
+    height INTEGER,
+    num_boxes INTEGER,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS detections (
+    name TEXT NOT NULL,
+    label_id INTEGER NOT NULL,
+    score REAL,
+    x_center REAL,
+    y_center REAL,
+    width REAL,
+    height REAL
+);
+CREATE INDEX IF NOT EXISTS detections_name ON detections (name);
+"""
+
+def manifest_path(base_dir, shard_index=0, num_shards=1):
+    """Default manifest location; every shard of a multi-machine run gets its own file."""
+    if num_shards > 1:
+        return Path(base_dir) / f"layout_manifest-{shard_index:05d}-of-{num_shards:05d}.sqlite"
+    return Path(base_dir) / MANIFEST_NAME
+
+def reverse_label_map(id2label):
+    """
+    label name -> id. Some PP-DocLayoutV3 names repeat; the lowest id wins,
+    as the old first-match scan over id2label did.
+    """
+    label2id = {}
+    for idx in sorted(id2label):
+        label2id.setdefault(id2label[idx], idx)
+    return label2id
+
+def detections_to_yolo(img_results, img_width, img_height, label2id):
+    """
+    Converts the pipeline detections of one page to normalized YOLO boxes:
+    [(label_id, score, x_center, y_center, width, height), ...]
+    """
+    boxes = []
+    for res in img_results:
+        # YOLO format: class_id x_center y_center width height (normalized)
+        box = res["box"]
+        xmin, ymin, xmax, ymax = box["xmin"], box["ymin"], box["xmax"], box["ymax"]
+
+        # Ensure coordinates are within image bounds
+        xmin = max(0, xmin)
+        ymin = max(0, ymin)
+        xmax = min(img_width, xmax)
+        ymax = min(img_height, ymax)
+
+        width = xmax - xmin
+        height = ymax - ymin
+        x_center = xmin + width / 2
+        y_center = ymin + height / 2
+
+        # Normalize
+        x_center /= img_width
+        y_center /= img_height
+        width /= img_width
+        height /= img_height
+
+        # Transformers pipeline object-detection returns 'label' as the string name
+        label_id = label2id.get(res["label"], -1)
+        if label_id != -1:
+            boxes.append((label_id, float(res["score"]), x_center, y_center, width, height))
+    return boxes
+
+class LayoutManifest:
+    """
+    SQLite manifest of annotated pages and their detections (normalized YOLO boxes).
+    Pages are appended one batch per transaction. WAL mode lets several worker
+    processes append to the same file on a local disk.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=120)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def processed_names(self):
+        """Names of all pages already in the manifest."""
+        return {row[0] for row in self.conn.execute("SELECT name FROM pages")}
+
+    def append(self, pages):
+        """
+        Records a batch of pages in one transaction.
+        pages: [(name, width, height, [(label_id, score, xc, yc, w, h), ...]), ...]
+        Re-annotated pages replace their previous detections.
+        """
+        now = time.time()
+        names = [(name,) for name, _, _, _ in pages]
+        with self.conn:
+            self.conn.executemany("DELETE FROM detections WHERE name = ?", names)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pages (name, width, height, num_boxes, created) VALUES (?, ?, ?, ?, ?)",
+                [(name, width, height, len(boxes), now) for name, width, height, boxes in pages],
+            )
+            self.conn.executemany(
+                "INSERT INTO detections (name, label_id, score, x_center, y_center, width, height) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(name, *box) for name, _, _, boxes in pages for box in boxes],
+            )
+
+    def num_pages(self):
+        return self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def export_yolo(self, labels_dir):
+        """Writes one YOLO .txt per page (including empty pages). Returns the number of files."""
+        labels_dir = Path(labels_dir)
+        labels_dir.mkdir(parents=True, exist_ok=True)
+        boxes_by_name = {name: [] for (name,) in self.conn.execute("SELECT name FROM pages")}
+        rows = self.conn.execute(
+            "SELECT name, label_id, x_center, y_center, width, height FROM detections ORDER BY name, rowid"
+        )
+        for name, label_id, x_center, y_center, width, height in rows:
+            if name in boxes_by_name:
+                boxes_by_name[name].append(f"{label_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
+        for name, lines in boxes_by_name.items():
+            with open(labels_dir / f"{Path(name).stem}.txt", "w") as f:
+                f.writelines(lines)
+        return len(boxes_by_name)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,194 @@
+import os
+import re
+import sys
+import glob
+import json
+import argparse
+from collections import Counter
+from src.data.scripts.hash_store import (
+    parquet_shard_files, write_store_from_shards, read_shard, write_shard, STORE_NAME, LOCAL_SHARD
+)
+from src.data.scripts.sharding import shard_of
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".webp"]
+SHARD_NAME = re.compile(r"-(\d{5})-of-(\d{5})$")
+
+def shard_of_file(path):
+    """(shard index, num shards) from a '-00003-of-00008' file name suffix, or None."""
+    match = SHARD_NAME.search(os.path.splitext(os.path.basename(path))[0])
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def print_check(title, items, limit=10):
+    print(f"{title}: {len(items)}")
+    for item in sorted(items)[:limit]:
+        print(f"  {item}")
+    if len(items) > limit:
+        print(f"  ... and {len(items) - limit} more")
+
+# --- Hash stores ---
+def missing_shards(paths):
+    """Shard indices absent from a set of '-XXXXX-of-YYYYY' files (all shards of a run must be merged)."""
+    shards = [s for s in map(shard_of_file, paths) if s]
+    missing = set()
+    for num_shards in {n for _, n in shards}:
+        seen = {i for i, n in shards if n == num_shards}
+        missing.update(f"{i:05d}-of-{num_shards:05d}" for i in range(num_shards) if i not in seen)
+    return missing
+
+def expected_parquet_files(args, input_dirs):
+    """Parquet files that should be hashed: from the source if given, else from the shards' progress files."""
+    if args.parquet_dir:
+        from src.data.scripts.shard_scheduler import LocalSource
+        return set(LocalSource(args.parquet_dir).list_files())
+    if args.repo:
+        from src.data.scripts.shard_scheduler import HubSource
+        return set(HubSource(args.repo, download_dir=None).list_files())
+    expected = set()
+    for input_dir in input_dirs:
+        for progress_file in glob.glob(os.path.join(input_dir, "progress*.json")):
+            with open(progress_file, "r") as f:
+                progress = json.load(f)
+            # Files with partial row groups were started but not finished
+            expected.update(progress.get("processed_files", []))
+            expected.update(progress.get("row_groups", {}))
+    return expected
+
+def merge_hashes(args):
+    """
+    Combines the per-parquet hash shards written by several generate_embeddings
+    shards (each input is one shard's --output-dir) into one hash store.
+    Fails if a parquet file or a whole shard is missing, or a parquet file was
+    hashed by more than one shard, unless --force. Local image shards
+    (local_images-*.npz) are checked for images hashed twice or in the wrong shard.
+    """
+    found, local_files = {}, []
+    for input_dir in args.inputs:
+        embed_dir = os.path.join(input_dir, "embeddings")
+        embed_dir = embed_dir if os.path.isdir(embed_dir) else input_dir
+        for name, npz_path in parquet_shard_files(embed_dir).items():
+            found.setdefault(name, set()).add(os.path.realpath(npz_path))
+        local_files.extend(os.path.realpath(f) for f in glob.glob(os.path.join(embed_dir, f"{LOCAL_SHARD}*.npz")))
+
+    expected = expected_parquet_files(args, args.inputs)
+    missing = expected - set(found)
+    duplicated = {name for name, paths in found.items() if len(paths) > 1}
+    shard_files = {name: sorted(paths)[0] for name, paths in found.items()}
+    progress_files = [f for input_dir in args.inputs for f in glob.glob(os.path.join(input_dir, "progress*.json"))]
+    absent_shards = missing_shards(progress_files + local_files)
+
+    # Local image paths are relative to one image dir, so they must be unique and in their shard
+    local_files = sorted(set(local_files))
+    path_counts, misplaced = Counter(), set()
+    for npz_path in local_files:
+        paths = read_shard(npz_path)[1]
+        path_counts.update(paths)
+        shard = shard_of_file(npz_path)
+        if shard:
+            misplaced.update(f"{p} in {os.path.basename(npz_path)}" for p in paths if shard_of(p, shard[1]) != shard[0])
+    duplicate_paths = {p for p, c in path_counts.items() if c > 1}
+
+    print(f"Parquet shards found: {len(shard_files)} (expected {len(expected)})")
+    if local_files:
+        print(f"Local images: {sum(path_counts.values())} in {len(local_files)} files")
+    print_check("Missing shards", absent_shards)
+    print_check("Missing parquet files", missing)
+    print_check("Parquet files hashed by several shards", duplicated)
+    print_check("Local images hashed more than once", duplicate_paths)
+    print_check("Local images in the wrong shard file", misplaced)
+    ok = not (absent_shards or missing or duplicated or duplicate_paths or misplaced)
+    if not ok and not args.force:
+        print("FAIL: nothing written (use --force to merge anyway).")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    if shard_files:
+        store_path = write_store_from_shards(shard_files, os.path.join(args.output, STORE_NAME))
+        print(f"Hash store written to {store_path}")
+    if local_files:
+        hashes, paths, locations = [], [], []
+        for npz_path in local_files:
+            h, p, loc = read_shard(npz_path)
+            hashes.extend(h.tolist())
+            paths.extend(p)
+            locations.extend(loc.tolist())
+        save_path = os.path.join(args.output, "embeddings", f"{LOCAL_SHARD}.npz")
+        write_shard(save_path, hashes, paths, locations)
+        print(f"Local image hashes written to {save_path}")
+    print("OK" if ok else "Merged with problems (--force).")
+    return 0
+
+# --- Labelled pages (fused pipeline / processor JSONL) ---
+def merge_labels(args):
+    """
+    Combines the per-shard JSONL outputs of the labelling scripts into one
+    file sorted by page name. Fails if a page is labelled twice, sits in the
+    wrong shard file, or (with --image-dir) is missing, unless --force.
+    """
+    inputs = sorted({path for pattern in args.inputs for path in (glob.glob(pattern) or [pattern])})
+    records, duplicated, misplaced = {}, set(), set()
+    for path in inputs:
+        shard = shard_of_file(path)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    name = record["name"]
+                except (json.JSONDecodeError, KeyError):
+                    # Partial last line of an interrupted run
+                    continue
+                if shard and shard_of(name, shard[1]) != shard[0]:
+                    misplaced.add(f"{name} in {os.path.basename(path)}")
+                if name in records:
+                    duplicated.add(name)
+                    continue
+                records[name] = record
+
+    missing = set()
+    if args.image_dir:
+        expected = {f for f in os.listdir(args.image_dir) if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS}
+        missing = expected - set(records)
+
+    print(f"Shard files: {len(inputs)}, labelled pages: {len(records)}")
+    print_check("Missing shards", missing_shards(inputs))
+    print_check("Missing pages", missing)
+    print_check("Pages labelled more than once", duplicated)
+    print_check("Pages in the wrong shard file", misplaced)
+    ok = not (missing_shards(inputs) or missing or duplicated or misplaced)
+    if not ok and not args.force:
+        print("FAIL: nothing written (use --force to merge anyway).")
+        return 1
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for name in sorted(records):
+            f.write(json.dumps(records[name], ensure_ascii=False) + "\n")
+    os.replace(tmp_path, args.output)
+    print(f"{len(records)} pages written to {args.output}")
+    print("OK" if ok else "Merged with problems (--force).")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and verify the outputs of sharded multi-machine runs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    hashes = sub.add_parser("hashes", help="Merge generate_embeddings shard output dirs into one hash store")
+    hashes.add_argument("inputs", nargs="+", help="--output-dir of every shard")
+    hashes.add_argument("--output", type=str, required=True, help="Directory for the merged hashes.store")
+    hashes.add_argument("--repo", type=str, default=None, help="Verify against every parquet of this HF repo")
+    hashes.add_argument("--parquet-dir", type=str, default=None, help="Verify against a local parquet directory")
+    hashes.add_argument("--force", action="store_true", help="Write the merge even if verification fails")
+    hashes.set_defaults(func=merge_hashes)
+
+    labels = sub.add_parser("labels", help="Merge per-shard labelling JSONL outputs into one file")
+    labels.add_argument("inputs", nargs="+", help="Shard JSONL files (globs allowed)")
+    labels.add_argument("--output", type=str, required=True, help="Merged JSON lines file")
+    labels.add_argument("--image-dir", type=str, default=None, help="Verify every page of this directory is labelled")
+    labels.add_argument("--force", action="store_true", help="Write the merge even if verification fails")
+    labels.set_defaults(func=merge_labels)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
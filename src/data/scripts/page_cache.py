@@ -0,0 +1,317 @@
+import os
+import io
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+import numpy as np
+from PIL import Image
+from src.data.scripts.stage_metrics import metrics
+
+INDEX_NAME = "index.sqlite"
+DEFAULT_MAX_GB = 20.0
+# Eviction frees down to this fraction of the budget, so it doesn't run on every insert
+EVICT_TO = 0.9
+# Access times are written in batches; LRU order only needs to be roughly right
+TOUCH_FLUSH = 256
+# The running size total is re-read from the index this often, to count other processes' writes
+TOTAL_RESYNC = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    nbytes INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    digest TEXT
+);
+CREATE TABLE IF NOT EXISTS originals (
+    digest TEXT PRIMARY KEY,
+    width INTEGER,
+    height INTEGER
+);
+"""
+
+def content_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def entry_key(digest, size, mode):
+    """<content digest>-<w>x<h>-<mode>, 'full' for the original resolution."""
+    return f"{digest}-{'full' if size is None else f'{size[0]}x{size[1]}'}-{mode}"
+
+def decode_to_array(source, size=None, mode="RGB"):
+    """
+    Decodes an image file or bytes to a uint8 array (H, W[, C]), resized to size.
+    size is (width, height), a callable(original size) -> (width, height) or None.
+    JPEGs use draft() so the codec skips most of the full-resolution decode.
+    Returns (array, original size).
+    """
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        orig_size = img.size
+        target = size(orig_size) if callable(size) else size
+        if target:
+            img.draft(mode, target)
+        img = img.convert(mode)
+    if target and img.size != tuple(target):
+        img = img.resize(tuple(target), Image.Resampling.BILINEAR)
+    return np.asarray(img), orig_size
+
+class PageCache:
+    """
+    On-disk cache of decoded (optionally downscaled) pages, shared by the
+    pipeline stages and across runs. Pages are stored as .npy arrays and read
+    back memory-mapped, keyed by the content hash of the encoded file plus the
+    target size and mode, so a renamed or copied page still hits and an edited
+    one misses. An SQLite index tracks sizes and access times; the least
+    recently used entries are evicted once the cache exceeds max_bytes.
+    Thread-safe; several processes can share one cache directory (writes are
+    atomic renames, the index is in WAL mode). Instances can be pickled to
+    process pool workers, which reopen the index on first use.
+    """
+
+    def __init__(self, cache_dir, max_bytes=int(DEFAULT_MAX_GB * 1e9)):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._init_state()
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._touched = {}
+        self._total = None
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return {"cache_dir": self.cache_dir, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(os.path.join(self.cache_dir, INDEX_NAME), timeout=120,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    # --- Keys ---
+    def file_digest(self, path):
+        """
+        Content digest of an image file. Remembered per (path, file size, mtime)
+        so unchanged files are not re-read.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self.conn.execute("SELECT size, mtime_ns, digest FROM sources WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        with open(path, "rb") as f:
+            digest = content_digest(f.read())
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO sources (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                              (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def original_size(self, digest):
+        """(width, height) of the encoded image with this digest if it was decoded before, else None."""
+        with self._lock:
+            row = self.conn.execute("SELECT width, height FROM originals WHERE digest = ?", (digest,)).fetchone()
+        return tuple(row) if row else None
+
+    def _remember_size(self, digest, orig_size):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO originals (digest, width, height) VALUES (?, ?, ?)",
+                              (digest, orig_size[0], orig_size[1]))
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc("page_cache.hits" if hit else "page_cache.misses")
+
+    # --- Entries ---
+    def get(self, key):
+        """Read-only memory-mapped array for key, or None."""
+        try:
+            array = np.load(self.entry_path(key), mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            # Missing, evicted meanwhile, or a partial file from a crashed writer
+            return None
+        with self._lock:
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_FLUSH:
+                self._flush_touches()
+        return array
+
+    def put(self, key, array):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+        nbytes = os.path.getsize(path)
+        with self._lock:
+            with self.conn:
+                old = self.conn.execute("SELECT nbytes FROM entries WHERE key = ?", (key,)).fetchone()
+                self.conn.execute("INSERT OR REPLACE INTO entries (key, nbytes, last_access) VALUES (?, ?, ?)",
+                                  (key, nbytes, time.time()))
+            self._puts += 1
+            if self._total is None or self._puts % TOTAL_RESYNC == 0:
+                self._total = self._sum_locked()
+            else:
+                self._total += nbytes - (old[0] if old else 0)
+            self._evict_locked()
+
+    def _flush_touches(self):
+        if not self._touched:
+            return
+        with self.conn:
+            self.conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                  [(t, k) for k, t in self._touched.items()])
+        self._touched.clear()
+
+    def _sum_locked(self):
+        return self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+
+    def _evict_locked(self, max_bytes=None):
+        """
+        Evicts down to EVICT_TO of max_bytes. Puts keep a running total, so the
+        full size scan only runs when the budget looks exceeded.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if self._total is not None and self._total <= max_bytes:
+            return 0
+        total = self._total = self._sum_locked()
+        if total <= max_bytes:
+            return 0
+        self._flush_touches()
+        target = max_bytes * EVICT_TO
+        evicted = []
+        for key, nbytes in self.conn.execute("SELECT key, nbytes FROM entries ORDER BY last_access"):
+            if total <= target:
+                break
+            evicted.append(key)
+            total -= nbytes
+        with self.conn:
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in evicted])
+        self._total = total
+        for key in evicted:
+            try:
+                # Readers that already mapped the file keep a valid mapping
+                os.remove(self.entry_path(key))
+            except FileNotFoundError:
+                pass
+        metrics.inc("page_cache.evicted", len(evicted))
+        return len(evicted)
+
+    def evict(self, max_bytes=None):
+        """Evicts least recently used entries until under max_bytes (default: the budget)."""
+        with self._lock:
+            return self._evict_locked(max_bytes)
+
+    # --- Decode through the cache ---
+    def load(self, path, size=None, mode="RGB"):
+        """
+        Decoded page of an image file, from the cache or decoded and stored.
+        size is (width, height), a callable(original size) -> (width, height) or None.
+        Returns (read-only array, original size).
+        """
+        digest = self.file_digest(path)
+        # Keyed by content, so a page first seen under another path or on another machine still hits
+        orig_size = self.original_size(digest)
+        if orig_size is not None or not callable(size):
+            array = self.get(entry_key(digest, size(orig_size) if callable(size) else size, mode))
+            if array is not None:
+                if orig_size is None:
+                    # Fixed size and the original size was never recorded: the header is enough
+                    with Image.open(path) as img:
+                        orig_size = img.size
+                    self._remember_size(digest, orig_size)
+                self._count(hit=True)
+                return array, orig_size
+        self._count(hit=False)
+        with metrics.stage("page_cache.decode"):
+            array, orig_size = decode_to_array(path, size, mode)
+        target = size(orig_size) if callable(size) else size
+        self.put(entry_key(digest, target, mode), array)
+        self._remember_size(digest, orig_size)
+        return array, orig_size
+
+    def load_bytes(self, data, size=None, mode="RGB"):
+        """Like load() for encoded image bytes (e.g. a parquet image cell); size must not be callable."""
+        key = entry_key(content_digest(data), size, mode)
+        array = self.get(key)
+        if array is not None:
+            self._count(hit=True)
+            return array
+        self._count(hit=False)
+        with metrics.stage("page_cache.decode"):
+            array, _ = decode_to_array(data, size, mode)
+        self.put(key, array)
+        return array
+
+    def stats(self):
+        with self._lock:
+            entries, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM entries").fetchone()
+            return {"entries": entries, "bytes": total, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            return self._evict_locked(max_bytes=-1)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._flush_touches()
+                self._conn.close()
+                self._conn = None
+
+def add_page_cache_args(parser):
+    parser.add_argument("--page-cache", type=str, default=None,
+                        help="Directory of the shared decoded-page cache (disabled if unset). Only pays off when "
+                             "--page-cache-gb holds every page of a pass: a full-resolution A4 scan takes ~26 MB, "
+                             "so a smaller budget evicts each page before it is read again")
+    parser.add_argument("--page-cache-gb", type=float, default=DEFAULT_MAX_GB, help="Disk budget of the page cache")
+
+def page_cache_from_args(args):
+    return PageCache(args.page_cache, int(args.page_cache_gb * 1e9)) if args.page_cache else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or trim the shared decoded-page cache")
+    parser.add_argument("cache_dir", type=str)
+    parser.add_argument("--evict-to-gb", type=float, default=None, help="Evict LRU entries down to this size")
+    parser.add_argument("--clear", action="store_true", help="Remove every entry")
+    args = parser.parse_args()
+
+    cache = PageCache(args.cache_dir)
+    if args.clear:
+        print(f"Removed {cache.clear()} entries.")
+    elif args.evict_to_gb is not None:
+        print(f"Evicted {cache.evict(int(args.evict_to_gb * 1e9))} entries.")
+    stats = cache.stats()
+    print(f"{stats['entries']} entries, {stats['bytes'] / 1e9:.2f} GB in {args.cache_dir}")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import io
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image
+from src.data.scripts.shard_scheduler import HubSource, LocalSource
+
+def split_files(files, split):
+    """
+    Parquet files of one split: 'data/train-00000-of-00004.parquet' or 'train/0000.parquet'.
+    Local directories without split names keep all their files.
+    """
+    matched = [f for f in files
+               if os.path.basename(f).startswith(f"{split}-") or f"/{split}/" in f"/{f}"]
+    return sorted(matched) if matched else sorted(files)
+
+def is_image_field(field):
+    """HF datasets store Image features as struct<bytes: binary, path: string>."""
+    return pa.types.is_struct(field.type) and field.type.get_field_index("bytes") >= 0
+
+def decode_image(value, page_cache=None):
+    """Decodes an HF image cell ({"bytes", "path"}) into a loaded PIL image (through page_cache if given)."""
+    if value is None or value.get("bytes") is None:
+        return None
+    if page_cache is not None:
+        return Image.fromarray(page_cache.load_bytes(value["bytes"]))
+    img = Image.open(io.BytesIO(value["bytes"]))
+    img.load()
+    return img
+
+class ParquetStream:
+    """
+    Iterates the rows of a dataset's parquet shards as dicts, like a split of
+    datasets.load_dataset, without materializing the dataset first.
+    source is a local parquet directory or a HuggingFace dataset repo; remote
+    shards are read row group by row group through HfFileSystem, so nothing is
+    written to disk. A background thread reads the next row groups while the
+    current one is consumed, and image cells are decoded on a thread pool
+    (or read from page_cache, a PageCache shared with the other stages).
+    """
+
+    def __init__(self, source, split="train", columns=None, decode_images=True,
+                 prefetch_row_groups=2, decode_workers=4, limit=None, files=None, page_cache=None):
+        self.source = source
+        self.split = split
+        self.columns = columns
+        self.decode_images = decode_images
+        self.prefetch_row_groups = prefetch_row_groups
+        self.decode_workers = decode_workers
+        self.limit = limit
+        self.page_cache = page_cache
+        self.is_local = os.path.isdir(source)
+        self._files = files
+
+    @property
+    def files(self):
+        """Parquet files of the split, relative to the source."""
+        if self._files is None:
+            lister = LocalSource(self.source) if self.is_local else HubSource(self.source, download_dir=None)
+            self._files = split_files(list(lister.list_files()), self.split)
+        return self._files
+
+    def _open(self, filename):
+        if self.is_local:
+            return pq.ParquetFile(os.path.join(self.source, filename))
+        from huggingface_hub import HfFileSystem
+        return pq.ParquetFile(HfFileSystem().open(f"datasets/{self.source}/{filename}", "rb"))
+
+    def _produce(self, executor, out_queue, stop):
+        try:
+            for filename in self.files:
+                parquet_file = self._open(filename)
+                image_columns = [f.name for f in parquet_file.schema_arrow
+                                 if is_image_field(f) and (self.columns is None or f.name in self.columns)]
+                for rg in range(parquet_file.num_row_groups):
+                    if stop.is_set():
+                        return
+                    rows = parquet_file.read_row_group(rg, columns=self.columns).to_pylist()
+                    futures = {}
+                    if self.decode_images:
+                        for col in image_columns:
+                            futures[col] = [executor.submit(decode_image, row[col], self.page_cache) for row in rows]
+                    out_queue.put((rows, futures))
+        except Exception as e:
+            out_queue.put(e)
+        finally:
+            out_queue.put(None)
+
+    def __iter__(self):
+        out_queue = queue.Queue(maxsize=max(1, self.prefetch_row_groups))
+        stop = threading.Event()
+        count = 0
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.decode_workers) as executor:
+            producer = threading.Thread(target=self._produce, args=(executor, out_queue, stop), daemon=True)
+            producer.start()
+            try:
+                while True:
+                    item = out_queue.get()
+                    if item is None:
+                        return
+                    if isinstance(item, Exception):
+                        raise item
+                    rows, futures = item
+                    for i, row in enumerate(rows):
+                        if self.limit is not None and count >= self.limit:
+                            return
+                        for col, col_futures in futures.items():
+                            row[col] = col_futures[i].result()
+                        count += 1
+                        yield row
+            finally:
+                stop.set()
+                # Drain so the producer is never stuck on a full queue, and drop
+                # decodes nobody will read so the pool shuts down quickly
+                pending = [futures]
+                while producer.is_alive() or not out_queue.empty():
+                    try:
+                        item = out_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if isinstance(item, tuple):
+                        pending.append(item[1])
+                for row_group_futures in pending:
+                    for col_futures in row_group_futures.values():
+                        for future in col_futures:
+                            future.cancel()
+
+def open_examples(dataset_name, parquet_dir=None, streaming=True, split="train", columns=None,
+                  decode_images=True, limit=None, **stream_kwargs):
+    """
+    Examples of a dataset split, either streamed (ParquetStream over parquet_dir
+    or the hub repo) or fully loaded with datasets.load_dataset.
+    """
+    if streaming or parquet_dir:
+        return ParquetStream(parquet_dir or dataset_name, split=split, columns=columns,
+                             decode_images=decode_images, limit=limit, **stream_kwargs)
+    from datasets import load_dataset
+    examples = load_dataset(dataset_name)[split]
+    if columns:
+        examples = examples.select_columns(columns)
+    if limit is not None:
+        examples = examples.select(range(min(limit, len(examples))))
+    return examples
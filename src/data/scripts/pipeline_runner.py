@@ -0,0 +1,394 @@
+import os
+import ast
+import sys
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+DEFAULT_PIPELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pipeline.json")
+STATE_NAME = "state.sqlite"
+MISSING = "missing"
+# Lines of a failed stage's log echoed to the terminal
+LOG_TAIL = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    digest TEXT
+);
+CREATE TABLE IF NOT EXISTS stages (
+    name TEXT PRIMARY KEY,
+    status TEXT,
+    attempt TEXT,
+    fingerprint TEXT,
+    parts TEXT,
+    outputs TEXT,
+    seconds REAL,
+    finished_at REAL
+);
+"""
+
+def digest_of(obj):
+    return hashlib.blake2b(json.dumps(obj, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+def overlaps(a, b):
+    """True if one path is the other or lies inside it."""
+    a, b = os.path.abspath(a), os.path.abspath(b)
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+# --- Stages ---
+class Stage:
+    """
+    One step of the pipeline: a CLI command (or module) run with args.
+    - args: parameters that change the result, part of the fingerprint
+    - run_args: parameters that don't (workers, prefetch, caches), passed but not fingerprinted
+    - inputs / outputs: files or directories read / written. A directory changed
+      in place (flatten) is listed as both.
+    - after: stages to wait for besides those producing the inputs
+    - clean: remove the outputs before re-running with a new fingerprint, so
+      scripts that resume from their outputs start over
+    """
+
+    def __init__(self, name, command, args=(), run_args=(), inputs=(), outputs=(), after=(), clean=False):
+        self.name = name
+        self.command = command
+        self.args = list(args)
+        self.run_args = list(run_args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.clean = clean
+        self.deps = []
+        # Outputs a later stage rewrites in place: only their existence is checked
+        self.handed_over = set()
+
+    @property
+    def module(self):
+        from src.data.cli import COMMANDS
+        return COMMANDS[self.command][0] if self.command in COMMANDS else self.command
+
+def expand(value, variables):
+    if isinstance(value, list):
+        return [expand(v, variables) for v in value]
+    return str(value).format_map(variables)
+
+def load_pipeline(path, overrides=None):
+    """
+    Stages of a pipeline JSON file {"vars": {...}, "stages": [{"name", "command", ...}]}.
+    "{var}" placeholders in args, inputs and outputs are filled from vars (overridden
+    by --set). A stage depends on earlier stages whose outputs overlap its inputs.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    variables = {**config.get("vars", {}), **(overrides or {})}
+    stages = []
+    for spec in config["stages"]:
+        spec = dict(spec)
+        for key in ("args", "run_args", "inputs", "outputs"):
+            spec[key] = expand(spec.get(key, []), variables)
+        stages.append(Stage(**spec))
+
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise SystemExit(f"Duplicate stage names in {path}")
+    for i, stage in enumerate(stages):
+        unknown = set(stage.after) - set(names[:i])
+        if unknown:
+            raise SystemExit(f"Stage {stage.name}: 'after' must name earlier stages, got {sorted(unknown)}")
+        # Only earlier stages count, so a stage rewriting its input in place stays acyclic
+        for earlier in stages[:i]:
+            produces = any(overlaps(src, dst) for src in stage.inputs for dst in earlier.outputs)
+            if produces or earlier.name in stage.after:
+                stage.deps.append(earlier)
+        for later in stages[i + 1:]:
+            stage.handed_over.update(p for p in stage.outputs if any(overlaps(p, q) for q in later.outputs))
+    return stages
+
+def select_stages(stages, targets):
+    """The target stages and everything upstream of them (all stages if no targets)."""
+    if not targets:
+        return stages
+    by_name = {s.name: s for s in stages}
+    unknown = set(targets) - set(by_name)
+    if unknown:
+        raise SystemExit(f"Unknown stages {sorted(unknown)}, expected some of {list(by_name)}")
+    wanted, todo = set(), [by_name[t] for t in targets]
+    while todo:
+        stage = todo.pop()
+        if stage.name not in wanted:
+            wanted.add(stage.name)
+            todo.extend(stage.deps)
+    return [s for s in stages if s.name in wanted]
+
+# --- Code ---
+def module_file(module):
+    """Source file of a module under src/, or None for third-party and missing modules."""
+    if module != "src" and not module.startswith("src."):
+        return None
+    path = os.path.join(*module.split(".")) + ".py"
+    return path if os.path.isfile(path) else None
+
+def code_files(module):
+    """Source files of a module and every src module it imports, transitively (lazy imports included)."""
+    seen, todo = set(), [module]
+    while todo:
+        path = module_file(todo.pop())
+        if path is None or path in seen:
+            continue
+        seen.add(path)
+        with open(path, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                todo.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                todo.append(node.module)
+                # from src.data.scripts import page_cache
+                todo.extend(f"{node.module}.{alias.name}" for alias in node.names)
+    return sorted(seen)
+
+# --- State ---
+class PipelineState:
+    """
+    SQLite record of every stage's last run (fingerprint, fingerprint parts,
+    output digests) and of file content digests, remembered per (path, size,
+    mtime) so unchanged files are not re-read. Shared by the stage threads.
+    """
+
+    def __init__(self, state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_dir = state_dir
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(state_dir, STATE_NAME), timeout=120, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self.conn.execute("SELECT size, mtime_ns, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                              (path, st.st_size, st.st_mtime_ns, h.hexdigest()))
+        return h.hexdigest()
+
+    def path_digest(self, path):
+        """Content digest of a file, or of a directory's relative file names and contents."""
+        if os.path.isfile(path):
+            return self.file_digest(path)
+        if not os.path.isdir(path):
+            return MISSING
+        entries = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                entries.append((os.path.relpath(file_path, path), self.file_digest(file_path)))
+        return digest_of(entries)
+
+    def last_run(self, name):
+        with self._lock:
+            row = self.conn.execute("SELECT status, attempt, fingerprint, parts, outputs, seconds FROM stages WHERE name = ?",
+                                    (name,)).fetchone()
+        if row is None:
+            return None
+        keys = ("status", "attempt", "fingerprint", "parts", "outputs", "seconds")
+        run = dict(zip(keys, row))
+        run["parts"] = json.loads(run["parts"]) if run["parts"] else {}
+        run["outputs"] = json.loads(run["outputs"]) if run["outputs"] else {}
+        return run
+
+    def record(self, name, status, attempt, fingerprint=None, parts=None, outputs=None, seconds=None):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (name, status, attempt, fingerprint, json.dumps(parts) if parts else None,
+                               json.dumps(outputs) if outputs else None, seconds, time.time()))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+# --- Fingerprints ---
+def fingerprint(stage, state):
+    """Returns (fingerprint, parts): digest of the stage's params, code and input contents."""
+    parts = {
+        "params": digest_of([stage.module, stage.args]),
+        "code": {path: state.file_digest(path) for path in code_files(stage.module)},
+        "inputs": {path: state.path_digest(path) for path in stage.inputs},
+    }
+    return digest_of(parts), parts
+
+def output_digests(stage, state):
+    return {path: ("exists" if os.path.exists(path) else MISSING) if path in stage.handed_over
+            else state.path_digest(path) for path in stage.outputs}
+
+def explain(old, new):
+    """Which params, code files or inputs differ between two fingerprints' parts."""
+    if not old:
+        return ["never run"]
+    reasons = ["params"] if old.get("params") != new["params"] else []
+    for kind, label in (("code", "code"), ("inputs", "input")):
+        before, after = old.get(kind, {}), new[kind]
+        reasons.extend(f"{label} {path}"
+                       for path in sorted(set(before) | set(after)) if before.get(path) != after.get(path))
+    return reasons
+
+def plan(stage, state, force=False):
+    """(needs to run, reasons, fingerprint, parts) from the current inputs and the last recorded run."""
+    fp, parts = fingerprint(stage, state)
+    last = state.last_run(stage.name)
+    if force:
+        return True, ["forced"], fp, parts
+    if last is None or last["status"] != "done":
+        return True, ["never run"] if last is None else [f"last run {last['status']}"], fp, parts
+    if last["fingerprint"] != fp:
+        return True, explain(last["parts"], parts), fp, parts
+    outputs = output_digests(stage, state)
+    changed = [f"output {p}" for p in stage.outputs if outputs[p] == MISSING or outputs[p] != last["outputs"].get(p)]
+    return bool(changed), changed, fp, parts
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+# --- Execution ---
+def run_stage(stage, state, force=False, dry_run=False):
+    """
+    Runs a stage if its fingerprint or outputs changed. A re-run with a new
+    fingerprint first removes the outputs of a clean stage; an interrupted or
+    failed run with the same fingerprint is resumed instead.
+    Returns (status, reasons, seconds).
+    """
+    needed, reasons, fp, parts = plan(stage, state, force)
+    if not needed:
+        return "skipped", [], 0.0
+    if dry_run:
+        return "would run", reasons, 0.0
+
+    last = state.last_run(stage.name)
+    previous = last and (last["attempt"] if last["status"] != "done" else last["fingerprint"])
+    if stage.clean and previous and previous != fp:
+        for path in stage.outputs:
+            if not any(overlaps(path, src) for src in stage.inputs):
+                remove_path(path)
+    state.record(stage.name, "running", fp, parts=parts)
+
+    cmd = [sys.executable, "-m", stage.module, *stage.args, *stage.run_args]
+    log_path = os.path.join(state.state_dir, "logs", f"{stage.name}.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    print(f"[{stage.name}] running ({', '.join(reasons)}), log: {log_path}", flush=True)
+    start = time.perf_counter()
+    with open(log_path, "w", encoding="utf-8") as log:
+        log.write(" ".join(cmd) + "\n\n")
+        log.flush()
+        returncode = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+    seconds = time.perf_counter() - start
+
+    if returncode != 0:
+        state.record(stage.name, "failed", fp, parts=parts, seconds=seconds)
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            tail = f.readlines()[-LOG_TAIL:]
+        print(f"[{stage.name}] failed with exit code {returncode} after {seconds:.1f}s:\n  " + "  ".join(tail), flush=True)
+        return "failed", reasons, seconds
+    missing = [p for p in stage.outputs if not os.path.exists(p)]
+    if missing:
+        state.record(stage.name, "failed", fp, parts=parts, seconds=seconds)
+        print(f"[{stage.name}] finished but did not write {missing}", flush=True)
+        return "failed", reasons, seconds
+    # Fingerprinted again after the run: inputs rewritten in place (flatten) are part of the result
+    done_fp, done_parts = fingerprint(stage, state)
+    state.record(stage.name, "done", fp, done_fp, done_parts, output_digests(stage, state), seconds)
+    print(f"[{stage.name}] done in {seconds:.1f}s", flush=True)
+    return "done", reasons, seconds
+
+def run_pipeline(stages, state, jobs=2, force=(), dry_run=False):
+    """
+    Runs the stages in dependency order, up to `jobs` at a time. A stage starts
+    once all its upstream stages finished; stages downstream of a failure are
+    blocked. In a dry run, stages after one that would run are reported as
+    pending, since whether they run depends on what their upstream writes.
+    Returns {stage name: (status, reasons, seconds)}.
+    """
+    results, running = {}, {}
+    pending = list(stages)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while pending or running:
+            for stage in list(pending):
+                dep_status = [results[d.name][0] if d.name in results else None for d in stage.deps if d in stages]
+                if None in dep_status:
+                    continue
+                pending.remove(stage)
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    results[stage.name] = ("blocked", ["upstream failed"], 0.0)
+                elif dry_run and any(s in ("would run", "pending") for s in dep_status):
+                    results[stage.name] = ("pending", ["upstream would run"], 0.0)
+                else:
+                    running[pool.submit(run_stage, stage, state, stage.name in force, dry_run)] = stage
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except Exception as e:
+                    print(f"[{stage.name}] error: {e}", flush=True)
+                    results[stage.name] = ("failed", [str(e)], 0.0)
+    return results
+
+def print_results(stages, results):
+    width = max(len(s.name) for s in stages)
+    print("\n" + "=" * 60)
+    for stage in stages:
+        status, reasons, seconds = results[stage.name]
+        timing = f"{seconds:8.1f}s" if seconds else " " * 9
+        print(f"  {stage.name:<{width}}  {status:<9} {timing}  {'; '.join(reasons)}")
+    print("=" * 60)
+
+def parse_overrides(items):
+    overrides = {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--set expects key=value, got {item}")
+        overrides[key] = value
+    return overrides
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline stages whose inputs, parameters or code changed since their last run")
+    parser.add_argument("targets", nargs="*", help="Stages to bring up to date, with their upstream (default: all)")
+    parser.add_argument("--pipeline", type=str, default=DEFAULT_PIPELINE, help="Pipeline definition (JSON)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Override a pipeline variable")
+    parser.add_argument("--state-dir", type=str, default="data/.pipeline", help="Fingerprints and stage logs")
+    parser.add_argument("--jobs", type=int, default=2, help="Independent stages run at the same time")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE", help="Re-run a stage even if unchanged")
+    parser.add_argument("--dry-run", action="store_true", help="Show which stages would run and why")
+    args = parser.parse_args()
+
+    stages = select_stages(load_pipeline(args.pipeline, parse_overrides(args.set)), args.targets)
+    state = PipelineState(args.state_dir)
+    results = run_pipeline(stages, state, args.jobs, set(args.force), args.dry_run)
+    state.close()
+    print_results(stages, results)
+    sys.exit(1 if any(r[0] in ("failed", "blocked") for r in results.values()) else 0)
+
+if __name__ == "__main__":
+    main()
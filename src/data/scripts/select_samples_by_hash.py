@@ -3,87 +3,237 @@ import numpy as np
 import argparse
 import json
 import shutil
-import glob
 import pyarrow.parquet as pq
 from tqdm.auto import tqdm
-from huggingface_hub import hf_hub_download
-from PIL import Image
-import io
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor
-
-def get_hex_from_hash(h):
-    """Converts a flattened 64-dim binary hash (as float) to a hex string for sorting."""
-    # Convert float/bool to bits
-    bits = (h > 0.5).astype(int)
-    # Pack 8 bits into a byte
-    bytes_list = []
-    for i in range(0, 64, 8):
-        byte_val = 0
-        for b in range(8):
-            byte_val = (byte_val << 1) | bits[i + b]
-        bytes_list.append(byte_val)
-    return bytes(bytes_list).hex()
-
-def save_image_worker(args):
-    """Worker function to save a single image."""
-    img_bytes, rel_path, output_dir = args
-    if img_bytes is None: return False
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.data.scripts.stage_metrics import metrics, add_metrics_args, configure_from_args
+from src.data.scripts.hash_store import HashStore, consolidate, stale_shards, STORE_NAME, NO_LOCATION
+from src.data.scripts.hamming_index import MultiIndexHash, cluster_representatives, cluster_report
+from src.data.scripts.diverse_selection import (
+    document_ids, prefix_buckets, stratified_selection, farthest_point_sampling,
+    diversity_report, print_diversity_comparison
+)
+
+STRATEGIES = ["hash-order", "stratified", "fps"]
+DEFAULT_EMBED_DIR = "data/toanmath_embeddings/embeddings"
+
+def select_by_hash_order(records, n):
+    """
+    Selects the first n records in hash order.
+    uint64 order is the same as the hex-string order of the hashes.
+    """
+    order = np.argsort(records['hash'], kind='stable')
+    return records[order[:n]]
+
+def select_records(store, records, args):
+    """Selects args.n records with the chosen strategy. Returns (selected, doc_ids or None)."""
+    doc_ids = None
+    if args.by_document or args.report_diversity:
+        print("Deriving source documents from paths...")
+        doc_ids = document_ids(store.get_paths(records['path']))
+
+    if args.strategy == "hash-order":
+        return select_by_hash_order(records, args.n), doc_ids
+    if args.strategy == "stratified":
+        strata = doc_ids if args.by_document else prefix_buckets(records['hash'], args.prefix_bits)
+        idx = stratified_selection(strata, args.n, seed=args.seed)
+    else:
+        idx = farthest_point_sampling(records['hash'], args.n, seed=args.seed, pool_size=args.fps_pool or None)
+    idx = np.sort(idx)
+    return records[idx], doc_ids
+
+def dedupe_records(records, max_distance):
+    """Keeps one record per near-duplicate cluster (pHashes within max_distance bits)."""
+    index = MultiIndexHash(records['hash'], max_distance=max_distance)
+    labels = index.clusters()
+    report = cluster_report(labels)
+    return records[cluster_representatives(labels)], report
+
+def group_by_shard(store, selected):
+    """Maps parquet filename -> list of (relative path, row group, row offset) for the selected records."""
+    parquet_groups = {}
+    for shard_id in np.unique(selected['shard']):
+        path_ids = selected['path'][selected['shard'] == shard_id]
+        parquet_groups[store.shards[shard_id]] = list(zip(
+            store.get_paths(path_ids),
+            store.row_groups[path_ids].tolist(),
+            store.row_offsets[path_ids].tolist(),
+        ))
+    return parquet_groups
+
+def open_parquet(parquet_fn, args, temp_download_dir):
+    """
+    Opens a shard for reading. Returns (ParquetFile, downloaded path or None,
+    remote file handle or None); the caller closes the handle.
+    By default the hub file is read remotely, so only the footer and the row
+    groups that are actually read get transferred.
+    """
+    if args.parquet_dir:
+        return pq.ParquetFile(os.path.join(args.parquet_dir, parquet_fn)), None, None
+    from huggingface_hub import hf_hub_download, HfFileSystem
+    if args.download:
+        downloaded_path = hf_hub_download(
+            repo_id=args.repo, filename=parquet_fn,
+            repo_type="dataset", local_dir=temp_download_dir
+        )
+        return pq.ParquetFile(downloaded_path), downloaded_path, None
+    handle = HfFileSystem().open(f"datasets/{args.repo}/{parquet_fn}", 'rb')
     try:
-        save_path = os.path.join(output_dir, rel_path)
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        if isinstance(img_bytes, dict) and 'bytes' in img_bytes:
-            img_bytes = img_bytes['bytes']
-        with open(save_path, 'wb') as f:
-            f.write(img_bytes)
-        return True
-    except Exception as e:
-        print(f"Error saving {rel_path}: {e}")
-        return False
+        return pq.ParquetFile(handle), None, handle
+    except Exception:
+        handle.close()
+        raise
+
+def locate_rows(parquet_file, rel_paths):
+    """Finds (row group, row offset) of paths without a recorded location by scanning only the 'path' column."""
+    wanted = set(rel_paths)
+    found = {}
+    for rg in range(parquet_file.num_row_groups):
+        paths = parquet_file.read_row_group(rg, columns=['path']).column('path').to_pylist()
+        for offset, path in enumerate(paths):
+            if path in wanted:
+                found[path] = (rg, offset)
+        if len(found) >= len(wanted):
+            break
+    return found
+
+def extract_rows(parquet_file, items, output_dir):
+    """
+    Writes the images of items = [(rel_path, row_group, row_offset)] to output_dir,
+    reading only the needed row groups and only the 'image' and 'path' columns.
+    Returns the number of images written.
+    """
+    missing = [rel_path for rel_path, rg, _ in items if rg == NO_LOCATION]
+    if missing:
+        found = locate_rows(parquet_file, missing)
+        items = [(p, rg, off) for p, rg, off in items if rg != NO_LOCATION] + \
+                [(p, *found[p]) for p in missing if p in found]
+
+    by_row_group = {}
+    for rel_path, rg, offset in items:
+        by_row_group.setdefault(rg, []).append((offset, rel_path))
+
+    extracted_count = 0
+    for rg, rows in sorted(by_row_group.items()):
+        with metrics.stage("extraction.read_row_group"):
+            table = parquet_file.read_row_group(rg, columns=['image', 'path'])
+            taken = table.take([offset for offset, _ in rows])
+        with metrics.stage("extraction.write"):
+            for img, path, (_, rel_path) in zip(taken.column('image').to_pylist(),
+                                                taken.column('path').to_pylist(), rows):
+                if path != rel_path:
+                    print(f"Location mismatch for {rel_path} (found {path}), skipping.")
+                    metrics.inc("extraction.location_mismatches")
+                    continue
+                if isinstance(img, dict):
+                    img = img.get('bytes')
+                if img is None:
+                    continue
+                save_path = os.path.join(output_dir, rel_path)
+                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                with open(save_path, 'wb') as f:
+                    f.write(img)
+                extracted_count += 1
+    metrics.inc("extraction.images", extracted_count)
+    return extracted_count
+
+def extract_shard(parquet_fn, items, args, temp_download_dir):
+    """Thread worker: extracts the selected rows of one shard. Returns (parquet_fn, count)."""
+    with metrics.stage("extraction.open_shard"):
+        parquet_file, downloaded_path, handle = open_parquet(parquet_fn, args, temp_download_dir)
+    try:
+        return parquet_fn, extract_rows(parquet_file, items, args.output_dir)
+    finally:
+        parquet_file.close()
+        if handle is not None:
+            handle.close()
+        # Cleanup parquet to save space
+        if downloaded_path and os.path.exists(downloaded_path):
+            os.remove(downloaded_path)
 
 def main():
     parser = argparse.ArgumentParser(description="Sort images by hash and select top N samples")
-    parser.add_argument("--embed-dir", type=str, default="data/toanmath_embeddings/embeddings", help="Directory with .npz files")
+    parser.add_argument("--embed-dir", type=str, default=None,
+                        help=f"Directory with .npz files (default: embeddings/ next to --store, else {DEFAULT_EMBED_DIR})")
+    parser.add_argument("--store", type=str, default=None,
+                        help=f"Consolidated hash store (default: {STORE_NAME} next to --embed-dir). Rebuilt from "
+                             f"--embed-dir if missing or older than a shard file there")
+    parser.add_argument("--rebuild-store", action="store_true", help="Rebuild the store from --embed-dir first")
     parser.add_argument("--repo", type=str, default="daominhwysi/toanmath.com-full", help="HF Repo ID for downloading parquets")
     parser.add_argument("--output-dir", type=str, default="data/selected_samples_25k", help="Where to save selected images")
     parser.add_argument("--n", type=int, default=25000, help="Number of images to select")
     parser.add_argument("--workers", type=int, default=max(1, mp.cpu_count() // 2))
+    parser.add_argument("--dedupe-distance", type=int, default=None,
+                        help="Drop near-duplicate pages within this Hamming distance before selecting")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="hash-order",
+                        help="hash-order: first N by hash; stratified: round-robin over hash prefix buckets "
+                             "(or documents); fps: greedy farthest-point sampling")
+    parser.add_argument("--by-document", action="store_true",
+                        help="Stratify by source document (derived from the path) instead of hash buckets")
+    parser.add_argument("--prefix-bits", type=int, default=12, help="Hash prefix bits used as strata")
+    parser.add_argument("--fps-pool", type=int, default=200000,
+                        help="Random candidate pool for fps (bounds time/memory), 0 for the full corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report-diversity", action="store_true",
+                        help="Compare diversity of the selection against hash-order truncation")
+    parser.add_argument("--report-only", action="store_true", help="Select and report without extracting images")
+    parser.add_argument("--parquet-dir", type=str, help="Local directory of parquet files used instead of --repo")
+    parser.add_argument("--download", action="store_true",
+                        help="Download whole parquet files instead of reading only the needed row groups remotely")
+    add_metrics_args(parser)
 
     args = parser.parse_args()
+    configure_from_args(args)
 
     # 1. Collect all hashes
-    print(f"Loading hashes from {args.embed_dir}...")
-    npz_pattern = os.path.join(args.embed_dir, "*.npz")
-    npz_files = [f for f in glob.glob(npz_pattern) if os.path.basename(f) != "local_images.npz"]
+    # The store and its shard files sit side by side, as generate_embeddings writes them
+    if args.embed_dir is None:
+        args.embed_dir = os.path.join(os.path.dirname(args.store), "embeddings") if args.store else DEFAULT_EMBED_DIR
+    store_path = args.store or os.path.join(os.path.dirname(os.path.normpath(args.embed_dir)), STORE_NAME)
+    stale = stale_shards(args.embed_dir, store_path)
+    if args.rebuild_store or not os.path.exists(store_path) or stale:
+        if stale and os.path.exists(store_path):
+            print(f"{len(stale)} shard files in {args.embed_dir} are newer than or missing from {store_path} "
+                  f"(e.g. {stale[0]}).")
+        print(f"Consolidating hashes from {args.embed_dir} into {store_path}...")
+        consolidate(args.embed_dir, store_path)
+    print(f"Loading hashes from {store_path}...")
+    store = HashStore(store_path)
 
-    all_items = [] # Will store (hex_hash, parquet_filename, rel_path)
+    records = store.records() # Structured array of (hash, shard id, path id)
+    print(f"Found total {len(records)} images.")
 
-    for npz_path in tqdm(npz_files, desc="Reading NPZ files"):
-        data = np.load(npz_path)
-        hashes = data['embeddings']
-        paths = data['paths']
-        parquet_filename = os.path.basename(npz_path).replace('.npz', '.parquet')
+    if args.dedupe_distance is not None:
+        print(f"Removing near-duplicates (Hamming distance <= {args.dedupe_distance})...")
+        records, report = dedupe_records(records, args.dedupe_distance)
+        print(f"  {report['num_clusters']} clusters, {report['num_duplicates']} duplicates removed "
+              f"(largest cluster: {report['largest_cluster']} pages).")
 
-        for h, p in zip(hashes, paths):
-            hex_h = get_hex_from_hash(h)
-            all_items.append((hex_h, parquet_filename, p))
+    # 2-3. Select top N with the chosen strategy
+    print(f"Selecting with strategy '{args.strategy}'...")
+    selected, doc_ids = select_records(store, records, args)
+    print(f"Selected {len(selected)} images.")
 
-    print(f"Found total {len(all_items)} images.")
+    if args.report_diversity:
+        # doc_ids is aligned with records; map selections back through path ids
+        doc_by_path = np.full(len(store), -1, dtype=np.int64)
+        doc_by_path[records['path']] = doc_ids
+        baseline = select_by_hash_order(records, args.n)
+        reports = {
+            "hash-order": diversity_report(baseline['hash'], doc_by_path[baseline['path']],
+                                           prefix_bits=args.prefix_bits),
+        }
+        if args.strategy != "hash-order":
+            reports[args.strategy] = diversity_report(selected['hash'], doc_by_path[selected['path']],
+                                                      prefix_bits=args.prefix_bits)
+        print_diversity_comparison(reports)
 
-    # 2. Sort by hash
-    print("Sorting by hash...")
-    all_items.sort(key=lambda x: x[0])
-
-    # 3. Select top N
-    selected_items = all_items[:args.n]
-    print(f"Selected {len(selected_items)} images.")
+    if args.report_only:
+        return
 
     # 4. Group by parquet for efficient extraction
-    parquet_groups = {}
-    for hex_h, parquet_fn, rel_path in selected_items:
-        if parquet_fn not in parquet_groups:
-            parquet_groups[parquet_fn] = []
-        parquet_groups[parquet_fn].append(rel_path)
+    parquet_groups = group_by_shard(store, selected)
 
     # 5. Extract images
     os.makedirs(args.output_dir, exist_ok=True)
@@ -91,45 +241,20 @@ def main():
     os.makedirs(temp_download_dir, exist_ok=True)
 
     try:
-        for parquet_fn, rel_paths in tqdm(parquet_groups.items(), desc="Extracting from Parquets"):
-            print(f"\nProcessing {parquet_fn} ({len(rel_paths)} images)...")
-
-            # Download parquet
-            downloaded_path = hf_hub_download(
-                repo_id=args.repo, filename=parquet_fn,
-                repo_type="dataset", local_dir=temp_download_dir
-            )
-
-            # Read parquet
-            parquet_file = pq.ParquetFile(downloaded_path)
-            path_set = set(rel_paths)
-
-            extracted_count = 0
-            with ProcessPoolExecutor(max_workers=args.workers) as executor:
-                num_batches = (parquet_file.metadata.num_rows // 1024) + 1
-                for batch in tqdm(parquet_file.iter_batches(batch_size=1024),
-                                 total=num_batches, desc=f"  Scanning {parquet_fn}", leave=False):
-                    batch_dict = batch.to_pydict()
-                    images = batch_dict.get('image', [])
-                    paths = batch_dict.get('path', [])
-
-                    tasks = []
-                    for img, path in zip(images, paths):
-                        if path in path_set:
-                            tasks.append((img, path, args.output_dir))
-
-                    if tasks:
-                        results = list(executor.map(save_image_worker, tasks))
-                        extracted_count += sum(1 for r in results if r)
-
-                    if extracted_count >= len(rel_paths):
-                        break
-
-            print(f"  Extracted {extracted_count} images.")
-
-            # Cleanup parquet to save space
-            if os.path.exists(downloaded_path):
-                os.remove(downloaded_path)
+        # Shards are independent, so they are read in parallel (I/O bound, pyarrow releases the GIL)
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(extract_shard, parquet_fn, items, args, temp_download_dir)
+                       for parquet_fn, items in parquet_groups.items()]
+            total_extracted = 0
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Extracting from Parquets"):
+                try:
+                    parquet_fn, extracted_count = future.result()
+                    total_extracted += extracted_count
+                    tqdm.write(f"  {parquet_fn}: extracted {extracted_count}/{len(parquet_groups[parquet_fn])} images.")
+                except Exception as e:
+                    tqdm.write(f"Error extracting: {e}")
+        print(f"Extracted {total_extracted} images to {args.output_dir}")
+        metrics.print_summary("extraction")
 
     finally:
         if os.path.exists(temp_download_dir):
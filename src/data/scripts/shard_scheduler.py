@@ -0,0 +1,233 @@
+import os
+import glob
+import json
+import time
+import shutil
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pyarrow.parquet as pq
+from tqdm.auto import tqdm
+from src.data.scripts.hash_store import write_shard, read_shard, shard_path
+from src.data.scripts.stage_metrics import metrics
+
+# --- Shard sources ---
+class HubSource:
+    """Parquet shards of a HuggingFace dataset repo, downloaded on demand."""
+
+    def __init__(self, repo, download_dir):
+        self.repo = repo
+        self.download_dir = download_dir
+
+    def list_files(self):
+        """Returns {filename: size in bytes} for every parquet in the repo."""
+        from huggingface_hub import HfApi
+        entries = HfApi().list_repo_tree(repo_id=self.repo, repo_type="dataset", recursive=True)
+        return {e.path: getattr(e, 'size', 0) or 0 for e in entries if e.path.endswith('.parquet')}
+
+    def fetch(self, filename):
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(repo_id=self.repo, filename=filename,
+                               repo_type="dataset", local_dir=self.download_dir)
+
+    def release(self, local_path):
+        if os.path.exists(local_path):
+            os.remove(local_path)
+
+class LocalSource:
+    """A local directory of parquet files standing in for the hub (nothing is downloaded or deleted)."""
+
+    def __init__(self, parquet_dir):
+        self.parquet_dir = parquet_dir
+
+    def list_files(self):
+        files = glob.glob(os.path.join(self.parquet_dir, "**", "*.parquet"), recursive=True)
+        return {os.path.relpath(f, self.parquet_dir).replace(os.sep, '/'): os.path.getsize(f) for f in files}
+
+    def fetch(self, filename):
+        return os.path.join(self.parquet_dir, filename)
+
+    def release(self, local_path):
+        pass
+
+# --- Progress ---
+class ShardProgress:
+    """
+    progress.json with per-shard and per-row-group state:
+    {"processed_files": [...], "row_groups": {filename: [done indices]}, "last_updated": ...}
+    Row-group results are kept in partial_dir until their shard is complete.
+    """
+
+    def __init__(self, progress_file, partial_dir):
+        self.progress_file = progress_file
+        self.partial_dir = partial_dir
+        self.data = {"processed_files": [], "row_groups": {}, "last_updated": ""}
+        if os.path.exists(progress_file):
+            with open(progress_file, 'r') as f:
+                self.data.update(json.load(f))
+        self.data.setdefault("row_groups", {})
+
+    def save(self):
+        self.data["last_updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        tmp_path = self.progress_file + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=4)
+        os.replace(tmp_path, self.progress_file)
+
+    def is_done(self, filename):
+        return filename in self.data["processed_files"]
+
+    def done_row_groups(self, filename):
+        return set(self.data["row_groups"].get(filename, []))
+
+    def partial_path(self, filename, row_group):
+        return os.path.join(self.partial_dir, filename.replace('.parquet', ''), f"rg_{row_group:05d}.npz")
+
+    def mark_row_group(self, filename, row_group, hashes, paths, locations):
+        write_shard(self.partial_path(filename, row_group), hashes, paths, locations)
+        self.data["row_groups"].setdefault(filename, []).append(row_group)
+        self.save()
+
+    def collect_row_groups(self, filename, num_row_groups):
+        """Concatenates the partial results of a shard in row-group order."""
+        all_hashes, all_paths, all_locations = [], [], []
+        for rg in range(num_row_groups):
+            hashes, paths, locations = read_shard(self.partial_path(filename, rg))
+            all_hashes.append(hashes)
+            all_paths.extend(paths)
+            all_locations.append(locations)
+        if not all_hashes:
+            return np.zeros(0, dtype=np.uint64), all_paths, np.zeros((0, 2), dtype=np.uint32)
+        return np.concatenate(all_hashes), all_paths, np.concatenate(all_locations)
+
+    def mark_file(self, filename):
+        if filename not in self.data["processed_files"]:
+            self.data["processed_files"].append(filename)
+        self.data["row_groups"].pop(filename, None)
+        self.save()
+        shutil.rmtree(os.path.join(self.partial_dir, filename.replace('.parquet', '')), ignore_errors=True)
+
+# --- Scheduler ---
+def run_shard_scheduler(source, files, embed_dir, progress, hash_fn, hash_args=(),
+                        workers=1, prefetch=1, concurrent_shards=1, disk_budget=None):
+    """
+    Hashes parquet shards with download/compute overlap.
+    - Up to `prefetch` shards are fetched ahead of the ones being hashed.
+    - Up to `concurrent_shards` shards have row groups queued on the shared process pool.
+    - Fetched-but-unreleased shards never exceed `disk_budget` bytes (one shard is
+      always allowed so a single oversized file cannot stall the run).
+    hash_fn(args) runs in the workers with args = (local_path, [row_group], *hash_args)
+    and returns (hashes, paths, locations, num_failed).
+    Returns the list of shards that completed.
+    """
+    pending = deque(files.keys())
+    fetching = {}    # future -> filename
+    ready = deque()  # (filename, local_path) fetched, waiting for a hashing slot
+    active = {}      # filename -> {"path", "num_row_groups", "remaining"}
+    rg_futures = {}  # future -> (filename, row_group, submit time)
+    held_bytes = 0
+    completed = []
+
+    def can_fetch():
+        if not pending or len(fetching) + len(ready) >= prefetch + max(0, concurrent_shards - len(active)):
+            return False
+        if disk_budget is None or (held_bytes == 0 and not fetching):
+            return True
+        return held_bytes + files[pending[0]] <= disk_budget
+
+    def timed_fetch(filename):
+        with metrics.stage("hashing.fetch"):
+            return source.fetch(filename)
+
+    def finish_shard(filename):
+        nonlocal held_bytes
+        state = active.pop(filename)
+        with metrics.stage("hashing.write_shard"):
+            hashes, paths, locations = progress.collect_row_groups(filename, state["num_row_groups"])
+            # Written even when empty, so merge_shards can tell "done, nothing decoded" from "not run"
+            write_shard(shard_path(embed_dir, filename), hashes, paths, locations)
+            progress.mark_file(filename)
+        source.release(state["path"])
+        held_bytes -= files[filename]
+        metrics.set("hashing.held_bytes", held_bytes)
+        metrics.inc("hashing.shards")
+        completed.append(filename)
+        file_bar.update(1)
+
+    def start_shard(filename, local_path):
+        num_row_groups = pq.ParquetFile(local_path).num_row_groups
+        done = progress.done_row_groups(filename)
+        todo = [rg for rg in range(num_row_groups) if rg not in done]
+        active[filename] = {"path": local_path, "num_row_groups": num_row_groups, "remaining": len(todo)}
+        if done:
+            tqdm.write(f"Resuming {filename}: {len(done)}/{num_row_groups} row groups already hashed.")
+        for rg in todo:
+            future = process_pool.submit(hash_fn, (local_path, [rg], *hash_args))
+            rg_futures[future] = (filename, rg, time.perf_counter())
+        if not todo:
+            finish_shard(filename)
+
+    file_bar = tqdm(total=len(files), desc="Files")
+    with ThreadPoolExecutor(max_workers=max(1, prefetch)) as fetch_pool, \
+         ProcessPoolExecutor(max_workers=workers) as process_pool:
+        while pending or fetching or ready or active:
+            while can_fetch():
+                filename = pending.popleft()
+                held_bytes += files[filename]
+                fetching[fetch_pool.submit(timed_fetch, filename)] = filename
+                metrics.set("hashing.held_bytes", held_bytes)
+
+            while ready and len(active) < concurrent_shards:
+                filename, local_path = ready.popleft()
+                try:
+                    start_shard(filename, local_path)
+                except Exception as e:
+                    tqdm.write(f"Error reading {filename}: {e}")
+                    active.pop(filename, None)
+                    source.release(local_path)
+                    held_bytes -= files[filename]
+                    file_bar.update(1)
+
+            if not fetching and not rg_futures:
+                continue
+
+            done, _ = wait(list(fetching) + list(rg_futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetching:
+                    filename = fetching.pop(future)
+                    try:
+                        ready.append((filename, future.result()))
+                    except Exception as e:
+                        tqdm.write(f"Error fetching {filename}: {e}")
+                        held_bytes -= files[filename]
+                        file_bar.update(1)
+                    continue
+
+                filename, rg, submitted = rg_futures.pop(future)
+                state = active[filename]
+                # Queue wait + hashing in the pool, as seen from the scheduler
+                metrics.observe("hashing.row_group_seconds", time.perf_counter() - submitted)
+                try:
+                    hashes, paths, locations, num_failed = future.result()
+                    progress.mark_row_group(filename, rg, hashes, paths, locations)
+                    metrics.inc("hashing.row_groups")
+                    metrics.inc("hashing.images", len(hashes))
+                    metrics.inc("hashing.failed_images", num_failed)
+                    if num_failed:
+                        tqdm.write(f"  {num_failed} images in {filename} (row group {rg}) could not be decoded.")
+                except Exception as e:
+                    # The row group stays unmarked and is retried on the next run
+                    tqdm.write(f"Error hashing {filename} row group {rg}: {e}")
+                    state["failed"] = True
+                state["remaining"] -= 1
+                if state["remaining"] == 0:
+                    if state.get("failed"):
+                        active.pop(filename)
+                        source.release(state["path"])
+                        held_bytes -= files[filename]
+                        file_bar.update(1)
+                    else:
+                        finish_shard(filename)
+    file_bar.close()
+    return completed
@@ -0,0 +1,36 @@
+import os
+import zlib
+
+def shard_of(name, num_shards):
+    """Stable shard of a file name or sample id (crc32, identical on every machine and run)."""
+    return zlib.crc32(name.encode("utf-8")) % num_shards
+
+def row_key(example, idx):
+    """Shard key of a dataset row: its path (or file_name) column, else its row index."""
+    for column in ("path", "file_name"):
+        if example.get(column):
+            return str(example[column])
+    return str(idx)
+
+def select_shard(items, shard_index, num_shards, key=str):
+    """Items whose key(item) falls in shard_index; everything when num_shards == 1."""
+    if num_shards <= 1:
+        return list(items)
+    return [item for item in items if shard_of(key(item), num_shards) == shard_index]
+
+def shard_suffix(shard_index, num_shards):
+    """'-00003-of-00008' for a sharded run, '' otherwise (same naming as the layout manifests)."""
+    return f"-{shard_index:05d}-of-{num_shards:05d}" if num_shards > 1 else ""
+
+def sharded_path(path, shard_index, num_shards):
+    """progress.json -> progress-00003-of-00008.json"""
+    root, ext = os.path.splitext(path)
+    return f"{root}{shard_suffix(shard_index, num_shards)}{ext}"
+
+def add_shard_args(parser, what="inputs"):
+    parser.add_argument("--shard-index", type=int, default=0, help=f"Shard of the {what} to process")
+    parser.add_argument("--num-shards", type=int, default=1, help=f"Number of machines splitting the {what}")
+
+def check_shard_args(args):
+    if args.num_shards < 1 or not 0 <= args.shard_index < args.num_shards:
+        raise SystemExit(f"--shard-index must be in [0, {args.num_shards}), got {args.shard_index}")
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import atexit
+import cProfile
+import pstats
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds (upper bounds), Prometheus style; +Inf is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def metric_key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+def format_labels(label_items):
+    if not label_items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in label_items) + "}"
+
+def prometheus_name(name):
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-quantile (max for the overflow bucket)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+class Metrics:
+    """
+    Process-wide counters, gauges and latency histograms, with named stage
+    timers. Thread-safe. Optionally exports periodically to a JSON lines file
+    (one snapshot per line) and/or a Prometheus textfile, and captures a
+    cProfile per stage for the stages listed in profile_stages (one profiler
+    per stage and thread, merged when dumped).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+        self.jsonl_path = None
+        self.prometheus_path = None
+        self.profile_stages = set()
+        self.profile_dir = None
+        self.profiles = {}  # stage -> {thread id: cProfile.Profile}
+        self._unprofiled = set()
+        self._partial = set()
+        self._exporter = None
+        self._stop = threading.Event()
+
+    # --- Recording ---
+    def inc(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[metric_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    @contextmanager
+    def stage(self, name, profile=True, **labels):
+        """
+        Times the block into the '<name>_seconds' histogram (profiled if enabled for this stage).
+        cProfile only describes synchronous code: a block that awaits lets other
+        tasks run inside it, whose work would be charged to this stage, and
+        concurrent tasks would fight over the one profiler. Such stages pass
+        profile=False and are only timed. Stages run from worker threads get a
+        profiler per thread, so every call is counted.
+        """
+        profiler = None
+        if name in self.profile_stages and not profile:
+            with self.lock:
+                warn = name not in self._unprofiled
+                self._unprofiled.add(name)
+            if warn:
+                print(f"[metrics] Stage {name} spans awaits and is not profiled (timing only).")
+        elif name in self.profile_stages:
+            with self.lock:
+                profiler = self.profiles.setdefault(name, {}).setdefault(threading.get_ident(), cProfile.Profile())
+        start = time.perf_counter()
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one active profiler per process; time only
+                profiler = None
+                with self.lock:
+                    warn = name not in self._partial
+                    self._partial.add(name)
+                if warn:
+                    print(f"[metrics] Stage {name} ran while another profiler was active; "
+                          f"its profile only covers the calls that ran alone.")
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    # --- Export ---
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_s": time.time() - self.started,
+                "counters": {name + format_labels(lbl): v for (name, lbl), v in self.counters.items()},
+                "gauges": {name + format_labels(lbl): v for (name, lbl), v in self.gauges.items()},
+                "histograms": {name + format_labels(lbl): h.summary() for (name, lbl), h in self.histograms.items()},
+            }
+
+    def export_jsonl(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+    def export_prometheus(self, path):
+        """Writes the Prometheus text format atomically (for node_exporter's textfile collector)."""
+        lines = []
+        with self.lock:
+            for (name, lbl), v in sorted(self.counters.items()):
+                lines.append(f"{prometheus_name(name)}_total{format_labels(lbl)} {v}")
+            for (name, lbl), v in sorted(self.gauges.items()):
+                lines.append(f"{prometheus_name(name)}{format_labels(lbl)} {v}")
+            for (name, lbl), h in sorted(self.histograms.items()):
+                metric = prometheus_name(name)
+                cumulative = 0
+                for bound, c in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += c
+                    lines.append(f"{metric}_bucket{format_labels(lbl + (('le', bound),))} {cumulative}")
+                lines.append(f"{metric}_sum{format_labels(lbl)} {h.sum}")
+                lines.append(f"{metric}_count{format_labels(lbl)} {h.count}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def dump_profiles(self):
+        """Writes <profile_dir>/<stage>.prof (open with pstats or snakeviz). Only at exit: it stops the profilers."""
+        with self.lock:
+            profiles = {name: list(by_thread.values()) for name, by_thread in self.profiles.items()}
+        if not self.profile_dir or not profiles:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        for name, profilers in profiles.items():
+            stats = None
+            for profiler in profilers:
+                try:
+                    stats = pstats.Stats(profiler) if stats is None else stats.add(profiler)
+                except TypeError:
+                    # Never ran with the profiler enabled on this thread
+                    continue
+            if stats is not None:
+                stats.dump_stats(os.path.join(self.profile_dir, f"{prometheus_name(name)}.prof"))
+
+    def flush(self):
+        if self.jsonl_path:
+            self.export_jsonl(self.jsonl_path)
+        if self.prometheus_path:
+            self.export_prometheus(self.prometheus_path)
+
+    def _export_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[metrics] Export failed: {e}")
+
+    def configure(self, jsonl_path=None, prometheus_path=None, interval=30.0, profile_stages=(), profile_dir=None):
+        """Enables export (periodic and at exit) and per-stage profiling."""
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.profile_stages = set(profile_stages or ())
+        self.profile_dir = profile_dir or ("profiles" if self.profile_stages else None)
+        if (jsonl_path or prometheus_path) and interval and self._exporter is None:
+            self._exporter = threading.Thread(target=self._export_loop, args=(interval,), daemon=True)
+            self._exporter.start()
+        if jsonl_path or prometheus_path or self.profile_stages:
+            atexit.register(self.close)
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self.flush()
+        self.dump_profiles()
+
+    def print_summary(self, prefix=""):
+        """Compact table of counters and stage latencies."""
+        snap = self.snapshot()
+        names = [k for k in snap["histograms"] if k.startswith(prefix)]
+        counters = [k for k in snap["counters"] if k.startswith(prefix)]
+        if not names and not counters:
+            return
+        print("\n" + "=" * 92)
+        print(f"{'Stage':<44} | {'count':>7} | {'total s':>9} | {'mean ms':>8} | {'p95 ms':>8}")
+        print("-" * 92)
+        for name in sorted(names):
+            h = snap["histograms"][name]
+            print(f"{name:<44} | {h['count']:>7} | {h['sum']:>9.1f} | {h['mean'] * 1000:>8.1f} | {h['p95'] * 1000:>8.1f}")
+        for name in sorted(counters):
+            print(f"{name:<44} | {snap['counters'][name]:>7}")
+        print("=" * 92)
+
+# Process-wide instance used by the pipeline modules
+metrics = Metrics()
+
+def add_metrics_args(parser):
+    """Adds the shared --metrics-* / --profile-* flags to a script's parser."""
+    group = parser.add_argument_group("metrics")
+    group.add_argument("--metrics-jsonl", type=str, default=None, help="Append metric snapshots to this JSON lines file")
+    group.add_argument("--metrics-prom", type=str, default=None, help="Write a Prometheus textfile here")
+    group.add_argument("--metrics-interval", type=float, default=30.0, help="Seconds between metric exports")
+    group.add_argument("--profile-stages", nargs="*", default=[],
+                       help="Stages to capture with cProfile (synchronous stages only; async waits are just timed)")
+    group.add_argument("--profile-dir", type=str, default="profiles", help="Where per-stage .prof files go")
+
+def tagged_path(path, tag):
+    """metrics.prom + worker0 -> metrics-worker0.prom"""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{tag}{ext}"
+
+def configure_from_args(args, tag=None):
+    """Configures the process-wide metrics from add_metrics_args flags; tag separates worker processes."""
+    def path_for(path):
+        return tagged_path(path, tag) if path and tag else path
+    metrics.configure(
+        jsonl_path=path_for(args.metrics_jsonl),
+        prometheus_path=path_for(args.metrics_prom),
+        interval=args.metrics_interval,
+        profile_stages=args.profile_stages,
+        profile_dir=os.path.join(args.profile_dir, tag) if tag else args.profile_dir,
+    )
@@ -0,0 +1,109 @@
+import io
+import os
+import numpy as np
+import cv2
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image
+
+WORDS = ["Cho", "hàm", "số", "tính", "đạo", "giá", "trị", "của", "biểu", "thức", "tam", "giác", "đường", "tròn"]
+
+def synthetic_page(width=1240, height=1754, num_figures=2, seed=0):
+    """
+    A white document page (BGR uint8) with text-like lines and gray figure
+    regions. Returns (page, figure boxes as [x1, y1, x2, y2]).
+    """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    margin = width // 12
+    line_h = max(12, height // 60)
+
+    boxes = []
+    for _ in range(num_figures):
+        w = int(rng.integers(width // 6, width // 2))
+        h = int(rng.integers(height // 12, height // 5))
+        x1 = int(rng.integers(margin, width - margin - w))
+        y1 = int(rng.integers(margin, height - margin - h))
+        cv2.rectangle(page, (x1, y1), (x1 + w, y1 + h), (200, 200, 200), -1)
+        cv2.circle(page, (x1 + w // 2, y1 + h // 2), min(w, h) // 3, (60, 60, 60), 2)
+        boxes.append([x1, y1, x1 + w, y1 + h])
+
+    y = margin
+    while y < height - margin:
+        x = margin
+        while x < width - margin:
+            word_w = int(rng.integers(line_h, line_h * 5))
+            cv2.rectangle(page, (x, y), (min(x + word_w, width - margin), y + line_h // 2), (30, 30, 30), -1)
+            x += word_w + line_h // 2
+        y += line_h
+    for x1, y1, x2, y2 in boxes:
+        page[y1:y2, x1:x2] = 220
+    return page, boxes
+
+def encode_page(page, fmt="JPEG", quality=90):
+    """Encodes a BGR page to image bytes."""
+    buffer = io.BytesIO()
+    Image.fromarray(cv2.cvtColor(page, cv2.COLOR_BGR2RGB)).save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+def synthetic_yolo_labels(num_boxes=20, seed=0, num_classes=25):
+    """label_raw text with num_boxes normalized YOLO boxes."""
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(num_boxes):
+        w, h = rng.uniform(0.05, 0.6), rng.uniform(0.01, 0.2)
+        x_c, y_c = rng.uniform(w / 2, 1 - w / 2), rng.uniform(h / 2, 1 - h / 2)
+        lines.append(f"{int(rng.integers(num_classes))} {x_c:.6f} {y_c:.6f} {w:.6f} {h:.6f}")
+    return "\n".join(lines)
+
+def synthetic_response(num_paragraphs=20, num_figures=2, seed=0):
+    """A Gemini-style answer: <thinking> block plus an AssessmentMarkupLanguage document with graphic tags."""
+    rng = np.random.default_rng(seed)
+
+    def sentence():
+        words = rng.choice(WORDS, size=int(rng.integers(6, 20)))
+        text = " ".join(words)
+        if rng.random() < 0.3:
+            text += r" \(x^2 + \frac{a}{b} = \sqrt{c}\)"
+        return text
+
+    paragraphs = ["<|ln|>".join(sentence() for _ in range(int(rng.integers(1, 4)))) for _ in range(num_paragraphs)]
+    for i in range(num_figures):
+        pos = int(rng.integers(0, len(paragraphs) + 1))
+        paragraphs.insert(pos, f'<graphic tag="IM{i + 1}" label="Hình {i + 1}" describe="Đồ thị hàm số"/>')
+    thinking = "\n".join(f"- Bước {i + 1}: {sentence()}" for i in range(max(1, num_paragraphs // 4)))
+    document = "<|pn|>".join(paragraphs)
+    return f"<thinking>\n{thinking}\n</thinking>\n\n<AssessmentMarkupLanguage>\n{document}\n</AssessmentMarkupLanguage>"
+
+def write_synthetic_images(out_dir, num_images=32, width=1240, height=1754, fmt="JPEG", seed=0):
+    """Writes synthetic pages to out_dir. Returns their relative paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    ext = ".jpg" if fmt == "JPEG" else f".{fmt.lower()}"
+    rel_paths = []
+    for i in range(num_images):
+        page, _ = synthetic_page(width, height, seed=seed + i)
+        rel_path = f"doc_{i // 8}_page_{i % 8}{ext}"
+        with open(os.path.join(out_dir, rel_path), "wb") as f:
+            f.write(encode_page(page, fmt))
+        rel_paths.append(rel_path)
+    return rel_paths
+
+def write_synthetic_parquet(path, num_rows=64, width=1240, height=1754, fmt="JPEG", row_group_size=32, seed=0):
+    """
+    Writes a parquet shard in the HF image dataset layout:
+    image struct<bytes, path>, path, label_raw.
+    Pages are generated once per 8 rows and reused to keep generation cheap.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    ext = ".jpg" if fmt == "JPEG" else f".{fmt.lower()}"
+    encoded = [encode_page(synthetic_page(width, height, seed=seed + i)[0], fmt) for i in range(min(8, num_rows))]
+    rows = []
+    for i in range(num_rows):
+        rel_path = f"doc_{i // 8}/page_{i % 8}{ext}"
+        rows.append({
+            "image": {"bytes": encoded[i % len(encoded)], "path": rel_path},
+            "path": rel_path,
+            "label_raw": synthetic_yolo_labels(int(np.random.default_rng(seed + i).integers(0, 30)), seed=seed + i),
+        })
+    pq.write_table(pa.Table.from_pylist(rows), path, row_group_size=row_group_size)
+    return path
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from src.data.scripts.batch_phash import (
+    phash_batch, phash_image, phash_thumbnail, hashes_to_hex, pack_bits, unpack_bits
+)
+
+imagehash = pytest.importorskip("imagehash")
+
+def synthetic_pages():
+    """Noise, gradients, a text-like page, a flat page and a non-square photo-like page."""
+    rng = np.random.default_rng(0)
+    pages = [Image.fromarray(rng.integers(0, 256, (120, 90, 3), dtype=np.uint8))]
+    gradient = np.tile(np.linspace(0, 255, 200, dtype=np.uint8), (150, 1))
+    pages.append(Image.fromarray(gradient))
+    pages.append(Image.fromarray(gradient.T.copy()).convert("RGB"))
+    page = Image.new("RGB", (210, 297), "white")
+    draw = ImageDraw.Draw(page)
+    for y in range(20, 280, 14):
+        draw.rectangle([20, y, 20 + int(rng.integers(60, 170)), y + 6], fill="black")
+    pages.append(page)
+    pages.append(Image.new("L", (64, 64), 200))
+    blobs = rng.normal(128, 60, (48, 160)).clip(0, 255).astype(np.uint8)
+    pages.append(Image.fromarray(blobs).resize((320, 96)))
+    return pages
+
+def test_phash_batch_matches_imagehash():
+    pages = synthetic_pages()
+    expected = [str(imagehash.phash(p)) for p in pages]
+    hashes = phash_batch(np.stack([phash_thumbnail(p) for p in pages]))
+    assert hashes_to_hex(hashes) == expected
+    assert [hashes_to_hex([phash_image(p)])[0] for p in pages] == expected
+
+def test_highfreq_factor_matches_imagehash():
+    pages = synthetic_pages()
+    expected = [str(imagehash.phash(p, highfreq_factor=2)) for p in pages]
+    assert [hashes_to_hex([phash_image(p, highfreq_factor=2)])[0] for p in pages] == expected
+
+def test_thumbnail_size_follows_hash_size():
+    assert phash_thumbnail(synthetic_pages()[0], hash_size=8, highfreq_factor=2).shape == (16, 16)
+
+def test_unsupported_hash_size_is_rejected():
+    with pytest.raises(ValueError):
+        phash_image(synthetic_pages()[0], hash_size=16)
+
+def test_pack_unpack_roundtrip():
+    bits = np.random.default_rng(1).integers(0, 2, (5, 64)).astype(bool)
+    np.testing.assert_array_equal(unpack_bits(pack_bits(bits)).astype(bool), bits)
@@ -0,0 +1,25 @@
+import asyncio
+from src.data.labelling.dedup import Deduplicator, LabelledPage
+
+USAGE = {"model": "gemini-3-flash-preview", "input": 1_000_000, "output": 1_000_000, "thinking": 0}
+
+def test_reuse_cost_honours_price_overrides():
+    default = Deduplicator("reuse")
+    default.record_reuse({"usage": USAGE})
+    assert default.stats["cost_avoided_usd"] == 3.5
+    overridden = Deduplicator("reuse", price_input=1.0, price_output=2.0)
+    overridden.record_reuse({"usage": USAGE})
+    assert overridden.stats["cost_avoided_usd"] == 3.0
+
+def test_failed_page_is_not_matched_again():
+    async def run():
+        dedup = Deduplicator("reuse", radius=2)
+        page = dedup.add(0b1011, LabelledPage("a.webp", 0, future=asyncio.get_running_loop().create_future()))
+        assert dedup.match(0b1010, 0)[0] is page
+        waiting = asyncio.ensure_future(dedup.source_record(page))
+        dedup.mark_failed(page)
+        assert await waiting is None
+        # Later near-duplicates go straight to labelling
+        assert dedup.match(0b1010, 0) == (None, None)
+        assert dedup.stats["unique"] == 1
+    asyncio.run(run())
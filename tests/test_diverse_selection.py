@@ -0,0 +1,27 @@
+import numpy as np
+from src.data.scripts.diverse_selection import farthest_point_sampling, stratified_selection
+
+def test_fps_returns_unique_indices_when_only_duplicates_remain():
+    hashes = np.array([1, 1, 1, 2, 2, 3, 3, 3, 3, 3], dtype=np.uint64)
+    selected = farthest_point_sampling(hashes, 8)
+    assert len(selected) == 8
+    assert len(set(selected.tolist())) == 8
+    # Every distinct hash is covered before duplicates are drawn
+    assert set(hashes[selected[:3]].tolist()) == {1, 2, 3}
+
+def test_fps_selects_everything_when_n_exceeds_pool():
+    hashes = np.array([5, 5, 9], dtype=np.uint64)
+    assert sorted(farthest_point_sampling(hashes, 10).tolist()) == [0, 1, 2]
+
+def test_fps_random_hashes_unique():
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2**63, size=300, dtype=np.int64).astype(np.uint64)
+    selected = farthest_point_sampling(hashes, 200, pool_size=250)
+    assert len(set(selected.tolist())) == 200
+
+def test_empty_input_or_zero_n_selects_nothing():
+    empty = np.zeros(0, dtype=np.uint64)
+    for selected in (farthest_point_sampling(empty, 5), farthest_point_sampling(empty, 5, pool_size=10),
+                     farthest_point_sampling(np.array([1, 2], dtype=np.uint64), 0),
+                     stratified_selection(np.zeros(0, dtype=np.int64), 5)):
+        assert len(selected) == 0 and selected.dtype.kind == "i"
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from src.data.scripts.hamming_index import MultiIndexHash, hamming_distance
+
+def brute_force_clusters(hashes, max_distance):
+    dist = hamming_distance(hashes[:, None], hashes[None, :])
+    i, j = np.nonzero(dist <= max_distance)
+    graph = coo_matrix((np.ones(len(i)), (i, j)), shape=(len(hashes), len(hashes)))
+    return connected_components(graph, directed=False)[1]
+
+def same_partition(a, b):
+    """True if two labellings group the items identically (label values may differ)."""
+    pairs = set(zip(a.tolist(), b.tolist()))
+    return len(pairs) == len(set(a.tolist())) == len(set(b.tolist()))
+
+def flip_bits(rng, hashes, max_flips):
+    out = hashes.copy()
+    for n in range(len(out)):
+        for bit in rng.choice(64, size=rng.integers(0, max_flips + 1), replace=False):
+            out[n] ^= np.uint64(1) << np.uint64(bit)
+    return out
+
+def random_set(rng, shared_prefix_bits=0):
+    """Random hashes plus near duplicates of some of them (and a few exact duplicates)."""
+    base = rng.integers(0, 2**63, size=150, dtype=np.int64).astype(np.uint64)
+    if shared_prefix_bits:
+        # Near-blank pages: all hashes agree on their top bits, so one chunk key is shared
+        base &= np.uint64((1 << (64 - shared_prefix_bits)) - 1)
+    near = flip_bits(rng, base[rng.choice(len(base), size=150)], 4)
+    if shared_prefix_bits:
+        near &= np.uint64((1 << (64 - shared_prefix_bits)) - 1)
+    return np.concatenate([base, near, base[:10]])
+
+@pytest.mark.parametrize("max_distance", [0, 2, 4])
+@pytest.mark.parametrize("shared_prefix_bits", [0, 16, 40])
+def test_clusters_match_brute_force(max_distance, shared_prefix_bits):
+    rng = np.random.default_rng(max_distance * 100 + shared_prefix_bits)
+    hashes = random_set(rng, shared_prefix_bits)
+    labels = MultiIndexHash(hashes, max_distance).clusters()
+    assert same_partition(labels, brute_force_clusters(hashes, max_distance))
+
+def test_unique_pairs_are_close_and_complete():
+    rng = np.random.default_rng(7)
+    hashes = random_set(rng, shared_prefix_bits=16)
+    index = MultiIndexHash(hashes, 3)
+    i, j = index.unique_pairs()
+    found = {(min(a, b), max(a, b)) for a, b in zip(i.tolist(), j.tolist())}
+    u = index.unique_hashes
+    dist = hamming_distance(u[:, None], u[None, :])
+    expected = {(a, b) for a, b in zip(*np.nonzero(np.triu(dist <= 3, k=1)))}
+    assert found == expected
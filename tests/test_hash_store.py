@@ -0,0 +1,79 @@
+import os
+import numpy as np
+from src.data.scripts.batch_phash import unpack_bits
+from src.data.scripts.hash_store import (
+    write_store, write_shard, read_shard, shard_path, consolidate, stale_shards, HashStore, NO_LOCATION, LOCAL_SHARD
+)
+
+def test_store_roundtrip(tmp_path):
+    hashes = np.array([0, 1, 2**63, 2**64 - 1], dtype=np.uint64)
+    paths = ["a/1.webp", "a/2.webp", "bài-giảng/3.webp", ""]
+    shard_ids = [0, 0, 1, 1]
+    locations = [(0, 0), (0, 1), (2, 5), (3, 0)]
+    out = str(tmp_path / "hashes.store")
+    write_store(out, hashes, shard_ids, paths, ["x.parquet", "y.parquet"], locations)
+
+    store = HashStore(out)
+    assert len(store) == 4
+    np.testing.assert_array_equal(store.hashes, hashes)
+    assert store.get_paths(range(4)) == paths
+    assert [store.get_shard(i) for i in range(4)] == ["x.parquet", "x.parquet", "y.parquet", "y.parquet"]
+    np.testing.assert_array_equal(store.row_groups, [0, 0, 2, 3])
+    np.testing.assert_array_equal(store.row_offsets, [0, 1, 5, 0])
+    np.testing.assert_array_equal(store.records()["path"], np.arange(4))
+
+def test_empty_store(tmp_path):
+    out = str(tmp_path / "hashes.store")
+    write_store(out, np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint32), [], [])
+    store = HashStore(out)
+    assert len(store) == 0 and store.shards == []
+    assert len(store.records()) == 0
+
+def test_consolidate_reads_legacy_and_empty_shards(tmp_path):
+    shard_dir = tmp_path / "embeddings"
+    (shard_dir / "data").mkdir(parents=True)
+    # Legacy format: (N, 64) float32 bit 'embeddings', compressed, no locations
+    legacy_hashes = np.array([5, 2**60 + 3], dtype=np.uint64)
+    np.savez_compressed(shard_path(str(shard_dir), "data/a.parquet"),
+                        embeddings=unpack_bits(legacy_hashes).astype(np.float32),
+                        paths=np.array(["a/0.webp", "a/1.webp"]))
+    write_shard(shard_path(str(shard_dir), "data/b.parquet"), [7], ["b/0.webp"], [(1, 2)])
+    write_shard(shard_path(str(shard_dir), "data/c.parquet"), [], [])
+    # Local image shards are not part of the parquet store
+    write_shard(str(shard_dir / f"{LOCAL_SHARD}.npz"), [9], ["page.png"])
+
+    hashes, paths, locations = read_shard(shard_path(str(shard_dir), "data/a.parquet"))
+    np.testing.assert_array_equal(hashes, legacy_hashes)
+    assert (locations == NO_LOCATION).all()
+    assert read_shard(shard_path(str(shard_dir), "data/c.parquet"))[1] == []
+
+    store = HashStore(consolidate(str(shard_dir)))
+    assert store.shards == ["data/a.parquet", "data/b.parquet", "data/c.parquet"]
+    np.testing.assert_array_equal(store.hashes, [5, 2**60 + 3, 7])
+    assert store.get_paths(range(3)) == ["a/0.webp", "a/1.webp", "b/0.webp"]
+    np.testing.assert_array_equal(store.row_groups, [NO_LOCATION, NO_LOCATION, 1])
+    np.testing.assert_array_equal(store.row_offsets, [NO_LOCATION, NO_LOCATION, 2])
+
+def test_stale_shards_reports_new_and_rewritten_shards(tmp_path):
+    shard_dir = tmp_path / "embeddings"
+    (shard_dir / "data").mkdir(parents=True)
+    store_path = str(tmp_path / "hashes.store")
+    write_shard(shard_path(str(shard_dir), "data/a.parquet"), [1], ["a/0.webp"], [(0, 0)])
+    assert stale_shards(str(shard_dir), store_path) == ["data/a.parquet"]
+
+    consolidate(str(shard_dir))
+    built = os.stat(store_path).st_mtime_ns
+    assert stale_shards(str(shard_dir), store_path) == []
+    # A store merged elsewhere has no shard directory next to it
+    assert stale_shards(str(tmp_path / "missing"), store_path) == []
+
+    write_shard(shard_path(str(shard_dir), "data/b.parquet"), [2], ["b/0.webp"], [(0, 0)])
+    b_path = shard_path(str(shard_dir), "data/b.parquet")
+    os.utime(b_path, ns=(built - 10**9, built - 10**9))
+    assert stale_shards(str(shard_dir), store_path) == ["data/b.parquet"]
+
+    consolidate(str(shard_dir))
+    built = os.stat(store_path).st_mtime_ns
+    a_path = shard_path(str(shard_dir), "data/a.parquet")
+    os.utime(a_path, ns=(built + 10**9, built + 10**9))
+    assert stale_shards(str(shard_dir), store_path) == ["data/a.parquet"]
@@ -0,0 +1,73 @@
+import json
+import asyncio
+import argparse
+import numpy as np
+from PIL import Image
+from src.data.labelling import processor
+from src.data.scripts.hash_store import write_shard, shard_path, HashStore, STORE_NAME
+from src.data.scripts.merge_shards import merge_hashes, merge_labels
+from src.data.scripts.sharding import row_key, shard_of, sharded_path
+
+def write_run(output_dir, shard, num_shards, parquets):
+    """One generate_embeddings shard: per-parquet npz files and its progress file."""
+    for name, hashes in parquets.items():
+        paths = [f"{name}/{i}.webp" for i in range(len(hashes))]
+        locations = [(0, i) for i in range(len(hashes))]
+        write_shard(shard_path(output_dir / "embeddings", name), hashes, paths, locations)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    progress = output_dir / f"progress-{shard:05d}-of-{num_shards:05d}.json"
+    progress.write_text(json.dumps({"processed_files": sorted(parquets), "row_groups": {}}))
+
+def merge_args(inputs, output):
+    return argparse.Namespace(inputs=[str(p) for p in inputs], output=str(output),
+                              parquet_dir=None, repo=None, force=False)
+
+def test_merge_accepts_parquet_with_no_decodable_images(tmp_path):
+    write_run(tmp_path / "a", 0, 2, {"data/train-0.parquet": [1, 2, 3]})
+    # Every image of this parquet failed to decode: an empty shard, not a missing one
+    write_run(tmp_path / "b", 1, 2, {"data/train-1.parquet": []})
+    assert merge_hashes(merge_args([tmp_path / "a", tmp_path / "b"], tmp_path / "out")) == 0
+    store = HashStore(str(tmp_path / "out" / STORE_NAME))
+    np.testing.assert_array_equal(store.hashes, np.array([1, 2, 3], dtype=np.uint64))
+
+def test_merge_fails_on_parquet_that_was_not_run(tmp_path):
+    write_run(tmp_path / "a", 0, 2, {"data/train-0.parquet": [1, 2, 3]})
+    write_run(tmp_path / "b", 1, 2, {})
+    progress = tmp_path / "b" / "progress-00001-of-00002.json"
+    progress.write_text(json.dumps({"processed_files": [], "row_groups": {"data/train-1.parquet": [0]}}))
+    assert merge_hashes(merge_args([tmp_path / "a", tmp_path / "b"], tmp_path / "out")) == 1
+
+def test_row_key_prefers_path_then_file_name_then_index():
+    assert row_key({"path": "a.webp", "file_name": "b.webp"}, 3) == "a.webp"
+    assert row_key({"file_name": "b.webp"}, 3) == "b.webp"
+    assert row_key({"image": None}, 3) == "3"
+
+def label_shards(tmp_path, monkeypatch, rows, num_shards):
+    """Runs processor.process_dataset on every shard (API call stubbed) and saves each shard's results."""
+    async def fake_label_image(target_img, prompt, prompt_type, tag_to_bbox, W, H, route=None):
+        return "thinking", f"{prompt_type} page", None
+    monkeypatch.setattr(processor, "label_image", fake_label_image)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "output_dev" / "draw_boxes").mkdir(parents=True)
+    outputs = []
+    for shard in range(num_shards):
+        results = asyncio.run(processor.process_dataset(rows, shard_index=shard, num_shards=num_shards))
+        outputs.append(sharded_path(str(tmp_path / "processed.jsonl"), shard, num_shards))
+        processor.save_results(results, outputs[-1])
+    return outputs
+
+def test_processor_shards_merge_and_missing_shard_fails(tmp_path, monkeypatch):
+    names = [f"doc_page_{i}.webp" for i in range(8)]
+    rows = [{"path": name, "image": Image.new("RGB", (40, 60), "white"), "label_raw": ""} for name in names]
+    outputs = label_shards(tmp_path, monkeypatch, rows, 2)
+    records = [json.loads(line) for path in outputs for line in open(path, encoding="utf-8")]
+    # One page without objects per shard, each in the shard its path hashes to
+    assert len(records) == 2
+    assert [shard_of(r["name"], 2) for r in records] == [0, 1]
+    assert "image" not in records[0]
+
+    args = argparse.Namespace(inputs=[outputs[0]], output=str(tmp_path / "merged.jsonl"), image_dir=None, force=False)
+    assert merge_labels(args) == 1
+    args.inputs = outputs
+    assert merge_labels(args) == 0
+    assert len((tmp_path / "merged.jsonl").read_text().splitlines()) == 2
@@ -0,0 +1,45 @@
+import shutil
+import numpy as np
+from PIL import Image
+from src.data.scripts.page_cache import PageCache
+
+def make_page(path, seed=0, size=(64, 48)):
+    rng = np.random.default_rng(seed)
+    Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(path)
+    return path
+
+def half(orig_size):
+    return orig_size[0] // 2, orig_size[1] // 2
+
+def test_renamed_page_hits_fixed_and_callable_size(tmp_path):
+    page = make_page(tmp_path / "a.png")
+    cache = PageCache(tmp_path / "cache")
+    first, orig = cache.load(page, size=(16, 12))
+    cache.load(page, size=half)
+    assert orig == (64, 48) and cache.misses == 2
+
+    copy = tmp_path / "renamed.png"
+    shutil.copy(page, copy)
+    # A fresh instance (another process or machine sharing the directory)
+    other = PageCache(tmp_path / "cache")
+    again, orig_again = other.load(copy, size=(16, 12))
+    other.load(copy, size=half)
+    assert (other.hits, other.misses) == (2, 0)
+    assert orig_again == (64, 48)
+    np.testing.assert_array_equal(first, again)
+
+def test_fixed_size_hit_without_recorded_original_size(tmp_path):
+    page = make_page(tmp_path / "a.png")
+    cache = PageCache(tmp_path / "cache")
+    cache.load(page, size=(16, 12))
+    cache.conn.execute("DELETE FROM originals")
+    _, orig = cache.load(page, size=(16, 12))
+    assert cache.hits == 1 and orig == (64, 48)
+
+def test_eviction_keeps_the_budget(tmp_path):
+    cache = PageCache(tmp_path / "cache", max_bytes=40_000)
+    for i in range(10):
+        cache.load(make_page(tmp_path / f"{i}.png", seed=i))
+    stats = cache.stats()
+    assert 0 < stats["bytes"] <= 40_000
+    assert stats["bytes"] == cache._total
@@ -0,0 +1,69 @@
+import io
+import os
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image
+from src.data.scripts.parquet_stream import ParquetStream, split_files
+
+def png_cell(i, path):
+    buf = io.BytesIO()
+    Image.new("RGB", (8 + i % 5, 6), (i % 256, 0, 0)).save(buf, format="PNG")
+    return {"bytes": buf.getvalue(), "path": path}
+
+def write_split(root, split, num_files=2, rows=10, row_group_size=3):
+    """data/<split>-0000i-of-0000n.parquet files with image, file_name and label_raw columns."""
+    os.makedirs(root / "data", exist_ok=True)
+    names = []
+    for f in range(num_files):
+        file_names = [f"{split}_{f}_{i}.png" for i in range(rows)]
+        table = pa.table({
+            "image": [png_cell(i, name) for i, name in enumerate(file_names)],
+            "file_name": file_names,
+            "label_raw": [f"{i} 0.5 0.5 0.1 0.1" for i in range(rows)],
+        })
+        pq.write_table(table, root / "data" / f"{split}-{f:05d}-of-{num_files:05d}.parquet", row_group_size=row_group_size)
+        names.extend(file_names)
+    return names
+
+def test_split_files_filters_by_split_name():
+    files = ["data/train-00000-of-00002.parquet", "data/test-00000-of-00001.parquet", "train/0001.parquet"]
+    assert split_files(files, "train") == ["data/train-00000-of-00002.parquet", "train/0001.parquet"]
+    assert split_files(files, "test") == ["data/test-00000-of-00001.parquet"]
+    # Directories without split names keep all their files
+    assert split_files(["a.parquet", "b.parquet"], "train") == ["a.parquet", "b.parquet"]
+
+def test_streams_one_split_in_order_with_decoded_images(tmp_path):
+    train = write_split(tmp_path, "train")
+    write_split(tmp_path, "test", num_files=1)
+    rows = list(ParquetStream(str(tmp_path), split="train", prefetch_row_groups=1, decode_workers=2))
+    assert [row["file_name"] for row in rows] == train
+    assert isinstance(rows[0]["image"], Image.Image)
+    assert rows[4]["image"].size == (12, 6)
+    assert rows[4]["label_raw"] == "4 0.5 0.5 0.1 0.1"
+
+def test_column_projection_and_limit(tmp_path):
+    train = write_split(tmp_path, "train")
+    rows = list(ParquetStream(str(tmp_path), columns=["file_name"], limit=7))
+    assert rows == [{"file_name": name} for name in train[:7]]
+    # Image cells are left as stored when decoding is off
+    row = next(iter(ParquetStream(str(tmp_path), columns=["image"], decode_images=False)))
+    assert set(row) == {"image"} and set(row["image"]) == {"bytes", "path"}
+
+def test_breaking_out_early_stops_the_producer(tmp_path):
+    write_split(tmp_path, "train", num_files=3, rows=30, row_group_size=2)
+    before = threading.active_count()
+    done = threading.Event()
+
+    def consume():
+        for i, row in enumerate(ParquetStream(str(tmp_path), prefetch_row_groups=1, decode_workers=2)):
+            if i == 2:
+                break
+        # The generator is closed here, which joins the producer and the decode pool
+        done.set()
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    assert done.wait(timeout=10), "breaking out of the stream hung"
+    consumer.join()
+    assert threading.active_count() == before
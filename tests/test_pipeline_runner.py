@@ -0,0 +1,118 @@
+import json
+import textwrap
+import pytest
+from src.data.scripts.pipeline_runner import load_pipeline, run_pipeline, PipelineState
+
+# Stage modules live under a src/ of the temp dir, so the runner fingerprints their code
+STAGE_MODULES = {
+    "helpers.py": """
+        def transform(text, suffix):
+            return text.upper() + suffix
+    """,
+    "write.py": """
+        import os
+        import sys
+        text, output = sys.argv[1:3]
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as f:
+            f.write(text)
+    """,
+    "upper.py": """
+        import os
+        import sys
+        from src.stages import helpers
+        source, output, suffix = sys.argv[1:4]
+        os.makedirs(output, exist_ok=True)
+        with open(source) as f:
+            text = helpers.transform(f.read(), suffix)
+        with open(os.path.join(output, "page.txt"), "w") as f:
+            f.write(text)
+    """,
+    "count.py": """
+        import os
+        import sys
+        source, output = sys.argv[1:3]
+        with open(os.path.join(source, "page.txt")) as f:
+            count = len(f.read())
+        os.makedirs(output, exist_ok=True)
+        with open(os.path.join(output, "count.txt"), "w") as f:
+            f.write(str(count))
+    """,
+}
+
+PIPELINE = {
+    "vars": {"work": "work", "text": "hello", "suffix": "!", "unit": "chars"},
+    "stages": [
+        {"name": "write", "command": "src.stages.write", "args": ["{text}", "{work}/raw.txt"],
+         "outputs": ["{work}/raw.txt"]},
+        {"name": "upper", "command": "src.stages.upper", "args": ["{work}/raw.txt", "{work}/upper", "{suffix}"],
+         "inputs": ["{work}/raw.txt"], "outputs": ["{work}/upper"], "clean": True},
+        {"name": "count", "command": "src.stages.count", "args": ["{work}/upper", "{work}/count", "{unit}"],
+         "inputs": ["{work}/upper"], "outputs": ["{work}/count"], "clean": True},
+    ],
+}
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    stages_dir = tmp_path / "src" / "stages"
+    stages_dir.mkdir(parents=True)
+    for name, source in STAGE_MODULES.items():
+        (stages_dir / name).write_text(textwrap.dedent(source))
+    (tmp_path / "pipeline.json").write_text(json.dumps(PIPELINE))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def run(project, **overrides):
+    stages = load_pipeline(str(project / "pipeline.json"), overrides)
+    state = PipelineState(str(project / "state"))
+    try:
+        results = run_pipeline(stages, state, jobs=2)
+    finally:
+        state.close()
+    return {name: result[0] for name, result in results.items()}
+
+def test_second_run_skips_every_stage(project):
+    assert run(project) == {"write": "done", "upper": "done", "count": "done"}
+    assert (project / "work" / "upper" / "page.txt").read_text() == "HELLO!"
+    assert run(project) == {"write": "skipped", "upper": "skipped", "count": "skipped"}
+
+def test_changed_args_rerun_the_stage_and_its_downstream(project):
+    run(project)
+    assert run(project, suffix="!!") == {"write": "skipped", "upper": "done", "count": "done"}
+    assert (project / "work" / "count" / "count.txt").read_text() == "7"
+    # The same override again finds everything up to date
+    assert run(project, suffix="!!") == {"write": "skipped", "upper": "skipped", "count": "skipped"}
+
+def test_unchanged_upstream_output_cuts_off_downstream(project):
+    run(project)
+    assert run(project, unit="letters") == {"write": "skipped", "upper": "skipped", "count": "done"}
+
+def test_editing_an_imported_module_invalidates_its_importers(project):
+    run(project)
+    helpers = project / "src" / "stages" / "helpers.py"
+    helpers.write_text(helpers.read_text().replace("text.upper()", "text.upper().strip()"))
+    # upper imports helpers; write does not, and count's input did not change
+    assert run(project) == {"write": "skipped", "upper": "done", "count": "skipped"}
+
+def test_clean_removes_only_the_stage_outputs(project):
+    run(project)
+    work = project / "work"
+    (work / "count" / "stale.txt").write_text("from an earlier run")
+    (work / "notes.txt").write_text("not a stage output")
+
+    assert run(project, unit="letters") == {"write": "skipped", "upper": "skipped", "count": "done"}
+    assert not (work / "count" / "stale.txt").exists()
+    assert (work / "count" / "count.txt").exists()
+    # Upstream outputs and unrelated files are left alone
+    assert (work / "upper" / "page.txt").read_text() == "HELLO!"
+    assert (work / "raw.txt").read_text() == "hello"
+    assert (work / "notes.txt").exists()
+
+def test_failed_stage_blocks_downstream_and_resumes(project):
+    run(project)
+    upper = project / "src" / "stages" / "upper.py"
+    source = upper.read_text()
+    upper.write_text(source + "\nsys.exit(3)\n")
+    assert run(project) == {"write": "skipped", "upper": "failed", "count": "blocked"}
+    upper.write_text(source)
+    assert run(project) == {"write": "skipped", "upper": "done", "count": "skipped"}
@@ -0,0 +1,104 @@
+import io
+import os
+import threading
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image
+from src.data.scripts.generate_embeddings import hash_row_groups
+from src.data.scripts.hash_store import consolidate, HashStore
+from src.data.scripts.shard_scheduler import LocalSource, ShardProgress, run_shard_scheduler
+
+ROWS_PER_GROUP = 3
+
+def write_parquet_dir(root, num_files=3, rows=7, seed=0):
+    """HF-style parquet files (image struct + path) of random pages, several row groups each."""
+    rng = np.random.default_rng(seed)
+    for f in range(num_files):
+        images, paths = [], []
+        for i in range(rows):
+            buf = io.BytesIO()
+            Image.fromarray(rng.integers(0, 256, (48, 32), dtype=np.uint8)).save(buf, format="PNG")
+            paths.append(f"doc{f}/page_{i}.png")
+            images.append({"bytes": buf.getvalue(), "path": paths[-1]})
+        table = pa.table({"image": images, "path": paths})
+        os.makedirs(root / "data", exist_ok=True)
+        pq.write_table(table, root / "data" / f"train-{f:05d}.parquet", row_group_size=ROWS_PER_GROUP)
+    return root
+
+def flaky_hash(args):
+    """hash_row_groups that fails on one (file, row group), like a worker crash or a bad download."""
+    local_path, row_groups, reduced_decode, fail_on = args
+    if fail_on and (os.path.basename(local_path), row_groups[0]) == fail_on:
+        raise RuntimeError("injected failure")
+    return hash_row_groups((local_path, row_groups, reduced_decode))
+
+class RecordingSource(LocalSource):
+    """LocalSource that records how many bytes are fetched and not yet released."""
+
+    def __init__(self, parquet_dir):
+        super().__init__(parquet_dir)
+        self.sizes = self.list_files()
+        self.lock = threading.Lock()
+        self.held = 0
+        self.max_held = 0
+        self.released = []
+
+    def fetch(self, filename):
+        with self.lock:
+            self.held += self.sizes[filename]
+            self.max_held = max(self.max_held, self.held)
+        return super().fetch(filename)
+
+    def release(self, local_path):
+        filename = os.path.relpath(local_path, self.parquet_dir).replace(os.sep, "/")
+        with self.lock:
+            self.held -= self.sizes[filename]
+            self.released.append(filename)
+
+def hash_dir(source, output_dir, fail_on=None, **kwargs):
+    """One run of the scheduler into output_dir, resuming from its progress file."""
+    progress = ShardProgress(str(output_dir / "progress.json"), str(output_dir / "partial"))
+    files = {f: size for f, size in sorted(source.list_files().items()) if not progress.is_done(f)}
+    return run_shard_scheduler(source, files, str(output_dir / "embeddings"), progress, flaky_hash,
+                               hash_args=(False, fail_on), workers=2, **kwargs)
+
+def assert_same_store(a, b):
+    np.testing.assert_array_equal(a.hashes, b.hashes)
+    assert a.shards == b.shards
+    assert a.get_paths(range(len(a))) == b.get_paths(range(len(b)))
+    np.testing.assert_array_equal(a.row_groups, b.row_groups)
+    np.testing.assert_array_equal(a.row_offsets, b.row_offsets)
+
+def test_resume_after_failed_row_group_matches_clean_run(tmp_path):
+    source = LocalSource(str(write_parquet_dir(tmp_path / "parquet")))
+    clean = tmp_path / "clean"
+    assert len(hash_dir(source, clean)) == 3
+    expected = HashStore(consolidate(str(clean / "embeddings")))
+    assert len(expected) == 21
+
+    resumed = tmp_path / "resumed"
+    completed = hash_dir(source, resumed, fail_on=("train-00001.parquet", 1))
+    assert "data/train-00001.parquet" not in completed and len(completed) == 2
+    progress = ShardProgress(str(resumed / "progress.json"), str(resumed / "partial"))
+    assert progress.done_row_groups("data/train-00001.parquet") == {0, 2}
+
+    # The re-run hashes only the missing row group of the failed file
+    assert hash_dir(source, resumed) == ["data/train-00001.parquet"]
+    assert not os.path.exists(resumed / "partial" / "data" / "train-00001")
+    assert_same_store(HashStore(consolidate(str(resumed / "embeddings"))), expected)
+
+def test_disk_budget_limits_fetched_shards(tmp_path):
+    source = RecordingSource(str(write_parquet_dir(tmp_path / "parquet", num_files=5)))
+    budget = 2 * max(source.sizes.values())
+    completed = hash_dir(source, tmp_path / "out", prefetch=4, concurrent_shards=2, disk_budget=budget)
+    assert sorted(completed) == sorted(source.sizes)
+    assert 0 < source.max_held <= budget
+    assert source.held == 0 and sorted(source.released) == sorted(source.sizes)
+
+def test_oversized_shard_still_runs(tmp_path):
+    source = RecordingSource(str(write_parquet_dir(tmp_path / "parquet", num_files=2)))
+    completed = hash_dir(source, tmp_path / "out", prefetch=2, disk_budget=1)
+    # One shard at a time is always allowed, however small the budget
+    assert sorted(completed) == sorted(source.sizes)
+    assert source.max_held == max(source.sizes.values())
@@ -0,0 +1,47 @@
+import sys
+import pstats
+import threading
+from src.data.scripts.stage_metrics import Metrics
+
+def work(n):
+    return sum(i * i for i in range(n))
+
+def test_stage_profiles_every_thread_and_merges_them(tmp_path, capsys):
+    metrics = Metrics()
+    metrics.profile_stages = {"worker.stage"}
+    metrics.profile_dir = str(tmp_path)
+    barrier = threading.Barrier(4)
+
+    def run():
+        for _ in range(5):
+            with metrics.stage("worker.stage"):
+                # Threads are inside the stage at the same time
+                barrier.wait()
+                work(1000)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert metrics.snapshot()["histograms"]["worker.stage_seconds"]["count"] == 20
+    metrics.dump_profiles()
+    stats = pstats.Stats(str(tmp_path / "worker_stage.prof")).stats
+    calls = sum(ncalls for (_, _, func), (_, ncalls, *_) in stats.items() if func == "work")
+    if sys.version_info < (3, 12):
+        assert calls == 20
+    else:
+        # One profiler at a time per process: a partial profile, reported once
+        assert 5 <= calls <= 20
+        assert capsys.readouterr().out.count("another profiler was active") == 1
+
+def test_unprofiled_stage_is_timed_only(tmp_path):
+    metrics = Metrics()
+    metrics.profile_stages = {"async.stage"}
+    metrics.profile_dir = str(tmp_path)
+    with metrics.stage("async.stage", profile=False):
+        work(10)
+    metrics.dump_profiles()
+    assert metrics.snapshot()["histograms"]["async.stage_seconds"]["count"] == 1
+    assert not (tmp_path / "async_stage.prof").exists()